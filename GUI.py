@@ -7,10 +7,12 @@ from tkinter import filedialog
 from fitter import *
 from iohandler import *
 from cmc_fitter import *
+from joint_fitter import *
 import GUI_config
 import constants
 import config
 import copy
+import functools
 import os
 import re
 import skrf as rf
@@ -18,9 +20,22 @@ from tkinter import scrolledtext
 from texthandler import *
 from lmfit import Parameters
 from collections import Counter
+from cancellation import CANCEL_EVENT, FitCancelled, check_cancelled
+from worker_pool import WorkerPool, default_pool_size, plan_batch, schedule_tasks
+import band_fitting
+import events
+import memory_profiling
+import model_reduction
+import parameter_matching
+from parameter_matrix import ParameterMatrix, main_parameter_names, circuit_parameter_names
+import profiling
 
 import multiprocessing as mp
 
+import logging.handlers
+import queue
+import threading
+
 class GUI:
     """
     The GUI is responsible for creating the user interface and dispatching tasks to the other classes, it instantiates
@@ -41,6 +56,17 @@ class GUI:
         self.iohandler = None
         self.fitter = None
         self.logger = None
+        # variables for the background run
+        self.worker_pool = None
+        self.mp_pool = None
+        self.timeouts = []
+        self.run_failed = False
+        self.run_thread = None
+        self.run_queue = queue.Queue()
+        self.run_button = None
+        self.cancel_button = None
+        self.progress_label = None
+        self.progress_stage = ""
         self.gui_layout = self.gui_layout = GUI_config.DROP_DOWN_ELEMENTS[0] # Inductor
         # variables for the file list
         self.filelist_frame = None
@@ -71,6 +97,8 @@ class GUI:
         self.create_specification_field()
         self.create_browse_button()
         self.create_run_button()
+        self.create_cancel_button()
+        self.create_progress_label()
         self.create_log_window()
         self.create_shunt_series_radio_button()
         self.create_filelist_frame()
@@ -79,6 +107,14 @@ class GUI:
         IOhandleinstance = IOhandler(self.logger)
         self.iohandler = IOhandleinstance
 
+        # start the worker pool now, so the first run does not have to wait for it
+        self.worker_pool = WorkerPool(logger_instance=self.logger)
+        self.worker_pool.get()
+        self.root.protocol("WM_DELETE_WINDOW", self.callback_close)
+
+        # show the events of the runs in the progress display
+        events.subscribe(self.on_event)
+
         self.root.mainloop()
 
     def create_drop_down(self):
@@ -190,6 +226,12 @@ class GUI:
         dmbutton.grid(column=2, row=2)
         # ocbutton.grid(column=2, row=3)
 
+        #create button for a 4-port measurement that contains all modes
+        s4plabel = tk.Label(self.filelist_frame, text='4-Port Measurement')
+        s4pbutton = tk.Button(self.filelist_frame, command=self.load_cmc_s4p_file, text= "Load")
+        s4plabel.grid(column=0, row=4, sticky="w")
+        s4pbutton.grid(column=2, row=4)
+
         #create checkmark lables
         dmchecklabel = tk.Label(self.filelist_frame, text='')
         cmchecklabel = tk.Label(self.filelist_frame, text='')
@@ -217,6 +259,23 @@ class GUI:
         except Exception as e:
             raise e
 
+    def load_cmc_s4p_file(self):
+        """
+        Method to load a 4-port measurement of a common mode choke; the configurations are derived from it (see
+        iohandler.mixed_mode_networks()) and replace the files loaded per mode
+
+        :return: None
+        """
+        filename = tk.filedialog.askopenfilename(title='Load 4-Port Measurement',
+                                                 filetypes=((".s4p", "*.s4p*"), ("all files", "*.*")), multiple=False)
+        #we need to check if the filename is not an empty string (i.e. if the user has not canceled the load)
+        if filename:
+            networks = self.iohandler.load_cmc_s4p(filename)
+            self.cmc_files.update(networks)
+            for mode in config.CMC_REQUIRED_CONFIGURATIONS:
+                self.checklables[mode].config(text = "\u2713")
+            self.selected_s2p_files = [os.path.abspath(filename)]
+
     def create_shunt_series_radio_button(self):
         """
         Method to create the radiobutton for shunt/series through calculation selection
@@ -292,9 +351,29 @@ class GUI:
 
         :return: None
         """
-        browse_button = tk.Button(self.root, command=self.callback_run, text="Run")
-        browse_button.config(font=GUI_config.ENTRY_FONT)
-        browse_button.grid(column=1, row=6, sticky=tk.W, **GUI_config.BUTTON_RIGHT_PADDING)
+        self.run_button = tk.Button(self.root, command=self.callback_run, text="Run")
+        self.run_button.config(font=GUI_config.ENTRY_FONT)
+        self.run_button.grid(column=1, row=6, sticky=tk.W, **GUI_config.BUTTON_RIGHT_PADDING)
+
+    def create_cancel_button(self):
+        """
+        Method to create the "cancel" button; it is only enabled while a fit is running
+
+        :return: None
+        """
+        self.cancel_button = tk.Button(self.root, command=self.callback_cancel, text="Cancel", state='disabled')
+        self.cancel_button.config(font=GUI_config.ENTRY_FONT)
+        self.cancel_button.grid(column=2, row=6, sticky=tk.W, **GUI_config.BUTTON_RIGHT_PADDING)
+
+    def create_progress_label(self):
+        """
+        Method to create the label that shows the stage of the current run
+
+        :return: None
+        """
+        self.progress_label = tk.Label(self.root, text="Ready", anchor=tk.W)
+        self.progress_label.config(font=GUI_config.ENTRY_FONT, bg=GUI_config.WHITE)
+        self.progress_label.grid(column=0, row=7, columnspan=3, sticky=tk.W, **GUI_config.SPEC_PADDING)
 
     def create_clear_files_button(self):
         """
@@ -321,6 +400,14 @@ class GUI:
         self.logger.addHandler(self.texthndl)
         self.logger.setLevel(logging.INFO)
 
+        # mirror the log to a rotating file
+        if GUI_config.LOG_FILE is not None:
+            file_handler = logging.handlers.RotatingFileHandler(GUI_config.LOG_FILE,
+                                                                maxBytes=GUI_config.LOG_FILE_MAX_BYTES,
+                                                                backupCount=GUI_config.LOG_FILE_BACKUP_COUNT)
+            file_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+            self.logger.addHandler(file_handler)
+
     def create_filelist_frame (self):
         """
         Method to create the frame for the file list
@@ -444,55 +531,384 @@ class GUI:
         """
         Callback function for the "run" button
 
-        **Calls the corresponding fitting routines**
+        **Reads the inputs from the GUI and starts the corresponding fitting routine in a background thread**
+
+        The Tk main loop keeps running during the fit; progress messages and calls that have to be made on the main
+        thread (plots) are passed through a queue that is polled by poll_run_queue().
 
         :return: None
         """
+        if self.run_thread is not None and self.run_thread.is_alive():
+            self.logger.info("A fit is already running\n")
+            return
+
+        # The inputs are read here, since the widgets must not be accessed from the background thread
+        captype = None
+        try:
+            if self.drop_down_var.get() == GUI_config.DROP_DOWN_ELEMENTS[2]: #CMC
+                # check if all required configurations for CMCs are present
+                if not (set(config.CMC_REQUIRED_CONFIGURATIONS).issubset(set(self.cmc_files.keys()))):
+                    raise Exception("Error: not all required files present")
+                run_target = self.fit_cmc
+            elif self.drop_down_var.get() == GUI_config.DROP_DOWN_ELEMENTS[1]:#CAP
+                captype = self.return_captype()
+                run_target = self.fit_cap
+            else:#COIL
+                run_target = self.fit_coil
+
+            gui_values = self.read_from_GUI(captype)
+        except Exception as e:
+            self.logger.error(str(e) + '\n')
+            return
+
+        CANCEL_EVENT.clear()
+        self.timeouts = []
+        self.run_button.config(state='disabled')
+        self.cancel_button.config(state='normal')
+        self.progress_label.config(text="Running")
+
+        self.run_thread = threading.Thread(target=self.run_pipeline, args=(run_target, gui_values, captype),
+                                           daemon=True)
+        self.run_thread.start()
+        self.root.after(GUI_config.RUN_QUEUE_POLL_INTERVAL, self.poll_run_queue)
+
+    def callback_cancel(self):
+        """
+        Callback function for the "cancel" button. Requests the cancellation of the current run and terminates the
+        workers of the multiprocessing pool
 
-        if self.drop_down_var.get() == GUI_config.DROP_DOWN_ELEMENTS[2]: #CMC
-            self.fit_cmc()
-        elif self.drop_down_var.get() == GUI_config.DROP_DOWN_ELEMENTS[1]:#CAP
-            self.fit_cap()
-        elif self.drop_down_var.get() == GUI_config.DROP_DOWN_ELEMENTS[0]:#COIL
-            self.fit_coil()
+        :return: None
+        """
+        if self.run_thread is None or not self.run_thread.is_alive():
+            return
 
-    def fit_cmc(self):
+        self.logger.info("Cancelling fit...\n")
+        self.progress_label.config(text="Cancelling")
+        self.cancel_button.config(state='disabled')
+        CANCEL_EVENT.set()
 
-        # iterate through loaded files and safe the keys
-        checkkey = []
-        for key in self.cmc_files:
-            checkkey.append(key)
-        # check if all required configurations for CMCs are present
-        if not (set(config.CMC_REQUIRED_CONFIGURATIONS).issubset(set(checkkey))):
-            raise Exception("not all required files present")
+        # the pool is restarted by the next run
+        self.worker_pool.terminate()
 
-        cmc_parameters = {}
-        cmc_order ={}
+    def callback_close(self):
+        """
+        Callback function for closing the window; cancels a running fit and shuts down the worker pool
 
-        # step through DM and CM Files and fit with the coil fitting process
-        for mode, files in self.cmc_files.items():
-            self.iohandler.files = files
-            self.logger.info("Fitting CMC, "+mode+"\n")
-            [saturation_table, parameters, order] = self.fit_coil()
-            cmc_parameters[mode] = parameters
-            cmc_order[mode] = order
+        :return: None
+        """
+        if self.run_thread is not None and self.run_thread.is_alive():
+            CANCEL_EVENT.set()
+            self.worker_pool.terminate()
+        else:
+            self.worker_pool.close()
+        self.root.destroy()
 
-        self.iohandler.generate_Netlist_4_port_single_point(cmc_parameters["DM"],cmc_parameters["CM"], cmc_order["DM"],
-                                                            cmc_order["CM"])
+    def run_pipeline(self, run_target, gui_values, captype):
+        """
+        Method that runs a fitting routine; this is the target of the background thread
 
-        pass
+        :param run_target: The fitting routine (fit_coil, fit_cap or fit_cmc)
+        :param gui_values: The inputs read from the GUI (see read_from_GUI())
+        :param captype: The type of capacitor; only used by fit_cap
+        :return: None
+        """
+        run_log = None
+        if config.RUN_LOG_FILE is not None:
+            run_log = events.JsonLinesWriter(config.RUN_LOG_FILE)
+            events.subscribe(run_log)
+
+        profiler = None
+        if config.PROFILING:
+            profiler = profiling.StageProfiler(config.PROFILE_DUMP_DIR)
+            events.subscribe(profiler)
+
+        memory_profiler = None
+        if config.MEMORY_PROFILING:
+            memory_profiler = memory_profiling.MemoryProfiler(config.MEMORY_TOP_ALLOCATIONS)
+            events.subscribe(memory_profiler)
+
+        self.run_failed = False
+        try:
+            with events.stage('run'):
+                if run_target == self.fit_cap:
+                    run_target(gui_values, captype)
+                else:
+                    run_target(gui_values)
+        except FitCancelled:
+            self.logger.info("Fit cancelled\n")
+        except Exception:
+            # the fitting routines report their errors themselves
+            self.logger.debug("Run aborted", exc_info=True)
+            self.run_failed = True
+        finally:
+            if self.timeouts:
+                self.logger.warning("Fits that timed out:\n" + "\n".join(
+                    ["  %s: %s (order %d)" % timeout for timeout in self.timeouts]) + "\n")
+            if run_log is not None:
+                events.unsubscribe(run_log)
+                run_log.close()
+            if profiler is not None:
+                events.unsubscribe(profiler)
+                self.report_profile(profiler.report())
+            if memory_profiler is not None:
+                events.unsubscribe(memory_profiler)
+                self.report_profile(memory_profiler.report())
+                memory_profiler.close()
+            self.run_queue.put(('done', None))
+
+    def report_profile(self, report):
+        """
+        Method to output the report of the profiling modes (see profiling.py and memory_profiling.py)
 
+        :param report: The report as a string
+        :return: None
+        """
+        self.logger.info(report)
 
-    def fit_coil(self):
+    def report_stage(self, stage):
+        """
+        Method to report the progress of a run as a 'progress' event. This is also the point where a run checks if it
+        has been cancelled
+
+        :param stage: A string describing the stage
+        :return: None
+        """
+        check_cancelled()
+        events.emit('progress', message=stage)
+
+    def on_event(self, event):
+        """
+        Subscriber for the events of the runs (see events.py); passes the progress messages and the starting stages to
+        the progress display. Called from the background thread and the thread that forwards the events of the workers
+
+        :param event: The event dict
+        :return: None
+        """
+        match event['event']:
+            case 'progress':
+                self.run_queue.put(('stage', event['message']))
+            case 'stage_start' if event['file'] is not None:
+                self.run_queue.put(('detail', "%s: %s" % (event['file'], event['stage'])))
+
+    def run_on_main_thread(self, function, *args):
+        """
+        Method to have a function called on the Tk main thread (e.g. for plotting)
+
+        :param function: The function to call
+        :param args: The arguments of the function
+        :return: None
+        """
+        self.run_queue.put(('call', (function, args)))
+
+    def start_pool_for_batch(self, fitters):
+        """
+        Method to start the multiprocessing pool for the higher order fits of a batch of files; the number of workers
+        and the shape of the pre-fit tasks depend on the number of files and their orders (see worker_pool.plan_batch())
+
+        :param fitters: A list containing the instances of all fitters
+        :return: True if the pre-fit is to be split into tasks per band, False if it is run as one task per file
+        """
+        processes, split_bands = plan_batch([fitter.order for fitter in fitters])
+        self.logger.info("Higher order fits of %d files on %d workers%s" % (
+            len(fitters), processes, ", pre-fit split into bands" if split_bands else ""))
+        self.mp_pool = self.worker_pool.get(processes)
+        return split_bands
+
+    def run_pool_tasks(self, fitters, method, stage, **kwargs):
+        """
+        Method to run a fitting method of all fitters on the multiprocessing pool and to wait for the results; reports
+        the progress and returns if the run is cancelled.
+
+        Every task is limited to config.FIT_TASK_TIMEOUT seconds from its start on a worker (see
+        WorkerPool.run_batch()). A file whose task times out keeps the parameters it had before the task; with the
+        REDUCED_ORDER fallback, its order is reduced and the task is run once more.
+
+        :param fitters: A list containing the instances of all fitters
+        :param method: The name of the Fitter method to run, e.g. 'pre_fit_bands'
+        :param stage: A string describing the stage
+        :param kwargs: (optional) Keyword arguments of the method
+        :return: A list of the resulting Parameters() objects, one per file
+        """
+        param_sets = [fitter.parameters for fitter in fitters]
+        report = lambda num_done, num_tasks: self.report_stage("%s: %d of %d files done" % (stage, num_done, num_tasks))
+
+        # the most expensive tasks are submitted first
+        tasks = {it: functools.partial(getattr(fitters[it], method), **kwargs)
+                 for it in schedule_tasks([fitter.order for fitter in fitters])}
+        retry = config.FIT_TIMEOUT_FALLBACK == constants.timeout_fallback.REDUCED_ORDER
+
+        while tasks:
+            results, timed_out = self.worker_pool.run_batch(tasks, config.FIT_TASK_TIMEOUT, report)
+            self.mp_pool = self.worker_pool.pool
+            for it, param_set in results.items():
+                param_sets[it] = param_set
+
+            tasks = {}
+            for it in timed_out:
+                self.timeouts.append((fitters[it].name, stage, fitters[it].order))
+                self.logger.warning("%s: %s timed out after %s s at order %d; keeping the parameters from before "
+                                    "the %s" % (fitters[it].name, stage, config.FIT_TASK_TIMEOUT, fitters[it].order,
+                                                stage))
+                if retry and fitters[it].order:
+                    order = int(fitters[it].order * config.FIT_TIMEOUT_ORDER_FACTOR)
+                    self.logger.warning("%s: repeating %s with order reduced to %d" % (fitters[it].name, stage, order))
+                    param_sets[it] = fitters[it].reduce_order(order)
+                    tasks[it] = functools.partial(getattr(fitters[it], method), **kwargs)
+            # only one retry per stage
+            retry = False
+
+        return param_sets
+
+    def pre_fit_bands_batch(self, fitters):
+        """
+        Method to pre-fit the bands of all files concurrently on the multiprocessing pool (see
+        Fitter.pre_fit_bands_concurrent()). The bands of every file are sorted into waves of non-overlapping bands; the
+        waves of all files with the same index are submitted as one batch, so the workers are shared by all files.
+        Every band is limited to config.FIT_TASK_TIMEOUT seconds; a band that times out keeps its estimate
+
+        :param fitters: A list containing the instances of all fitters
+        :return: None (the parameters are written to the fitters)
+        """
+        waves = []
+        for fitter in fitters:
+            # Fix all parameters in place, like the sequential pre-fit does
+            fitter.fix_parameters(fitter.parameters)
+            waves.append(band_fitting.get_band_waves(fitter.modeled_bandwidths, range(len(fitter.modeled_bandwidths))))
+
+        with events.stage('pre-fit'):
+            for wave_number in range(max([len(file_waves) for file_waves in waves], default=0)):
+                # the backgrounds of a wave are calculated with the results of the previous waves of the same file
+                tasks = {}
+                for num_file, (fitter, file_waves) in enumerate(zip(fitters, waves)):
+                    for it in (file_waves[wave_number] if wave_number < len(file_waves) else []):
+                        tasks[(num_file, it)] = functools.partial(band_fitting.fit_band, *fitter.band_fit_arguments(it))
+
+                report = lambda num_done, num_tasks, wave_number=wave_number: self.report_stage(
+                    "Pre-fit: wave %d, %d of %d bands done" % (wave_number + 1, num_done, num_tasks))
+                results, timed_out = self.worker_pool.run_batch(tasks, config.FIT_TASK_TIMEOUT, report)
+                self.mp_pool = self.worker_pool.pool
+                check_cancelled()
+
+                for (num_file, it), result in results.items():
+                    fitters[num_file].write_band_result(it, result)
+                for num_file, it in timed_out:
+                    stage = "Pre-fit of band %d" % (it + 1)
+                    self.timeouts.append((fitters[num_file].name, stage, fitters[num_file].order))
+                    self.logger.warning("%s: %s timed out after %s s; keeping its estimate" %
+                                        (fitters[num_file].name, stage, config.FIT_TASK_TIMEOUT))
+
+        # Free parameters for further fitting
+        for fitter in fitters:
+            fitter.free_parameters_higher_order(fitter.parameters)
+
+    def poll_run_queue(self):
+        """
+        Method to process the messages of the background thread; reschedules itself until the run is finished
+
+        :return: None
+        """
+        while True:
+            try:
+                message, content = self.run_queue.get_nowait()
+            except queue.Empty:
+                break
+
+            match message:
+                case 'stage':
+                    self.progress_stage = content
+                    self.progress_label.config(text=content)
+                case 'detail':
+                    self.progress_label.config(text="%s (%s)" % (self.progress_stage, content))
+                case 'call':
+                    function, args = content
+                    function(*args)
+                case 'done':
+                    self.progress_label.config(text="Cancelled" if CANCEL_EVENT.is_set() else "Done")
+                    self.run_button.config(state='normal')
+                    self.cancel_button.config(state='disabled')
+                    plt.show(block=False)
+                    return
+
+        self.root.after(GUI_config.RUN_QUEUE_POLL_INTERVAL, self.poll_run_queue)
+
+    def fit_cmc(self, gui_values):
+        """
+        Method to fit a common mode choke with the CMC fitter (see cmc_fitter.py). All configurations are preprocessed
+        at once in this process; the fitting pipelines of the configurations are independent and run concurrently on the
+        worker pool, one task per configuration (see CMC_Fitter.fit_all_configurations()). The DM and CM models are
+        joined to the netlist
+
+        :param gui_values: The inputs read from the GUI (see read_from_GUI())
+        :return: None
+        """
+        passive_nom, res, prom, shunt_series = gui_values[:4]
+        try:
+            self.report_stage("Preprocessing")
+            fitter = CMC_Fitter(self.cmc_files, shunt_series=shunt_series, logger_instance=self.logger,
+                                nominal_value={key: passive_nom for key in self.cmc_files}, series_resistance=res,
+                                peak_detection_prominence=prom)
+            keys = fitter.fit_configurations()
+
+            # Start the multiprocessing pool with a worker per configuration
+            self.report_stage("Fit of %d configurations" % len(keys))
+            self.mp_pool = self.worker_pool.get(min(len(keys), default_pool_size()))
+            timed_out = fitter.fit_all_configurations(worker_pool=self.worker_pool, timeout=config.FIT_TASK_TIMEOUT,
+                                                      full_fit=config.FULL_FIT)
+            self.mp_pool = self.worker_pool.pool
+            self.timeouts += [(fitter.file_dict[key].name, "Fit", fitter.order_dict[key]) for key in timed_out]
+
+            # report the resulting models
+            for key in keys:
+                events.emit('model', files=[fitter.file_dict[key].name], order=fitter.order_dict[key],
+                            parameters=[fitter.params_dict[key].valuesdict()])
+
+            ################ OUTPUT ####################################################################################
+            self.report_stage("Output")
+
+            # Set path for IO handler
+            self.iohandler.set_out_path(self.selected_s2p_files[0])
+
+            # Output plots
+            for key in keys:
+                fitter.select_configuration(key)
+                upper_frq_lim = config.FREQ_UPPER_LIMIT
+
+                with events.stage('plots', file=fitter.name):
+                    fitter.write_model_data(fitter.params_dict[key], fitter.order_dict[key])
+
+                    self.run_on_main_thread(
+                        self.iohandler.output_plot,
+                        fitter.freq[fitter.freq < upper_frq_lim],
+                        fitter.z21_data[fitter.freq < upper_frq_lim],
+                        fitter.data_mag[fitter.freq < upper_frq_lim],
+                        fitter.data_ang[fitter.freq < upper_frq_lim],
+                        fitter.model_data[fitter.freq < upper_frq_lim],
+                        fitter.name)
+
+            with events.stage('export'):
+                self.iohandler.generate_Netlist_4_port_single_point(fitter.params_dict["DM"].valuesdict(),
+                                                                    fitter.params_dict["CM"].valuesdict(),
+                                                                    fitter.order_dict["DM"], fitter.order_dict["CM"])
+
+        except FitCancelled:
+            raise
+
+        except Exception as e:
+            self.logger.error("ERROR: An Exception occurred during execution:")
+            self.logger.error(str(e) + '\n')
+            raise
+
+    def fit_coil(self, gui_values):
 
         fit_type = constants.El.INDUCTOR
 
         self.logger.info("----------Run----------\n")
-        [passive_nom, res, prom, shunt_series, files, dc_bias] = self.read_from_GUI()
+        [passive_nom, res, prom, shunt_series, files, dc_bias] = gui_values
 
         try:
 
             ################ PARSING AND PRE-PROCESSING ################################################################
+            self.report_stage("Parsing and pre-processing")
 
             # Create an array for the fitter instances and
             fitters = []
@@ -506,8 +922,14 @@ class GUI:
             ################ END PARSING AND PRE-PROCESSING ############################################################
 
             ################ MAIN RESONANCE FIT ########################################################################
+            self.report_stage("Main resonance fit")
 
-            for it, fitter in enumerate(fitters):
+            # Fit the files of a bias sweep in order of their DC bias, each one starting from its neighbour's parameters
+            warm_start = config.BIAS_SWEEP_WARM_START and len(fitters) > 1
+            if warm_start:
+                self.fit_main_res_bias_sweep(fitters, dc_bias)
+
+            for it, fitter in enumerate([] if warm_start else fitters):
 
                 #create the main resonance parameters
                 try:
@@ -533,12 +955,17 @@ class GUI:
             ################ END MAIN RESONANCE FIT ####################################################################
 
             ################ HIGHER ORDER RESONANCES - MULTIPROCESSING #################################################
+            self.report_stage("Higher order fit")
 
             # Start multiprocessing only if full fit is selected, otherwise use single process fitting
-            if config.FULL_FIT:
-                # Start multiprocessing pool
-                self.mp_pool = mp.Pool(config.MULTIPROCESSING_COUNT)
+            # If the joint fit is selected, it replaces the individual curve fits of the higher order resonances
+            joint_fit = config.JOINT_BIAS_FIT and len(fitters) > 1
 
+            if config.FULL_FIT and config.BIAS_SWEEP_WARM_START and len(fitters) > 1:
+                # Warm-started bias sweep; every fit depends on its neighbour, so the files are fit one after another
+                self.fit_higher_order_bias_sweep(fitters, dc_bias, curve_fit=not joint_fit)
+
+            elif config.FULL_FIT:
                 for it, fitter in enumerate(fitters):
                     fitter.get_resonances()
 
@@ -553,37 +980,30 @@ class GUI:
                 for fitter in fitters:
                     fitter.correct_parameters(change_main=correct_main_res, num_it=num_iterations)
 
-                #apply pre-fitting tasks to the multiprocessing pool
-                pre_fit_results = []
-                for it, fitter in enumerate(fitters):
-                    pre_fit_results.append(self.mp_pool.apply_async(fitter.pre_fit_bands))
+                # Start the multiprocessing pool, sized for the orders of the files
+                split_bands = self.start_pool_for_batch(fitters)
 
-                #wait for all pre-fits to finish
-                [result.wait() for result in pre_fit_results]
+                if split_bands:
+                    # the bands of all files are fit concurrently on the pool
+                    self.pre_fit_bands_batch(fitters)
+                else:
+                    #apply pre-fitting tasks to the multiprocessing pool and wait for all pre-fits to finish
+                    pre_fit_sets = self.run_pool_tasks(fitters, 'pre_fit_bands', "Pre-fit")
 
-                #write back to parameters of fitters
-                for it, pre_fit_result in enumerate(pre_fit_results):
-                    # we need to rewrite the obtained parameters to the fitters, since the address space for the subprocess
-                    # is different from the main
-                    param_set = (pre_fit_result.get())
-                    fitters[it].parameters = param_set
+                    #write back to parameters of fitters
+                    for it, param_set in enumerate(pre_fit_sets):
+                        # we need to rewrite the obtained parameters to the fitters, since the address space for the
+                        # subprocess is different from the main
+                        fitters[it].parameters = param_set
 
                 #CURVE FIT
-                # Create array for fit results
-                fit_results = []
-                for it, fitter in enumerate(fitters):
-                    fit_results.append(self.mp_pool.apply_async(fitter.fit_curve_higher_order))
-
-                # Wait for all fits to finish
-                [result.wait() for result in fit_results]
-
-                # Write back to instance parameters (mp results are in a different namespace)
-                for it, result in enumerate(fit_results):
-                    param_set = (result.get())
-                    fitters[it].parameters = param_set
+                if not joint_fit:
+                    # Apply the fits to the multiprocessing pool and wait for all fits to finish
+                    fit_sets = self.run_pool_tasks(fitters, 'fit_curve_higher_order', "Higher order fit")
 
-                # Fit done
-                self.mp_pool.close()
+                    # Write back to instance parameters (mp results are in a different namespace)
+                    for it, param_set in enumerate(fit_sets):
+                        fitters[it].parameters = param_set
             else:
                 # Run the higher order fitting process only for the first file
                 fitters[0].get_resonances()
@@ -591,64 +1011,87 @@ class GUI:
                 correct_main_res = 0
                 num_iterations = 4
                 fitters[0].correct_parameters(change_main=correct_main_res, num_it=num_iterations)
-                fitters[0].pre_fit_bands()
-                higher_order_params = fitters[0].fit_curve_higher_order()
+                if config.BAND_PARALLEL_PRE_FIT:
+                    higher_order_params = fitters[0].pre_fit_bands_concurrent()
+                else:
+                    higher_order_params = fitters[0].pre_fit_bands()
+                if not joint_fit:
+                    higher_order_params = fitters[0].fit_curve_higher_order()
                 if len(fitters) > 1:
                     for fitter in fitters[1:]:
                         fitter.add_higher_order_resonances_MR_fit(order=fitters[0].order, param_set0=higher_order_params)
 
+            ################ JOINT FIT OF ALL DC BIAS FILES ############################################################
 
+            joint_fitted = False
+            if joint_fit:
+                joint_fitted = self.fit_jointly(fitters)
+
+            ################ MODEL REDUCTION ###########################################################################
+
+            if config.FULL_FIT and config.MODEL_REDUCTION:
+                self.report_stage("Model reduction")
+                with events.stage('model reduction'):
+                    self.reduce_models(fitters, joint=joint_fitted)
 
             ################ END HIGHER ORDER RESONANCES - MULTIPROCESSING POOL ########################################
 
 
             ############### MATCH PARAMETERS ###########################################################################
+            self.report_stage("Matching parameters")
             parameter_list = []
             for fitter in fitters:
                 parameter_list.append(fitter.parameters)
 
-            parameter_list = self.match_parameters(parameter_list, fitters, captype)
+            with events.stage('matching'):
+                results = self.match_parameters(parameter_list, fitters, captype)
 
             ############### END MATCH PARAMETERS #######################################################################
 
             ################ SATURATION TABLE(S) #######################################################################
 
             order = max([fitter.order for fitter in fitters])
-            # saturation table for nominal value
-            # create saturation table and get nominal value
-            saturation_table = {}
-            match fit_type:
-                case constants.El.INDUCTOR:
-                    saturation_table['L'] = self.generate_saturation_table(parameter_list, 'L', dc_bias)
-                    saturation_table['C'] = self.generate_saturation_table(parameter_list, 'C', dc_bias)
-                    saturation_table['R_Fe'] = self.generate_saturation_table(parameter_list, 'R_Fe',
-                                                                              dc_bias)
-                case constants.El.CAPACITOR:
-                    saturation_table['C'] = self.generate_saturation_table(parameter_list, 'C', dc_bias)
-                    saturation_table['R_s'] = self.generate_saturation_table(parameter_list, 'R_s', dc_bias)
-
-            # write saturation table for acoustic resonance
-            if fit_type == constants.El.CAPACITOR and captype == constants.captype.MLCC:
-                saturation_table['R_A'] = self.generate_saturation_table(parameter_list, 'R_A', dc_bias)
-                saturation_table['L_A'] = self.generate_saturation_table(parameter_list, 'L_A', dc_bias)
-                saturation_table['C_A'] = self.generate_saturation_table(parameter_list, 'C_A', dc_bias)
-
-            if config.FULL_FIT:
-
-                # Create saturation tables for all parameters
-                for key_number in range(1, order + 1):
-                    # Create keys
-                    C_key = "C%s" % key_number
-                    L_key = "L%s" % key_number
-                    R_key = "R%s" % key_number
-
-                    saturation_table[C_key] = self.generate_saturation_table(parameter_list, C_key, dc_bias)
-                    saturation_table[L_key] = self.generate_saturation_table(parameter_list, L_key, dc_bias)
-                    saturation_table[R_key] = self.generate_saturation_table(parameter_list, R_key, dc_bias)
+            with events.stage('saturation tables'):
+                # saturation table for nominal value
+                # create saturation table and get nominal value
+                saturation_table = {}
+                match fit_type:
+                    case constants.El.INDUCTOR:
+                        saturation_table['L'] = self.generate_saturation_table(results, 'L', dc_bias)
+                        saturation_table['C'] = self.generate_saturation_table(results, 'C', dc_bias)
+                        saturation_table['R_Fe'] = self.generate_saturation_table(results, 'R_Fe',
+                                                                                  dc_bias)
+                    case constants.El.CAPACITOR:
+                        saturation_table['C'] = self.generate_saturation_table(results, 'C', dc_bias)
+                        saturation_table['R_s'] = self.generate_saturation_table(results, 'R_s', dc_bias)
+
+                # write saturation table for acoustic resonance
+                if fit_type == constants.El.CAPACITOR and captype == constants.captype.MLCC:
+                    saturation_table['R_A'] = self.generate_saturation_table(results, 'R_A', dc_bias)
+                    saturation_table['L_A'] = self.generate_saturation_table(results, 'L_A', dc_bias)
+                    saturation_table['C_A'] = self.generate_saturation_table(results, 'C_A', dc_bias)
+
+                if config.FULL_FIT:
+
+                    # Create saturation tables for all parameters
+                    for key_number in range(1, order + 1):
+                        # Create keys
+                        C_key = "C%s" % key_number
+                        L_key = "L%s" % key_number
+                        R_key = "R%s" % key_number
+
+                        saturation_table[C_key] = self.generate_saturation_table(results, C_key, dc_bias)
+                        saturation_table[L_key] = self.generate_saturation_table(results, L_key, dc_bias)
+                        saturation_table[R_key] = self.generate_saturation_table(results, R_key, dc_bias)
 
             ################ END SATURATION TABLE(S) ###################################################################
 
+            # report the resulting model
+            events.emit('model', files=[fitter.name for fitter in fitters], order=order,
+                        parameters=[results.row(it) for it in range(len(results))])
+
             ################ OUTPUT ####################################################################################
+            self.report_stage("Output")
 
             # Set path for IO handler
             path_out = self.selected_s2p_files[0]
@@ -658,53 +1101,56 @@ class GUI:
             for it, fitter in enumerate(fitters):
                 upper_frq_lim = config.FREQ_UPPER_LIMIT
 
-                fitter.write_model_data(parameter_list[it], order)
+                with events.stage('plots', file=fitter.name):
+                    fitter.write_model_data(results.to_parameters(it), order)
 
-                self.iohandler.output_plot(
-                    fitter.freq[fitter.freq < upper_frq_lim],
-                    fitter.z21_data[fitter.freq < upper_frq_lim],
-                    fitter.data_mag[fitter.freq < upper_frq_lim],
-                    fitter.data_ang[fitter.freq < upper_frq_lim],
-                    fitter.model_data[fitter.freq < upper_frq_lim],
-                    fitter.name)
+                    self.run_on_main_thread(
+                        self.iohandler.output_plot,
+                        fitter.freq[fitter.freq < upper_frq_lim],
+                        fitter.z21_data[fitter.freq < upper_frq_lim],
+                        fitter.data_mag[fitter.freq < upper_frq_lim],
+                        fitter.data_ang[fitter.freq < upper_frq_lim],
+                        fitter.model_data[fitter.freq < upper_frq_lim],
+                        fitter.name)
 
 
 
             # If we are using the coil fitter to fit a CMC, suppress the output and return parameters
-            if self.drop_down_var.get() == GUI_config.DROP_DOWN_ELEMENTS[2]:
-                return [saturation_table, parameter_list[0], order]
+            if self.gui_layout == GUI_config.DROP_DOWN_ELEMENTS[2]:
+                return [saturation_table, results.to_parameters(0), order]
 
 
             #export parameters
-            self.iohandler.export_parameters(parameter_list, order, fit_type, captype)
+            with events.stage('export'):
+                self.iohandler.export_parameters(results, order, fit_type, captype)
 
-            if config.FORCE_SINGLE_POINT_MODEL or len(fitters) == 1:
-                self.iohandler.generate_Netlist_2_port_single_point(parameter_list[0], order, fit_type, saturation_table, captype=captype)
-            elif config.FULL_FIT:
-                self.iohandler.generate_Netlist_2_port_full_fit(parameter_list[0],order, fit_type, saturation_table, captype=captype)
-            else:
-                self.iohandler.generate_Netlist_2_port(parameter_list[0],order, fit_type, saturation_table, captype=captype)
+                if config.FORCE_SINGLE_POINT_MODEL or len(fitters) == 1:
+                    self.iohandler.generate_Netlist_2_port_single_point(results.row(0), order, fit_type, saturation_table, captype=captype)
+                elif config.FULL_FIT:
+                    self.iohandler.generate_Netlist_2_port_full_fit(results.row(0),order, fit_type, saturation_table, captype=captype)
+                else:
+                    self.iohandler.generate_Netlist_2_port(results.row(0),order, fit_type, saturation_table, captype=captype)
 
 
 
             ################ END OUTPUT ################################################################################
 
+        except FitCancelled:
+            raise
+
         except Exception as e:
             self.logger.error("ERROR: An Exception occurred during execution:")
             self.logger.error(str(e) + '\n')
+            raise
 
-        finally:
-            plt.show()
-
-    def fit_cap(self):
+    def fit_cap(self, gui_values, captype):
 
         self.logger.info("----------Run----------\n")
 
         # This variable is redundant
         fit_type = El.CAPACITOR
 
-        captype = self.return_captype()
-        [passive_nom, res, prom, shunt_series, files, dc_bias] = self.read_from_GUI(captype)
+        [passive_nom, res, prom, shunt_series, files, dc_bias] = gui_values
 
         #set prominence to 3dB in case of High C model, because we need to avoid misdetection of resonances here
         if captype == constants.captype.HIGH_C:
@@ -712,6 +1158,7 @@ class GUI:
 
         try:
             ################ PARSING AND PRE-PROCESSING ################################################################
+            self.report_stage("Parsing and pre-processing")
 
             # Create an array for the fitter instances
             fitters = []
@@ -727,6 +1174,7 @@ class GUI:
 
             ################ HIGH C MODEL ##############################################################################
             if captype == constants.captype.HIGH_C:
+                self.report_stage("High C model fit")
                 #we need to specify some resonance frequency even if there is no detectable resonant frequency
                 # yet the f0 is required for some routines, hence we set it to an arbitrary value lower than the first resonance
                 for it, fitter in enumerate(fitters):
@@ -756,7 +1204,14 @@ class GUI:
 
             ################ MAIN RESONANCE FIT ########################################################################
             if captype != constants.captype.HIGH_C:
-                for it, fitter in enumerate(fitters):
+                self.report_stage("Main resonance fit")
+                # Fit the files of a bias sweep in order of their DC bias, each one starting from its neighbour's
+                # parameters
+                warm_start = config.BIAS_SWEEP_WARM_START and len(fitters) > 1
+                if warm_start:
+                    self.fit_main_res_bias_sweep(fitters, dc_bias)
+
+                for it, fitter in enumerate([] if warm_start else fitters):
 
                     # Create the main resonance parameters
                     try:
@@ -780,6 +1235,7 @@ class GUI:
 
                 # Check if we have at least two files present for MLCC type cap, otherwise switch back to generic
                 if captype == constants.captype.MLCC:
+                    self.report_stage("Acoustic resonance fit")
                     try:
                         fitters[1]
                     except:
@@ -830,137 +1286,160 @@ class GUI:
                 ################ END ACOUSTIC RESONANCE FIT FOR MLCC ###################################################
 
                 ################ HIGHER ORDER RESONANCES - MULTIPROCESSING POOL ########################################
-                self.mp_pool = mp.Pool(config.MULTIPROCESSING_COUNT)
-
-                for fitter in fitters:
-                    fitter.get_resonances()
-
-                correct_main_res = False
-                num_iterations = 4
-                for fitter in fitters:
-                    fitter.create_higher_order_parameters()
-                    fitter.correct_parameters(change_main=correct_main_res, num_it=num_iterations)
-
-                #apply pre-fitting tasks to the multiprocessing pool
-                pre_fit_results = []
-                for fitter in fitters:
-                    pre_fit_results.append(self.mp_pool.apply_async(fitter.pre_fit_bands))
-
-                #wait for all pre-fits to finish
-                [result.wait() for result in pre_fit_results]
+                self.report_stage("Higher order fit")
+                # If the joint fit is selected, it replaces the individual curve fits of the higher order resonances
+                joint_fit = config.JOINT_BIAS_FIT and len(fitters) > 1
+
+                if config.BIAS_SWEEP_WARM_START and len(fitters) > 1:
+                    # Warm-started bias sweep; every fit depends on its neighbour, so the files are fit one after
+                    # another
+                    self.fit_higher_order_bias_sweep(fitters, dc_bias, curve_fit=not joint_fit)
+
+                else:
+                    for fitter in fitters:
+                        fitter.get_resonances()
+
+                    correct_main_res = False
+                    num_iterations = 4
+                    for fitter in fitters:
+                        fitter.create_higher_order_parameters()
+                        fitter.correct_parameters(change_main=correct_main_res, num_it=num_iterations)
+
+                    # start the multiprocessing pool, sized for the orders of the files
+                    split_bands = self.start_pool_for_batch(fitters)
+
+                    if split_bands:
+                        # the bands of all files are fit concurrently on the pool
+                        self.pre_fit_bands_batch(fitters)
+                    else:
+                        #apply pre-fitting tasks to the multiprocessing pool and wait for all pre-fits to finish
+                        pre_fit_sets = self.run_pool_tasks(fitters, 'pre_fit_bands', "Pre-fit")
 
-                #write back to parameter list
-                for it, pre_fit_result in enumerate(pre_fit_results):
-                    param_set = pre_fit_result.get()
-                    fitters[it].parameters = param_set
+                        #write back to parameter list
+                        for it, param_set in enumerate(pre_fit_sets):
+                            fitters[it].parameters = param_set
 
-                #CURVE FIT
-                #create array for fit results
-                fit_results = []
-                for fitter in fitters:
-                    fit_results.append(self.mp_pool.apply_async(fitter.fit_curve_higher_order))
+                    #CURVE FIT
+                    if not joint_fit:
+                        # apply the fits to the multiprocessing pool and wait for all fits to finish
+                        fit_sets = self.run_pool_tasks(fitters, 'fit_curve_higher_order', "Higher order fit")
 
-                # wait for all pre-fits to finish
-                [result.wait() for result in fit_results]
+                        # write back to parameter list
+                        for it, param_set in enumerate(fit_sets):
+                            fitters[it].parameters = param_set
 
-                # write back to parameter list
-                for it, result in enumerate(fit_results):
-                    param_set = result.get()
-                    fitters[it].parameters = param_set
+                ################ END HIGHER ORDER RESONANCES - MULTIPROCESSING POOL ########################################
 
-                #fit done
-                self.mp_pool.close()
+                ################ JOINT FIT OF ALL DC BIAS FILES ########################################################
+                joint_fitted = False
+                if joint_fit:
+                    joint_fitted = self.fit_jointly(fitters)
 
-                ################ END HIGHER ORDER RESONANCES - MULTIPROCESSING POOL ########################################
+                ################ MODEL REDUCTION #######################################################################
+                if config.MODEL_REDUCTION:
+                    self.report_stage("Model reduction")
+                    with events.stage('model reduction'):
+                        self.reduce_models(fitters, joint=joint_fitted)
 
                 #TODO: single thread fit is missing here
 
             ############### MATCH PARAMETERS ###########################################################################
+            self.report_stage("Matching parameters")
             parameter_list = []
             for fitter in fitters:
                 parameter_list.append(fitter.parameters)
 
-            parameter_list = self.match_parameters(parameter_list, fitters, captype)
+            with events.stage('matching'):
+                results = self.match_parameters(parameter_list, fitters, captype)
 
             ############### END MATCH PARAMETERS #######################################################################
 
             ################ SATURATION TABLE(S) #######################################################################
 
             order = max([fitter.order for fitter in fitters])
-            # saturation table for nominal value
-            # create saturation table and get nominal value
-            saturation_table = {}
-            match fit_type:
-                case constants.El.INDUCTOR:
-                    saturation_table['L'] = self.generate_saturation_table(parameter_list, 'L', dc_bias)
-                    saturation_table['R_Fe'] = self.generate_saturation_table(parameter_list, 'R_Fe',
-                                                                              dc_bias)
-                case constants.El.CAPACITOR:
-                    saturation_table['C'] = self.generate_saturation_table(parameter_list, 'C', dc_bias)
-                    saturation_table['R_s'] = self.generate_saturation_table(parameter_list, 'R_s', dc_bias)
-
-            # write saturation table for acoustic resonance
-            if fit_type == constants.El.CAPACITOR and captype == constants.captype.MLCC:
-                saturation_table['R_A'] = self.generate_saturation_table(parameter_list, 'R_A', dc_bias)
-                saturation_table['L_A'] = self.generate_saturation_table(parameter_list, 'L_A', dc_bias)
-                saturation_table['C_A'] = self.generate_saturation_table(parameter_list, 'C_A', dc_bias)
-
-            if config.FULL_FIT:
-
-                # create saturation tables for all parameters
-                for key_number in range(1, order + 1):
-                    # create keys
-                    C_key = "C%s" % key_number
-                    L_key = "L%s" % key_number
-                    R_key = "R%s" % key_number
-
-                    saturation_table[C_key] = self.generate_saturation_table(parameter_list, C_key, dc_bias)
-                    saturation_table[L_key] = self.generate_saturation_table(parameter_list, L_key, dc_bias)
-                    saturation_table[R_key] = self.generate_saturation_table(parameter_list, R_key, dc_bias)
+            with events.stage('saturation tables'):
+                # saturation table for nominal value
+                # create saturation table and get nominal value
+                saturation_table = {}
+                match fit_type:
+                    case constants.El.INDUCTOR:
+                        saturation_table['L'] = self.generate_saturation_table(results, 'L', dc_bias)
+                        saturation_table['R_Fe'] = self.generate_saturation_table(results, 'R_Fe',
+                                                                                  dc_bias)
+                    case constants.El.CAPACITOR:
+                        saturation_table['C'] = self.generate_saturation_table(results, 'C', dc_bias)
+                        saturation_table['R_s'] = self.generate_saturation_table(results, 'R_s', dc_bias)
+
+                # write saturation table for acoustic resonance
+                if fit_type == constants.El.CAPACITOR and captype == constants.captype.MLCC:
+                    saturation_table['R_A'] = self.generate_saturation_table(results, 'R_A', dc_bias)
+                    saturation_table['L_A'] = self.generate_saturation_table(results, 'L_A', dc_bias)
+                    saturation_table['C_A'] = self.generate_saturation_table(results, 'C_A', dc_bias)
+
+                if config.FULL_FIT:
+
+                    # create saturation tables for all parameters
+                    for key_number in range(1, order + 1):
+                        # create keys
+                        C_key = "C%s" % key_number
+                        L_key = "L%s" % key_number
+                        R_key = "R%s" % key_number
+
+                        saturation_table[C_key] = self.generate_saturation_table(results, C_key, dc_bias)
+                        saturation_table[L_key] = self.generate_saturation_table(results, L_key, dc_bias)
+                        saturation_table[R_key] = self.generate_saturation_table(results, R_key, dc_bias)
 
             ################ END SATURATION TABLE(S) ###################################################################
 
+            # report the resulting model
+            events.emit('model', files=[fitter.name for fitter in fitters], order=order,
+                        parameters=[results.row(it) for it in range(len(results))])
+
             ################ OUTPUT ####################################################################################
+            self.report_stage("Output")
 
             #set path for IO handler
             path_out = self.selected_s2p_files[0]
             self.iohandler.set_out_path(path_out)
 
             #export parameters
-            self.iohandler.export_parameters(parameter_list, order, fit_type, captype)
+            with events.stage('export'):
+                self.iohandler.export_parameters(results, order, fit_type, captype)
 
-            if config.FORCE_SINGLE_POINT_MODEL or len(fitters) == 1:
-                self.iohandler.generate_Netlist_2_port_single_point(parameter_list[0], order, fit_type, saturation_table, captype=captype)
-            elif config.FULL_FIT:
-                self.iohandler.generate_Netlist_2_port_full_fit(parameter_list[0],order, fit_type, saturation_table, captype=captype)
-            else:
-                self.iohandler.generate_Netlist_2_port(parameter_list[0],order, fit_type, saturation_table, captype=captype)
+                if config.FORCE_SINGLE_POINT_MODEL or len(fitters) == 1:
+                    self.iohandler.generate_Netlist_2_port_single_point(results.row(0), order, fit_type, saturation_table, captype=captype)
+                elif config.FULL_FIT:
+                    self.iohandler.generate_Netlist_2_port_full_fit(results.row(0),order, fit_type, saturation_table, captype=captype)
+                else:
+                    self.iohandler.generate_Netlist_2_port(results.row(0),order, fit_type, saturation_table, captype=captype)
 
             for it, fitter in enumerate(fitters):
                 upper_frq_lim = config.FREQ_UPPER_LIMIT
 
-                fitter.write_model_data(parameter_list[it], order)
+                with events.stage('plots', file=fitter.name):
+                    fitter.write_model_data(results.to_parameters(it), order)
 
-                self.iohandler.output_plot(
-                    fitter.freq[fitter.freq < upper_frq_lim],
-                    fitter.z21_data[fitter.freq < upper_frq_lim],
-                    fitter.data_mag[fitter.freq < upper_frq_lim],
-                    fitter.data_ang[fitter.freq < upper_frq_lim],
-                    fitter.model_data[fitter.freq < upper_frq_lim],
-                    fitter.name)
+                    self.run_on_main_thread(
+                        self.iohandler.output_plot,
+                        fitter.freq[fitter.freq < upper_frq_lim],
+                        fitter.z21_data[fitter.freq < upper_frq_lim],
+                        fitter.data_mag[fitter.freq < upper_frq_lim],
+                        fitter.data_ang[fitter.freq < upper_frq_lim],
+                        fitter.model_data[fitter.freq < upper_frq_lim],
+                        fitter.name)
 
 
 
             ################ END OUTPUT ################################################################################
 
+        except FitCancelled:
+            raise
+
         except Exception as e:
             self.logger.error("ERROR: An Exception occurred during execution:")
             self.logger.error(str(e) + '\n')
             raise
 
-        finally:
-            plt.show()
-
     def read_from_GUI(self, captype = None):
         """
         function to read values from the several entry boxes, radiobuttons etc from the GUI
@@ -1025,253 +1504,229 @@ class GUI:
 
     def match_parameters(self, parameter_list, fitters, captype = None):
         """
-        Auxilliary method to map the parameters of the model to their corresponding frequencies
+        Auxilliary method to map the parameters of the model to their corresponding frequencies (see
+        parameter_matching.py)
 
         :param parameter_list: A list containing the Parameters() objects of all files
         :param fitters: A list containing the instances of all fitters used
         :param captype: Type of capacitor can be GENERIC or MLCC
-        :return: A list containing the Parameters() of all files, now with each resonance matched to their corresponding
-            frequency
+        :return: A ParameterMatrix containing the parameters of all files, now with each resonance matched to their
+            corresponding frequency
         """
 
         orders = [fitter.order for fitter in fitters]
 
-        w_array = np.full(( len(parameter_list), max(orders)), np.nan)
-
-        for num_set, parameter_set in enumerate(parameter_list[:]):
-            for key_number in range(1, orders[num_set] + 1):
-                w_key = "w%s" % key_number
-                w_array[num_set, key_number-1] = parameter_set[w_key].value
-
-
-        ref_array = np.nan
-        # find a reference array by iterating through all sets and finding one where all keys are filled
-        # ideally we have only one iteration
-        for set_number in range(np.shape(w_array)[0]):
-            if not np.isnan(w_array[set_number]).any():
-                ref_array = w_array[set_number]
-                break
-
-        # Check if we have found a reference array with all keys filled
-        if np.isnan(ref_array).any():
-            raise Exception("Could not determine a reference array for output; this should not happen")
-
-        # Create an assignment matrix and fill with -1; -1 is the indicator for "not present"
-        assignment_matrix = np.empty_like(w_array, dtype=np.int64)
-        assignment_matrix[:] = -1
-
-        # Iterate through all sets and find the keys that match best
-        for set_number in range(1, np.shape(w_array)[0]):
-            # Create a temporary row for the assignment matrix
-            temp_row = np.full([1, np.shape(w_array)[1]], -1, dtype=np.int64)[0]
-
-            # Iterate through all parameters and find the key that fits best (has the minimum distance from ref_array)
-            for param_number in range(np.shape(w_array)[1]):
-                if not np.isnan(w_array[set_number][param_number]):
-                    temp_row[param_number] = np.where(abs(w_array[set_number][param_number] - ref_array) == min(
-                        abs(w_array[set_number][param_number] - ref_array)))[0][0]
-
-            # Find duplicate keys that were assigned and free keys that have not been assigned
-            duplicates = [x for x in list(set([x for x in list(temp_row) if list(temp_row).count(x) > 1])) if x != -1]
-            free_keys = list(set(list(range(np.shape(ref_array)[0]))).difference(set(temp_row)))
-
-            # Iterate through all found duplicates
-            for duplicate in duplicates:
-                duplicate_positions = np.where(temp_row == duplicate)[0]
-                # Find the duplicate that fits the key number best; this is the duplicate we want to keep at that key
-                # Delete that key from the found duplicates
-                duplicate_positions = np.delete(duplicate_positions, np.where(
-                    abs(w_array[set_number][duplicate_positions] - ref_array[duplicate_positions]) == min(
-                        abs((w_array[set_number][duplicate_positions] - ref_array[duplicate_positions]))))[0][0])
-
-                # Iterate through the other occurences of the duplicate and find a free key that fits them
-                for it in duplicate_positions:
-                    best_key = free_keys[np.where(abs(w_array[set_number][it] - ref_array[free_keys]) ==
-                                                  min(abs(w_array[set_number][it] - ref_array[free_keys])))[0][0]]
-                    temp_row[it] = best_key
-
-            # Update ref_array
-            for param_number in range(np.shape(w_array)[1]):
-                if temp_row[param_number] != -1:
-                    ref_array[temp_row[param_number]] = w_array[set_number][param_number]
-
-            # Write to assignment matrix
-            assignment_matrix[set_number] = temp_row
-
-
-
-
-
         match fitters[0].fit_type: #TODO: this could use some better way of determining the fit type
             case constants.El.INDUCTOR:
                 r_default = config.R_FILL_IND
             case constants.El.CAPACITOR:
                 r_default = config.R_FILL_CAP
 
+        circuits = parameter_matching.match_circuits(parameter_matching.circuit_array(parameter_list, orders),
+                                                     r_default)
 
-        #check if first parameters object has all keys needed, else fill first array with all keys
-        for check_key in range(1, np.shape(w_array)[1]+1):
-            w_key = "w%s" % check_key
-            if not w_key in parameter_list[0]:
-                first_occurence = np.argwhere(assignment_matrix[:, param_number] != -1)[0][0]
-                first_occurence_set = parameter_list[first_occurence]
-                parameter_list[0] = self.fill_key(parameter_list[0], first_occurence_set, check_key, r_default)
+        main = ParameterMatrix.from_parameters(parameter_list, main_parameter_names(fitters[0].fit_type, captype))
+        return ParameterMatrix(main.names + circuit_parameter_names(np.shape(circuits)[1]),
+                               np.hstack([main.values, circuits.reshape(len(parameter_list), -1)]))
 
-        #switch key numbers
-        for set_number in range(1, np.shape(w_array)[0]):
-            parameter_set = parameter_list[set_number]
-            previous_set  = parameter_list[set_number - 1]
+    def fit_jointly(self, fitters):
+        """
+        Auxilliary method to fit all DC bias files jointly (see joint_fitter.py). The joint fit replaces the curve fits
+        of the higher order circuits, so if it does not improve the model, the curve fits are run after all: on the
+        pool for a full fit, for the reference file otherwise (its circuits are then copied to the other files)
 
-            output_set = Parameters()
-            output_set = self.copy_nominals(output_set, parameter_set, fitters[0].fit_type, captype)
+        :param fitters: A list containing the instances of all fitters
+        :return: True if the joint fit was accepted (the parameters are written to the fitters)
+        """
+        self.report_stage("Joint fit")
+        joint_fitter = JointFitter(fitters, logger_instance=self.logger)
+        with events.stage('joint fit'):
+            joint_fitter.fit()
+
+        if joint_fitter.accepted:
+            return True
+
+        self.report_stage("Higher order fit")
+        if config.FULL_FIT:
+            self.start_pool_for_batch(fitters)
+            fit_sets = self.run_pool_tasks(fitters, 'fit_curve_higher_order', "Higher order fit")
+            for it, param_set in enumerate(fit_sets):
+                fitters[it].parameters = param_set
+        else:
+            higher_order_params = fitters[0].fit_curve_higher_order()
+            for fitter in fitters[1:]:
+                fitter.add_higher_order_resonances_MR_fit(order=fitters[0].order, param_set0=higher_order_params)
+        return False
 
-            for param_number in range(np.shape(w_array)[1]):
-                old_key_nr = param_number + 1
-                if assignment_matrix[set_number][param_number] != -1:
-                    new_key_nr = assignment_matrix[set_number][param_number] + 1
+    def reduce_models(self, fitters, joint = False):
+        """
+        Auxilliary method to reduce the order of the models of all files (see model_reduction.py). The circuits that are
+        negligible in all files are removed, circuits at the same resonance frequency are merged, and the models that
+        changed are refit briefly: jointly if the models come from the joint fit, so the shared parameters are kept,
+        otherwise on the pool, one task per file. The change of the model error is logged and reported as a
+        'reduction' event.
+
+        :param fitters: A list containing the instances of all fitters
+        :param joint: (optional) True if the models come from the joint fit (see fit_jointly())
+        :return: None (the parameters are written to the fitters)
+        """
+        orders = [fitter.order for fitter in fitters]
+        if not max(orders, default=0):
+            return
 
-                if assignment_matrix[set_number][param_number]  != -1:
-                    output_set = self.switch_key(output_set, parameter_set, old_key_nr, new_key_nr)
+        w_array = parameter_matching.circuit_array([fitter.parameters for fitter in fitters], orders)[
+            :, :, parameter_matching.CIRCUIT_ELEMENTS.index('w')]
+        contributions = np.full(np.shape(w_array), np.nan)
+        for it, fitter in enumerate(fitters):
+            contributions[it, :fitter.order] = fitter.branch_contributions()
 
-            #fill remaining keys
-            for check_key in range(1, np.shape(w_array)[1] + 1):
-                w_key = "w%s" % check_key
-                if not w_key in output_set:
-                    output_set = self.fill_key(output_set, previous_set, check_key, r_default)
+        plan = model_reduction.reduction_plan(w_array, contributions, config.MODEL_REDUCTION_THRESHOLD,
+                                              config.MODEL_REDUCTION_MERGE_DISTANCE)
 
-            parameter_list[set_number] = copy.copy(output_set)
+        reduced = []
+        for it, (fitter, (merges, removed)) in enumerate(zip(fitters, plan)):
+            if not removed:
+                continue
 
-        return parameter_list
+            reduced.append((it, fitter.order, fitter.model_error_dB(),
+                            sum([len(other_key_numbers) for key_number, other_key_numbers in merges]), len(removed)))
+            for key_number, other_key_numbers in merges:
+                fitter.merge_circuits(key_number, other_key_numbers)
+            fitter.remove_circuits(removed)
 
-    def copy_nominals(self,out_set, parameter_set, fit_type, captype = None):
-        """
-        Auxilliary method to copy the parameters of the main element to a new parameter set
+        if not reduced:
+            return
 
-        :param out_set: A Parameters() object to be written to
-        :param parameter_set: A Parameters() object from which to copy
-        :param fit_type: The type of DUT to fit (coil or capacitor)
-        :param captype: The type of capacitor. Can be GENERIC or MLCC
-        :return: The out_set with copied main element parameters
+        self.report_stage("Model reduction: refit")
+        if joint:
+            JointFitter(fitters, logger_instance=self.logger).fit(max_nfev=config.MODEL_REDUCTION_REFIT_NFEV)
+        else:
+            refit_fitters = [fitters[it] for it, *_ in reduced]
+            self.start_pool_for_batch(refit_fitters)
+            refit_sets = self.run_pool_tasks(refit_fitters, 'fit_curve_higher_order', "Model reduction refit",
+                                             max_nfev=config.MODEL_REDUCTION_REFIT_NFEV)
+            for fitter, param_set in zip(refit_fitters, refit_sets):
+                fitter.parameters = param_set
+
+        for it, order, error, merged, removed in reduced:
+            fitter = fitters[it]
+            reduced_error = fitter.model_error_dB()
+            self.logger.info("%s: model reduced from order %d to %d (%d circuit(s) removed, %d merged); rms error "
+                             "%.3f dB -> %.3f dB" % (fitter.name, order, fitter.order, removed - merged, merged,
+                                                     error, reduced_error))
+            events.emit('reduction', file=fitter.name, order=order, reduced_order=fitter.order, merged=merged,
+                        error=error, reduced_error=reduced_error)
+
+    def get_bias_sweep_order(self, dc_bias_values):
         """
-        match fit_type:
-            case constants.El.INDUCTOR:
-                out_set.add('R_s', value = parameter_set['R_s'].value)
-                out_set.add('R_Fe', value =parameter_set['R_Fe'].value)
-                out_set.add('L', value =parameter_set['L'].value)
-                out_set.add('C', value =parameter_set['C'].value)
-            case constants.El.CAPACITOR:
-                out_set.add('R_s', value =parameter_set['R_s'].value)
-                out_set.add('R_iso', value =parameter_set['R_iso'].value)
-                out_set.add('L', value =parameter_set['L'].value)
-                out_set.add('C', value =parameter_set['C'].value)
-                if captype == constants.captype.MLCC:
-                    out_set.add('R_A', value=parameter_set['R_A'].value)
-                    out_set.add('L_A', value=parameter_set['L_A'].value)
-                    out_set.add('C_A', value=parameter_set['C_A'].value)
-
-        return out_set
+        Auxilliary method to get the order in which the files of a DC bias sweep are fit
 
-    def fill_key(self, parameter_set, previous_param_set, key_to_fill, r_value):
+        :param dc_bias_values: A list. The current or voltage values of the files
+        :return: A list of file indices, sorted by the magnitude of the DC bias (stable, so the reference file comes
+            first for equal bias)
         """
-        Method to fill a key if a resonance is no longer present in the current parameter set but was present in the
-        last parameter set
+        return [int(index) for index in np.argsort(np.abs(dc_bias_values), kind='stable')]
 
-        :param parameter_set: A Parameters() object to which to write
-        :param previous_param_set: The Parameters() object of the previous file
-        :param key_to_fill: The resonant circuit to fill
-        :param r_value: The value which shall be written to the resistor of the circuit
-        :return: The parameter_set to which to write
+    def fit_main_res_bias_sweep(self, fitters, dc_bias_values):
         """
-        w_key  = "w%s"  % key_to_fill
-        BW_key = "BW%s" % key_to_fill
-        R_key  = "R%s"  % key_to_fill
-        L_key  = "L%s"  % key_to_fill
-        C_key  = "C%s"  % key_to_fill
+        Auxilliary method to fit the main resonances of a DC bias sweep.
 
-        previous_param_set[R_key].expr = ''
-        previous_param_set[L_key].expr = ''
-        previous_param_set[C_key].expr = ''
+        The files are fit in order of their DC bias. The first file is fit from scratch, every other file starts from
+        the fitted parameters of its neighbour in the sweep, so a single fit stage is sufficient.
 
-        parameter_set.add(w_key, value=previous_param_set[w_key].value)
-        parameter_set.add(BW_key,value=previous_param_set[BW_key].value)
-        parameter_set.add(R_key, value=r_value)
-        parameter_set.add(L_key, value=previous_param_set[L_key].value)
-        parameter_set.add(C_key, value=previous_param_set[C_key].value)
+        :param fitters: A list containing the instances of all fitters
+        :param dc_bias_values: A list. The current or voltage values of the files
+        :return: None (the parameters are written to the fitters)
+        """
+        sweep_order = self.get_bias_sweep_order(dc_bias_values)
 
-        return parameter_set
+        for it, index in enumerate(sweep_order):
+            fitter = fitters[index]
+            self.report_stage("Main resonance fit: file %d of %d" % (it + 1, len(sweep_order)))
 
-    def switch_key(self, parameter_set_out, parameter_set_in, old_key_number, new_key_number):
+            # Create the main resonance parameters
+            try:
+                fitter.create_nominal_parameters()
+            except Exception:
+                raise Exception("Error: Something went wrong while trying to create nominal parameters; "
+                                "check if the element type is correct")
+
+            if it == 0:
+                match fitter.fit_type:
+                    case constants.El.INDUCTOR:
+                        fitter.fit_main_res_inductor_file_1()
+                    case constants.El.CAPACITOR:
+                        fitter.fit_main_res_capacitor_file_1()
+            else:
+                fitter.seed_main_res_parameters(fitters[sweep_order[it - 1]].parameters)
+                match fitter.fit_type:
+                    case constants.El.INDUCTOR:
+                        fitter.fit_main_res_inductor_file_n()
+                    case constants.El.CAPACITOR:
+                        fitter.fit_main_res_capacitor_file_n()
+
+    def fit_higher_order_bias_sweep(self, fitters, dc_bias_values, num_iterations = 4, curve_fit = True):
         """
-        Auxilliary method to switch a parameter key, necessary when a resonant circuit needs to be mapped to a different
-            frequency
+        Auxilliary method to fit the higher order resonances of a DC bias sweep.
+
+        The files are fit in order of their DC bias. Each file's resonances are matched to the fitted circuits of its
+        neighbour in the sweep and start from those values; only resonances that could not be matched are pre-fit.
 
-        :param parameter_set_out: The Parameters() object to which to write
-        :param parameter_set_in: The Parameters() set containing the key to map to a different key
-        :param old_key_number: The number(key) which needs to be mapped
-        :param new_key_number: The number(key) to map to
-        :return: The parameter_set_out
+        :param fitters: A list containing the instances of all fitters (main resonance already fitted)
+        :param dc_bias_values: A list. The current or voltage values of the files
+        :param num_iterations: Number of iterations for the parameter correction
+        :param curve_fit: Boolean. Whether to do the curve fit of the higher order resonances (can be skipped if a joint
+            fit follows)
+        :return: None (the parameters are written to the fitters)
         """
-        old_w_key  = "w%s"  % old_key_number
-        old_BW_key = "BW%s" % old_key_number
-        old_R_key  = "R%s"  % old_key_number
-        old_L_key  = "L%s"  % old_key_number
-        old_C_key  = "C%s"  % old_key_number
+        sweep_order = self.get_bias_sweep_order(dc_bias_values)
+
+        for it, index in enumerate(sweep_order):
+            fitter = fitters[index]
+            self.report_stage("Higher order fit: file %d of %d" % (it + 1, len(sweep_order)))
+            fitter.get_resonances()
 
-        new_w_key  = "w%s"  % new_key_number
-        new_BW_key = "BW%s" % new_key_number
-        new_R_key  = "R%s"  % new_key_number
-        new_L_key  = "L%s"  % new_key_number
-        new_C_key  = "C%s"  % new_key_number
+            if it == 0:
+                fitter.create_higher_order_parameters()
+            else:
+                fitter.create_higher_order_parameters(seed_set=fitters[sweep_order[it - 1]].parameters)
+                self.logger.info(fitter.name + ": warm start, {seeded} of {order} resonances seeded".format(
+                    seeded=int(np.count_nonzero(fitter.seeded_bands)), order=fitter.order))
 
-        parameter_set_in[old_R_key].expr = ''
-        parameter_set_in[old_L_key].expr = ''
-        parameter_set_in[old_C_key].expr = ''
+            fitter.correct_parameters(change_main=False, num_it=num_iterations)
 
-        parameter_set_out.add(new_w_key, value = parameter_set_in[old_w_key].value)
-        parameter_set_out.add(new_BW_key, value = parameter_set_in[old_BW_key].value)
-        parameter_set_out.add(new_R_key, value = parameter_set_in[old_R_key].value)
-        parameter_set_out.add(new_L_key, value = parameter_set_in[old_L_key].value)
-        parameter_set_out.add(new_C_key, value = parameter_set_in[old_C_key].value)
+            # Only pre-fit the bands that did not get a starting point from the neighbouring file
+            unseeded_bands = np.flatnonzero(np.logical_not(fitter.seeded_bands))
+            if len(unseeded_bands) and config.BAND_PARALLEL_PRE_FIT:
+                fitter.pre_fit_bands_concurrent(bands=unseeded_bands)
+            elif len(unseeded_bands):
+                fitter.pre_fit_bands(bands=unseeded_bands)
 
-        return parameter_set_out
+            if curve_fit:
+                fitter.fit_curve_higher_order()
 
-    def generate_saturation_table(self, parameter_list, key, dc_bias_values):
+    def generate_saturation_table(self, results, key, dc_bias_values):
         """
         Auxilliary function to generate saturation tables.
 
         Saturation tables are current or voltage dependent and have a proportionality factor relative to the reference
         file
 
-        :param parameter_list: A list of all Parameters() objects from the fit
+        :param results: The ParameterMatrix of the fit
         :param key: The Key to generate the saturation table for
         :param dc_bias_values: A list. The current or voltage values.
         :return: String. An LTSpice compatible saturation table
         """
 
-
-        #initialize an empty string
-        saturation_table = ''
-
         #check if we have the requested parameter -> else write the default sat table (0,1) i.e. no change with DC bias
-        try:
-            nominal = parameter_list[0][key].value
-        except:
+        if key not in results:
             print('Parameter ' + key + ' does not exist, can\'t create saturation table')
-            saturation_table = '0.0,1.0'
-            return saturation_table
-
-        for i, value in enumerate(dc_bias_values):
-            try:
-                if key in parameter_list[i]:
-                    saturation_table += str(value) + ','
-                    saturation_table += str(parameter_list[i][key].value / nominal)
-
-                if value != dc_bias_values[-1] and key in parameter_list[i + 1]:
-                    saturation_table += ','
-            except:
-                pass
+            return '0.0,1.0'
 
-        return saturation_table
+        values = results.column(key)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            factors = values / values[0]
+        return ','.join([str(value) + ',' + str(factor) for value, factor in zip(dc_bias_values, factors.tolist())])
 
     def entry_number_callback(self, checkstring):
         """
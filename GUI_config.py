@@ -46,3 +46,15 @@ Z0              :       int = 50
 FILELIST_ROW_OFFSET = 9
 
 
+
+#interval (in ms) in which the GUI polls the messages of a running fit
+RUN_QUEUE_POLL_INTERVAL = 100
+
+#log window; messages are buffered and written to the window in batches
+LOG_MAX_LINES = 5000
+LOG_BUFFER_SIZE = 10000
+LOG_FLUSH_INTERVAL = 100
+#optional log file (None to disable); rotated when it exceeds the size limit (in bytes)
+LOG_FILE = None
+LOG_FILE_MAX_BYTES = 10 * 1024 * 1024
+LOG_FILE_BACKUP_COUNT = 3
@@ -0,0 +1,128 @@
+"""
+Band-local pre-fitting of the higher order circuits.
+
+Every band is fit with only its own circuit free, against a background that contains the main resonance and all other
+circuits. The background is calculated once per band, so each fit is a small independent problem (R, C and w of one
+circuit) that can be sent to a multiprocessing pool. The residual is evaluated by the kernels of kernels.py, through an
+ObjectiveContext created once per band. The functions in this module are on module level, so they can be pickled.
+"""
+
+import numpy as np
+from lmfit import Parameters
+
+import config
+import constants
+import kernels
+from optimizer import minimize
+
+
+def calculate_branch_Z(fit_type, freq, R, L, C):
+    """
+    Function to calculate the impedance of a single higher order circuit; parallel RLC for inductors, serial RLC for
+    capacitors
+
+    :param fit_type: The type of DUT (coil or capacitor)
+    :param freq: The frequency vector
+    :param R: Resistance in Ohm
+    :param L: Inductance in config.INDUNIT
+    :param C: Capacitance in config.CAPUNIT
+    :return: The impedance of the circuit
+    """
+    w = freq * 2 * np.pi
+    Z_C = 1 / (1j * w * C * config.CAPUNIT)
+    Z_L = 1j * w * L * config.INDUNIT
+    match fit_type:
+        case constants.El.INDUCTOR:
+            return 1 / ((1 / Z_C) + (1 / Z_L) + (1 / R))
+        case constants.El.CAPACITOR:
+            return R + Z_L + Z_C
+
+
+def remove_from_background(fit_type, Z, Z_branch):
+    """
+    Function to remove a circuit from a model impedance; inverse of combine_with_background()
+
+    :param fit_type: The type of DUT (coil or capacitor)
+    :param Z: The impedance of the model
+    :param Z_branch: The impedance of the circuit
+    :return: The background impedance
+    """
+    match fit_type:
+        case constants.El.INDUCTOR:
+            return Z - Z_branch
+        case constants.El.CAPACITOR:
+            return 1 / (1 / Z - 1 / Z_branch)
+
+
+def get_band_waves(bandwidths, bands):
+    """
+    Function to sort bands into waves of non-overlapping bands. Bands within a wave can be fit concurrently; the
+    background of a wave is calculated with the results of all previous waves.
+
+    :param bandwidths: The (modeled) bandwidths; rows of [f_lower, f_center, f_upper]
+    :param bands: Indices of the bands to sort
+    :return: A list of waves, each a list of band indices
+    """
+    waves = []
+    wave_limits = []
+    for band in sorted(bands, key=lambda it: bandwidths[it][0]):
+        for wave, limit in zip(waves, wave_limits):
+            if bandwidths[band][0] >= limit[-1]:
+                wave.append(band)
+                limit.append(bandwidths[band][2])
+                break
+        else:
+            waves.append([band])
+            wave_limits.append([bandwidths[band][2]])
+    return waves
+
+
+def _band_residual(parameters, context, background, ser_par, modeflag):
+    """
+    Objective function for a band-local fit
+
+    :param parameters: A Parameters() object containing R, L, C and w of the circuit
+    :param context: The kernels.ObjectiveContext of the band
+    :param background: The background of the band; its impedance for inductors, its admittance for capacitors (see
+        kernels.ObjectiveContext.band_residual())
+    :param ser_par: Whether the circuit is a serial or parallel resonant circuit (1=serial;2=parallel)
+    :param modeflag: The kind of difference to calculate (see Fitter._calculate_Z())
+    :return: The difference between data and model
+    """
+    return context.band_residual(background, parameters['R'].value, parameters['L'].value * config.INDUNIT,
+                                 parameters['C'].value * config.CAPUNIT, ser_par, modeflag)
+
+
+def fit_band(fit_type, freq, data, background, circuit, modeflag = config.FIT_BY):
+    """
+    Function to fit a single circuit against its band
+
+    :param fit_type: The type of DUT (coil or capacitor)
+    :param freq: The frequency vector of the band
+    :param data: The impedance data of the band
+    :param background: The background impedance of the band
+    :param circuit: A dict containing (value, min, max) tuples for the keys 'R', 'C' and 'w' of the circuit
+    :param modeflag: The kind of difference to calculate (see Fitter._calculate_Z())
+    :return: A dict containing the fitted values for 'R', 'L', 'C' and 'w'
+    """
+    param_set = Parameters()
+    for key in ['R', 'C', 'w']:
+        value, min_value, max_value = circuit[key]
+        param_set.add(key, value=value, min=min_value, max=max_value, vary=True)
+    param_set.add('L', expr='(1/((C*' + str(config.CAPUNIT) + ')*(w*' + str(config.FUNIT) + ')**2))/' +
+                            str(config.INDUNIT))
+
+    # the circuits of inductors are parallel RLCs in series with the background, those of capacitors serial RLCs in
+    # parallel with it
+    match fit_type:
+        case constants.El.INDUCTOR:
+            ser_par = 2
+        case constants.El.CAPACITOR:
+            ser_par = 1
+            background = 1 / background
+
+    context = kernels.ObjectiveContext(freq, data)
+    out = minimize(_band_residual, param_set, args=(context, background, ser_par, modeflag),
+                   method='powell', stage='band pre-fit')
+
+    return {key: out.params[key].value for key in ['R', 'L', 'C', 'w']}
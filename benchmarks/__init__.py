@@ -0,0 +1,3 @@
+"""
+Benchmarks of ATMIS; see the modules for their usage.
+"""
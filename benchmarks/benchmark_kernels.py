@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the impedance kernels: compares the time per objective evaluation of the NumPy and the JIT-compiled
+(Numba) kernels and checks that both produce the same residuals. The objective functions are called with an
+ObjectiveContext, as they are by the fits.
+
+Usage: python benchmarks/benchmark_kernels.py [--points 4001 16001] [--order 15] [--repeat 200]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from lmfit import Parameters
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import config
+import constants
+import kernels
+from cmc_fitter import CMC_Fitter
+from fitter import Fitter
+
+
+def create_parameters(fit_type, order):
+    """
+    Function to create a parameter set with a main resonance and higher order circuits (in config units)
+
+    :param fit_type: The type of DUT (coil or capacitor)
+    :param order: The number of higher order circuits
+    :return: A Parameters() object
+    """
+    param_set = Parameters()
+    match fit_type:
+        case constants.El.INDUCTOR:
+            param_set.add('C', value=5e-12 / config.CAPUNIT)
+            param_set.add('L', value=10e-6 / config.INDUNIT)
+            param_set.add('R_Fe', value=20e3)
+        case constants.El.CAPACITOR:
+            param_set.add('C', value=100e-9 / config.CAPUNIT)
+            param_set.add('L', value=1e-9 / config.INDUNIT)
+            param_set.add('R_iso', value=10e6)
+    param_set.add('R_s', value=0.05)
+    param_set.add('C_p', value=1e-12 / config.CAPUNIT)
+
+    for key_number, f_res in enumerate(np.geomspace(50e6, 1.5e9, order), start=1):
+        C_act = 1e-12 / key_number
+        param_set.add('R%s' % key_number, value=1e3 / key_number)
+        param_set.add('C%s' % key_number, value=C_act / config.CAPUNIT)
+        param_set.add('L%s' % key_number, value=1 / ((2 * np.pi * f_res) ** 2 * C_act) / config.INDUNIT)
+
+    return param_set
+
+
+def time_per_call(function, repeat):
+    """
+    Function to measure the mean time per call of a function
+
+    :param function: The function to call (without arguments)
+    :param repeat: The number of calls
+    :return: The mean time per call in seconds
+    """
+    function()
+    start = time.perf_counter()
+    for it in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--points', type=int, nargs='+', default=[4001, 16001])
+    parser.add_argument('--order', type=int, default=config.MAX_ORDER)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    if not kernels.HAS_NUMBA:
+        print("Numba is not installed; only the NumPy kernels are timed")
+
+    print("{:<26}{:>8}{:>14}{:>14}{:>10}{:>14}".format("kernel", "points", "numpy [us]", "jit [us]", "speedup",
+                                                     "max. dev."))
+
+    for n_points in args.points:
+        freq = np.logspace(3, np.log10(2e9), n_points)
+
+        cases = []
+        for name, fit_type in [("coil", constants.El.INDUCTOR), ("capacitor", constants.El.CAPACITOR)]:
+            param_set = create_parameters(fit_type, args.order)
+            # the kernels only need the type of the DUT, so the data processing of the constructor is skipped
+            fitter = Fitter.__new__(Fitter)
+            fitter.fit_type = fit_type
+            fitter.captype = constants.captype.GENERIC
+            data = fitter._calculate_Z(param_set, freq, [], args.order, 0, constants.fcnmode.OUTPUT) * 1.01
+            context = kernels.ObjectiveContext(freq, data)
+            for mode_name, mode in [("FIT", constants.fcnmode.FIT), ("FIT_LOG", constants.fcnmode.FIT_LOG)]:
+                cases.append(("%s %s" % (name, mode_name),
+                              lambda f=fitter, p=param_set, d=context, m=mode:
+                              f._calculate_Z(p, freq, d, args.order, 0, m)))
+
+            rlc_params = Parameters()
+            rlc_params.add('R', value=1e3)
+            rlc_params.add('L', value=1e-8)
+            rlc_params.add('C', value=1e-12)
+            cases.append(("%s single RLC" % name, lambda f=fitter, p=rlc_params, d=context:
+                          f.calc_Z_simple_RLC(p, freq, d, 2, constants.fcnmode.FIT)))
+
+        cmc_fitter = CMC_Fitter.__new__(CMC_Fitter)
+        param_set = create_parameters(constants.El.INDUCTOR, args.order)
+        data = cmc_fitter.calculate_Z_CMC(param_set, freq, [], args.order, 0, constants.fcnmode.OUTPUT, 'OC') * 1.01
+        cases.append(("CMC OC FIT", lambda p=param_set, d=kernels.ObjectiveContext(freq, data):
+                      cmc_fitter.calculate_Z_CMC(p, freq, d, args.order, 0, constants.fcnmode.FIT, 'OC')))
+
+        for name, function in cases:
+            kernels.USE_NUMBA = False
+            numpy_time = time_per_call(function, args.repeat)
+            # the residual is written to the buffer of the context, so it has to be copied
+            numpy_result = function().copy()
+
+            if kernels.HAS_NUMBA:
+                kernels.USE_NUMBA = True
+                jit_time = time_per_call(function, args.repeat)
+                deviation = np.max(abs(function() - numpy_result)) / np.max(abs(numpy_result))
+                print("{:<26}{:>8}{:>14.1f}{:>14.1f}{:>10.1f}{:>14.2E}".format(name, n_points, numpy_time * 1e6,
+                                                                          jit_time * 1e6, numpy_time / jit_time,
+                                                                          deviation))
+            else:
+                print("{:<26}{:>8}{:>14.1f}{:>14}{:>10}{:>14}".format(name, n_points, numpy_time * 1e6, "-", "-", "-"))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the fitting pipeline: synthesizes measurements of known models (see benchmarks/synthetic.py), runs the
+fitting routines headless (see cli.py), times every stage and checks the fitted models against the ground truth.
+
+The results can be written to a JSON file and compared with a previous result; the benchmark fails (exit code 1) if a
+stage got slower than the baseline by more than the tolerance, if a fitted model got worse than the baseline by more than
+the error margin, or if a fitted model deviates from its ground truth by more than the allowed error.
+
+Usage: python benchmarks/benchmark_pipeline.py [--kinds coil cap mlcc electrolytic cmc] [--points 4001] [--order 5]
+       [--noise 1e-4] [--output result.json] [--baseline baseline.json] [--tolerance 1.3] [--max-model-error 6]
+       [--error-margin 0.5]
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import config
+import constants
+import events
+from benchmarks import synthetic
+from cli import CLI
+
+# stages that are shorter than this (in seconds) are not checked for regressions, their timing is mostly noise
+MIN_CHECKED_TIME = 0.05
+
+
+class EventCollector:
+    """
+    Subscriber that collects the finished stages and the fitted models of a run
+    """
+
+    def __init__(self):
+        self.stages = []
+        self.models = {}
+
+    def __call__(self, event):
+        match event['event']:
+            case 'stage_end':
+                self.stages.append(event)
+            case 'model':
+                for file, values in zip(event['files'], event['parameters']):
+                    self.models[file] = (values, event['order'])
+
+
+def fitted_model(values, order, truth):
+    """
+    Function to convert the fitted parameters (config units) to a model of the same form as the ground truth (SI units)
+
+    :param values: The fitted values (a valuesdict())
+    :param order: The order of the fitted model
+    :param truth: The ground truth the model belongs to
+    :return: A dict of the same form as the ground truth
+    """
+    model = {'fit_type': truth['fit_type'], 'C': values['C'] * config.CAPUNIT, 'L': values['L'] * config.INDUNIT,
+             'R_s': values['R_s'], 'branches': []}
+
+    for key_number in range(1, order + 1):
+        if 'R%s' % key_number not in values:
+            continue
+        R = values['R%s' % key_number]
+        L = values['L%s' % key_number] * config.INDUNIT
+        C = values['C%s' % key_number] * config.CAPUNIT
+        branch = {'f': 1 / (2 * np.pi * np.sqrt(L * C)), 'R': R}
+        branch['C' if truth['fit_type'] == constants.El.INDUCTOR else 'L'] = \
+            C if truth['fit_type'] == constants.El.INDUCTOR else L
+        model['branches'].append(branch)
+
+    match truth['fit_type']:
+        case constants.El.INDUCTOR:
+            model['R_Fe'] = values['R_Fe']
+        case constants.El.CAPACITOR:
+            model['R_iso'] = values['R_iso']
+            if 'R_A' in values:
+                model['acoustic'] = {'R_A': values['R_A'], 'L_A': values['L_A'] * config.INDUNIT,
+                                     'C_A': values['C_A'] * config.CAPUNIT}
+    return model
+
+
+def check_recovery(model, truth, freq):
+    """
+    Function to compare a fitted model with its ground truth
+
+    :param model: The fitted model (see fitted_model())
+    :param truth: The ground truth
+    :param freq: The frequency vector the model error is calculated for
+    :return: A dict containing the relative errors of the main parameters, the number of recovered higher order circuits
+        (resonance frequency within 5%), the max. relative error of their frequencies and the rms error of the
+        magnitude of the model in dB
+    """
+    result = {key: abs(model[key] / truth[key] - 1) for key in ['L', 'C', 'R_s']}
+
+    f_true = np.array([branch['f'] for branch in truth['branches']])
+    f_fit = np.array([branch['f'] for branch in model['branches']])
+    if len(f_true) and len(f_fit):
+        errors = np.array([np.min(abs(f_fit / f - 1)) for f in f_true])
+        result['recovered'] = int(np.sum(errors < 0.05))
+        result['f_error'] = float(np.max(errors))
+    else:
+        result['recovered'] = 0
+        result['f_error'] = None
+    result['order'] = len(f_fit)
+    result['true_order'] = len(f_true)
+
+    Z_true = synthetic.model_impedance(truth, freq)
+    Z_fit = synthetic.model_impedance(model, freq)
+    result['model_error_dB'] = float(np.sqrt(np.mean((20 * np.log10(abs(Z_fit) / abs(Z_true))) ** 2)))
+    return result
+
+
+def run_case(cli, kind, directory, args):
+    """
+    Function to synthesize the measurements of a case, fit them and collect the results
+
+    :param cli: The CLI instance that runs the fits
+    :param kind: One of synthetic.MODEL_KINDS
+    :param directory: The directory for the measurement files and the results of the fit
+    :param args: The arguments of the benchmark
+    :return: A dict containing the total time, the time and evaluations per stage and the recovery per file
+    """
+    measurements = synthetic.generate(kind, os.path.join(directory, kind), points=args.points, order=args.order,
+                                      noise=args.noise, bias_values=args.bias, seed=args.seed)
+
+    collector = EventCollector()
+    events.subscribe(collector)
+    start_time = time.perf_counter()
+    try:
+        if kind == 'cmc':
+            cli.run_cmc({measurement['mode']: measurement['path'] for measurement in measurements})
+        else:
+            truth = measurements[0]['truth']
+            # the bathtub model needs the nominal value
+            nominal_value = truth['C'] if truth['captype'] == constants.captype.HIGH_C else None
+            cli.run([measurement['path'] for measurement in measurements], truth['fit_type'],
+                    captype=truth['captype'], dc_bias=[measurement['bias'] for measurement in measurements],
+                    nominal_value=nominal_value)
+    finally:
+        events.unsubscribe(collector)
+    total_time = time.perf_counter() - start_time
+
+    stages = defaultdict(lambda: {'wall': 0.0, 'nfev': 0, 'calls': 0})
+    for event in collector.stages:
+        if event['stage'] == 'run':
+            continue
+        stages[event['stage']]['wall'] += event['elapsed']
+        stages[event['stage']]['nfev'] += event['nfev']
+        stages[event['stage']]['calls'] += 1
+
+    freq = np.geomspace(1e3, config.FREQ_UPPER_LIMIT * (1 - 1e-6), 2001)
+    recovery = {}
+    for measurement in measurements:
+        name = os.path.splitext(os.path.basename(measurement['path']))[0]
+        if name not in collector.models:
+            recovery[name] = None
+            continue
+        values, order = collector.models[name]
+        recovery[name] = check_recovery(fitted_model(values, order, measurement['truth']), measurement['truth'], freq)
+
+    return {'total': total_time, 'stages': dict(stages), 'recovery': recovery}
+
+
+def print_results(results, baseline):
+    """
+    Function to print the timing and the recovery tables
+
+    :param results: The results of all cases
+    :param baseline: (optional) The results of a previous run
+    :return: None
+    """
+    print("{:<14}{:<24}{:>8}{:>12}{:>10}{:>14}{:>8}".format("case", "stage", "calls", "wall [s]", "nfev",
+                                                            "baseline [s]", "ratio"))
+    for case, result in results.items():
+        rows = list(result['stages'].items()) + [('total', {'wall': result['total'], 'nfev': '', 'calls': ''})]
+        for stage, timing in rows:
+            reference = baseline.get(case, {}) if baseline else {}
+            if stage == 'total':
+                reference_time = reference.get('total')
+            else:
+                reference_time = reference.get('stages', {}).get(stage, {}).get('wall')
+            print("{:<14}{:<24}{:>8}{:>12.3f}{:>10}{:>14}{:>8}".format(
+                case, stage, timing['calls'], timing['wall'], timing['nfev'],
+                "%.3f" % reference_time if reference_time is not None else "-",
+                "%.2f" % (timing['wall'] / reference_time) if reference_time else "-"))
+
+    print()
+    print("{:<14}{:<16}{:>8}{:>8}{:>8}{:>10}{:>10}{:>10}{:>12}".format("case", "file", "L err", "C err", "R_s err",
+                                                                      "order", "found", "f err", "|Z| [dB]"))
+    for case, result in results.items():
+        for file, recovery in result['recovery'].items():
+            if recovery is None:
+                print("{:<14}{:<16}{:>8}".format(case, file, "no model"))
+                continue
+            print("{:<14}{:<16}{:>8.3f}{:>8.3f}{:>8.3f}{:>10}{:>10}{:>10}{:>12.3f}".format(
+                case, file, recovery['L'], recovery['C'], recovery['R_s'],
+                "%d/%d" % (recovery['order'], recovery['true_order']), recovery['recovered'],
+                "%.3f" % recovery['f_error'] if recovery['f_error'] is not None else "-", recovery['model_error_dB']))
+
+
+def find_failures(results, baseline, tolerance, max_model_error, error_margin):
+    """
+    Function to check the results for timing regressions and models that deviate from their ground truth
+
+    :param results: The results of all cases
+    :param baseline: (optional) The results of a previous run
+    :param tolerance: The allowed ratio of a stage's time to its baseline
+    :param max_model_error: The allowed rms error of the model magnitude in dB
+    :param error_margin: The allowed increase of the model error over the baseline in dB
+    :return: A list of strings describing the failures
+    """
+    failures = []
+    for case, result in results.items():
+        for file, recovery in result['recovery'].items():
+            if recovery is None:
+                failures.append("%s: no model for %s" % (case, file))
+            elif recovery['model_error_dB'] > max_model_error:
+                failures.append("%s: model error of %s is %.2f dB" % (case, file, recovery['model_error_dB']))
+
+        if not baseline or case not in baseline:
+            continue
+        for file, recovery in result['recovery'].items():
+            reference = baseline[case]['recovery'].get(file)
+            if recovery is None or reference is None:
+                continue
+            if recovery['model_error_dB'] > reference['model_error_dB'] + error_margin:
+                failures.append("%s: model error of %s is %.2f dB (baseline %.2f dB)"
+                                % (case, file, recovery['model_error_dB'], reference['model_error_dB']))
+
+        for stage, timing in result['stages'].items():
+            reference = baseline[case]['stages'].get(stage)
+            if reference is None or max(reference['wall'], timing['wall']) < MIN_CHECKED_TIME:
+                continue
+            if timing['wall'] > reference['wall'] * tolerance:
+                failures.append("%s: %s took %.3f s (baseline %.3f s)" % (case, stage, timing['wall'],
+                                                                          reference['wall']))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--kinds', nargs='+', choices=synthetic.MODEL_KINDS, default=synthetic.MODEL_KINDS)
+    parser.add_argument('--points', type=int, default=4001)
+    parser.add_argument('--order', type=int, default=5)
+    parser.add_argument('--noise', type=float, default=1e-4)
+    parser.add_argument('--bias', type=float, nargs='+', default=[0, 0.5, 1.0])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--processes', type=int)
+    parser.add_argument('--workdir', help="directory for the measurements and fit results (default: temporary)")
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--baseline', help="compare the results with this JSON file")
+    parser.add_argument('--tolerance', type=float, default=1.3)
+    parser.add_argument('--max-model-error', type=float, default=6.0)
+    parser.add_argument('--error-margin', type=float, default=0.5)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR, format='%(message)s')
+    directory = args.workdir if args.workdir is not None else tempfile.mkdtemp(prefix='atmis_benchmark_')
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = json.load(file)['results']
+
+    cli = CLI(args.processes)
+    results = {}
+    try:
+        for kind in args.kinds:
+            results[kind] = run_case(cli, kind, directory, args)
+    finally:
+        cli.close()
+
+    print_results(results, baseline)
+
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump({'settings': {'points': args.points, 'order': args.order, 'noise': args.noise,
+                                    'bias': args.bias, 'seed': args.seed}, 'results': results}, file, indent=2)
+
+    failures = find_failures(results, baseline, args.tolerance, args.max_model_error, args.error_margin)
+    if failures:
+        print("\nFAILED:\n  " + "\n  ".join(failures))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Scaling benchmark of the fitting routines: sweeps the number of frequency points (at a fixed order) and the order of the
+model (at a fixed number of points), times the objective function, the bandwidth model, the resonance detection, the
+parameter correction, the pre-fit and the full fit, and fits the empirical complexity t ~ n^k of every routine to both
+sweeps.
+
+The results (times and exponents) can be written to a JSON file for trend tracking and compared with a previous result;
+the benchmark fails (exit code 1) if the exponent of a routine exceeds the exponent of the baseline by more than the
+margin, i.e. if a change makes the routine scale worse.
+
+Usage: python benchmarks/benchmark_scaling.py [--points 201 1001 4001 16001] [--orders 1 2 4 8 15] [--output result.json]
+       [--baseline baseline.json] [--margin 0.3]
+"""
+
+import argparse
+import copy
+import json
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import config
+import constants
+import kernels
+from benchmarks import synthetic
+from fitter import Fitter
+
+ROUTINES = ['_calculate_Z', 'model_bandwidth', 'get_resonances', 'correct_parameters', 'pre_fit_bands',
+            'fit_curve_higher_order']
+
+# the CM coil of the synthetic CMC has the lowest main resonance and thus room for MAX_ORDER separated circuits
+MODEL_KIND = 'cmc CM'
+F_MIN = 1e3
+F_MAX = 2e9
+
+# number of objective evaluations that are averaged for the time per call
+EVALUATIONS = 100
+
+
+def create_fitter(points, order, noise, seed):
+    """
+    Function to create a fitter for a synthetic coil with its main resonance fitted, i.e. in the state the higher order
+    routines of the pipeline start from
+
+    :param points: The number of frequency points
+    :param order: The number of higher order circuits of the synthetic coil
+    :param noise: The relative noise of the impedance
+    :param seed: The seed of the noise
+    :return: A Fitter instance
+    """
+    truth = synthetic.create_truth(MODEL_KIND, order, 0, F_MAX)
+    freq = np.geomspace(F_MIN, F_MAX * (1 - 1e-6), points)
+    rng = np.random.default_rng(seed)
+    Z = synthetic.model_impedance(truth, freq) * (1 + noise * (rng.standard_normal(points)
+                                                               + 1j * rng.standard_normal(points)))
+
+    fitter = Fitter('scaling', freq, Z, constants.El.INDUCTOR)
+    fitter.create_nominal_parameters()
+    fitter.fit_main_res_inductor_file_1()
+    return fitter
+
+
+def best_time(function, repeat):
+    """
+    Function to measure the shortest time of several calls of a function
+
+    :param function: The function to call (without arguments)
+    :param repeat: The number of calls
+    :return: The shortest time in seconds
+    """
+    times = []
+    for it in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def time_routines(fitter, repeat):
+    """
+    Function to time the routines for one fitter; the routines are run in the order of the pipeline, so every routine
+    starts from the result of the previous one
+
+    :param fitter: The fitter (see create_fitter())
+    :param repeat: The number of repetitions of the routines that do not run an optimizer; their shortest time is taken
+    :return: A dict containing the time of every routine in seconds and the order of the detected model
+    """
+    timings = {'get_resonances': best_time(fitter.get_resonances, repeat)}
+    fitter.create_higher_order_parameters()
+
+    context = kernels.ObjectiveContext(fitter.freq, fitter.z21_data)
+    evaluate = lambda: fitter._calculate_Z(fitter.parameters, fitter.freq, context, fitter.order, 0, config.FIT_BY)
+    timings['_calculate_Z'] = best_time(lambda: [evaluate() for it in range(EVALUATIONS)], repeat) / EVALUATIONS
+
+    def model_bands():
+        for f_lower, f_center, f_upper in fitter.bandwidths:
+            window = (fitter.freq > f_lower / 1.2) & (fitter.freq < f_upper * 1.2)
+            data = fitter.data_mag[window] * np.exp(1j * np.radians(fitter.data_ang[window]))
+            fitter.model_bandwidth(fitter.freq[window], data, f_center)
+    timings['model_bandwidth'] = best_time(model_bands, repeat) / max(fitter.order, 1)
+
+    parameters = copy.deepcopy(fitter.parameters)
+    timings['correct_parameters'] = best_time(
+        lambda: fitter.correct_parameters(copy.deepcopy(parameters), change_main=False, num_it=4), repeat)
+
+    # the fits take long enough to be timed once
+    timings['pre_fit_bands'] = best_time(fitter.pre_fit_bands, 1)
+    timings['fit_curve_higher_order'] = best_time(fitter.fit_curve_higher_order, 1)
+    timings['order'] = fitter.order
+    return timings
+
+
+def complexity_exponent(x, t):
+    """
+    Function to fit the exponent k of t ~ x^k
+
+    :param x: The sizes of the problem
+    :param t: The times
+    :return: The exponent, or None if there are less than two usable sizes
+    """
+    x = np.asarray(x, dtype=float)
+    t = np.asarray(t, dtype=float)
+    usable = (x > 0) & (t > 0)
+    if len(np.unique(x[usable])) < 2:
+        return None
+    return float(np.polyfit(np.log(x[usable]), np.log(t[usable]), 1)[0])
+
+
+def sweep(cases, args, size):
+    """
+    Function to run a sweep and fit the complexity of every routine
+
+    :param cases: A list of (points, order) tuples
+    :param args: The arguments of the benchmark
+    :param size: The size the complexity is fit to; 'points' or 'order' (the order of the detected model)
+    :return: A dict containing 'x' (the sizes), the times and the exponent of every routine
+    """
+    result = {'x': [], 'times': {routine: [] for routine in ROUTINES}, 'exponents': {}}
+    for points, order in cases:
+        fitter = create_fitter(points, order, args.noise, args.seed)
+        timings = time_routines(fitter, args.repeat)
+        result['x'].append(len(fitter.freq) if size == 'points' else timings['order'])
+        for routine in ROUTINES:
+            result['times'][routine].append(timings[routine])
+        print("{:<8}{:>8}{:>8}".format(size, points, timings['order']) +
+              "".join(["{:>14.4f}".format(timings[routine]) for routine in ROUTINES]))
+
+    for routine in ROUTINES:
+        result['exponents'][routine] = complexity_exponent(result['x'], result['times'][routine])
+    return result
+
+
+def find_failures(results, baseline, margin):
+    """
+    Function to compare the exponents with the baseline
+
+    :param results: The results of both sweeps
+    :param baseline: The results of a previous run
+    :param margin: The allowed increase of an exponent
+    :return: A list of strings describing the failures
+    """
+    failures = []
+    for size, result in results.items():
+        for routine, exponent in result['exponents'].items():
+            reference = baseline.get(size, {}).get('exponents', {}).get(routine)
+            if exponent is None or reference is None:
+                continue
+            if exponent > reference + margin:
+                failures.append("%s scales with %s^%.2f (baseline %s^%.2f)" % (routine, size, exponent, size,
+                                                                               reference))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--points', type=int, nargs='+', default=[201, 1001, 4001, 16001])
+    parser.add_argument('--orders', type=int, nargs='+', default=[1, 2, 4, 8, config.MAX_ORDER])
+    parser.add_argument('--fixed-order', type=int, default=5, help="order of the point sweep")
+    parser.add_argument('--fixed-points', type=int, default=2001, help="number of points of the order sweep")
+    parser.add_argument('--noise', type=float, default=1e-4)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--baseline', help="compare the exponents with this JSON file")
+    parser.add_argument('--margin', type=float, default=0.3)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR, format='%(message)s')
+
+    print("times in s; _calculate_Z and model_bandwidth per call")
+    print("{:<8}{:>8}{:>8}".format("sweep", "points", "order") +
+          "".join(["{:>14}".format(routine[:13]) for routine in ROUTINES]))
+    results = {'points': sweep([(points, args.fixed_order) for points in args.points], args, 'points'),
+               'order': sweep([(args.fixed_points, order) for order in args.orders], args, 'order')}
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = json.load(file)['results']
+
+    print()
+    print("{:<26}{:>12}{:>12}{:>12}{:>12}".format("routine", "k(points)", "baseline", "k(order)", "baseline"))
+    for routine in ROUTINES:
+        row = [routine]
+        for size in ['points', 'order']:
+            exponent = results[size]['exponents'][routine]
+            reference = baseline.get(size, {}).get('exponents', {}).get(routine) if baseline else None
+            row += ["%.2f" % exponent if exponent is not None else "-",
+                    "%.2f" % reference if reference is not None else "-"]
+        print("{:<26}{:>12}{:>12}{:>12}{:>12}".format(*row))
+
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump({'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'settings': {'points': args.points, 'orders': args.orders, 'fixed_order': args.fixed_order,
+                                    'fixed_points': args.fixed_points, 'noise': args.noise, 'seed': args.seed},
+                       'results': results}, file, indent=2)
+
+    failures = find_failures(results, baseline, args.margin) if baseline else []
+    if failures:
+        print("\nFAILED:\n  " + "\n  ".join(failures))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+"""
+Synthetic measurements for the benchmarks.
+
+Creates Touchstone files from ladder models with known parameters, so the results of a fit can be checked against the
+ground truth:
+
+- 'coil': main resonance (R_s + L||R_Fe)||C with parallel resonance circuits in series
+- 'cap': main resonance R_s + L + C||R_iso with series resonance circuits in parallel
+- 'mlcc': capacitor with an acoustic resonance (series R_A, L_A, C_A in parallel) that appears with DC bias
+- 'electrolytic': capacitor with a large capacitance and ESR, i.e. a bathtub shaped impedance
+- 'cmc': the DM and CM measurements of a common mode choke (two coils of different inductance)
+
+All values of the ground truth are in SI units; the frequency of a higher order circuit is given instead of its
+inductance (coils) or capacitance (capacitors).
+"""
+
+import os
+
+import numpy as np
+import skrf as rf
+
+import constants
+
+MODEL_KINDS = ['coil', 'cap', 'mlcc', 'electrolytic', 'cmc']
+
+# quality factor of the higher order circuits and ratio of the resonance peak to the background impedance
+BRANCH_Q = 8
+BRANCH_CONTRAST = 5
+
+
+def coil_impedance(freq, L, C, R_s, R_Fe, branches = ()):
+    """
+    Function to calculate the impedance of a coil model
+
+    :param freq: The frequency vector
+    :param L: Inductance in H
+    :param C: Parasitic capacitance in F
+    :param R_s: Series resistance in Ohm
+    :param R_Fe: Core loss resistance in Ohm
+    :param branches: Parallel resonance circuits in series; list of dicts with the keys 'f', 'R' and 'C'
+    :return: The impedance (complex ndarray)
+    """
+    w = 2 * np.pi * freq
+    Z = 1 / (1 / (R_s + 1 / (1 / R_Fe + 1 / (1j * w * L))) + 1j * w * C)
+    for branch in branches:
+        L_b = 1 / ((2 * np.pi * branch['f']) ** 2 * branch['C'])
+        Z = Z + 1 / (1 / branch['R'] + 1j * w * branch['C'] + 1 / (1j * w * L_b))
+    return Z
+
+
+def capacitor_impedance(freq, C, L, R_s, R_iso, branches = (), acoustic = None):
+    """
+    Function to calculate the impedance of a capacitor model
+
+    :param freq: The frequency vector
+    :param C: Capacitance in F
+    :param L: Parasitic inductance in H
+    :param R_s: Series resistance in Ohm
+    :param R_iso: Insulation resistance in Ohm
+    :param branches: Series resonance circuits in parallel; list of dicts with the keys 'f', 'R' and 'L'
+    :param acoustic: (optional) The acoustic resonance of an MLCC; dict with the keys 'R_A', 'L_A' and 'C_A'
+    :return: The impedance (complex ndarray)
+    """
+    w = 2 * np.pi * freq
+    Y = 1 / (R_s + 1j * w * L + 1 / (1 / R_iso + 1j * w * C))
+    for branch in branches:
+        C_b = 1 / ((2 * np.pi * branch['f']) ** 2 * branch['L'])
+        Y = Y + 1 / (branch['R'] + 1j * w * branch['L'] + 1 / (1j * w * C_b))
+    if acoustic is not None:
+        Y = Y + 1 / (acoustic['R_A'] + 1j * w * acoustic['L_A'] + 1 / (1j * w * acoustic['C_A']))
+    return 1 / Y
+
+
+def coil_branches(f0, C, order, f_max):
+    """
+    Function to place the higher order circuits of a coil between the main resonance and the upper frequency limit; the
+    circuits are scaled to stand out of the capacitive background by BRANCH_CONTRAST
+
+    :param f0: The main resonance frequency
+    :param C: The parasitic capacitance in F
+    :param order: The number of circuits
+    :param f_max: The upper frequency limit
+    :return: A list of dicts with the keys 'f', 'R' and 'C'
+    """
+    branches = []
+    for f_res in np.geomspace(f0 * 4, f_max * 0.6, order):
+        w = 2 * np.pi * f_res
+        R = BRANCH_CONTRAST / (w * C)
+        branches.append({'f': f_res, 'R': R, 'C': BRANCH_Q / (R * w)})
+    return branches
+
+
+def capacitor_branches(f0, L, order, f_max):
+    """
+    Function to place the higher order circuits of a capacitor between the main resonance and the upper frequency limit;
+    the circuits are scaled to stand out of the inductive background by BRANCH_CONTRAST
+
+    :param f0: The main resonance frequency
+    :param L: The parasitic inductance in H
+    :param order: The number of circuits
+    :param f_max: The upper frequency limit
+    :return: A list of dicts with the keys 'f', 'R' and 'L'
+    """
+    branches = []
+    for f_res in np.geomspace(f0 * 4, f_max * 0.6, order):
+        w = 2 * np.pi * f_res
+        R = w * L / BRANCH_CONTRAST
+        branches.append({'f': f_res, 'R': R, 'L': BRANCH_Q * R / w})
+    return branches
+
+
+def create_truth(kind, order, bias, f_max):
+    """
+    Function to create the ground truth of a DUT at a given DC bias. The inductance of coils and the capacitance of
+    capacitors drop with the bias; the higher order circuits do not depend on the bias
+
+    :param kind: One of MODEL_KINDS; for 'cmc', 'DM' or 'CM' has to be appended (e.g. 'cmc DM')
+    :param order: The number of higher order circuits
+    :param bias: The DC bias (relative to the saturation current/voltage)
+    :param f_max: The upper frequency limit
+    :return: A dict containing 'fit_type', 'captype', the main resonance parameters and 'branches' (and 'acoustic'
+        for MLCCs)
+    """
+    saturation = 1 / (1 + bias ** 2)
+    match kind:
+        case 'coil' | 'cmc DM' | 'cmc CM':
+            L0, C, R_Fe = {'coil': (10e-6, 5e-12, 20e3), 'cmc DM': (2e-6, 10e-12, 5e3),
+                           'cmc CM': (1e-3, 20e-12, 50e3)}[kind]
+            truth = {'fit_type': constants.El.INDUCTOR, 'captype': None, 'L': L0 * saturation, 'C': C, 'R_s': 0.05,
+                     'R_Fe': R_Fe}
+            f0_ref = 1 / (2 * np.pi * np.sqrt(L0 * C))
+            truth['branches'] = coil_branches(f0_ref, C, order, f_max)
+        case 'cap' | 'mlcc' | 'electrolytic':
+            C0, L, R_s = {'cap': (100e-9, 1e-9, 0.01), 'mlcc': (1e-6, 0.5e-9, 0.005),
+                          'electrolytic': (1e-3, 10e-9, 0.05)}[kind]
+            truth = {'fit_type': constants.El.CAPACITOR,
+                     'captype': {'cap': constants.captype.GENERIC, 'mlcc': constants.captype.MLCC,
+                                 'electrolytic': constants.captype.HIGH_C}[kind],
+                     'C': C0 * saturation, 'L': L, 'R_s': R_s, 'R_iso': 10e6}
+            f0_ref = 1 / (2 * np.pi * np.sqrt(L * C0))
+            # the bathtub model has at most one higher order circuit
+            truth['branches'] = capacitor_branches(f0_ref, L, min(order, 1) if kind == 'electrolytic' else order,
+                                                   f_max)
+            if kind == 'mlcc' and bias > 0:
+                # the acoustic resonance is below the main resonance and grows with the bias
+                f_A = f0_ref / 20
+                w_A = 2 * np.pi * f_A
+                R_A = 2 / (w_A * truth['C'] * bias)
+                L_A = 20 * R_A / w_A
+                truth['acoustic'] = {'R_A': R_A, 'L_A': L_A, 'C_A': 1 / (w_A ** 2 * L_A)}
+        case _:
+            raise ValueError("Unknown model kind: %s" % kind)
+    return truth
+
+
+def model_impedance(truth, freq):
+    """
+    Function to calculate the impedance of a ground truth
+
+    :param truth: The ground truth (see create_truth())
+    :param freq: The frequency vector
+    :return: The impedance (complex ndarray)
+    """
+    match truth['fit_type']:
+        case constants.El.INDUCTOR:
+            return coil_impedance(freq, truth['L'], truth['C'], truth['R_s'], truth['R_Fe'], truth['branches'])
+        case constants.El.CAPACITOR:
+            return capacitor_impedance(freq, truth['C'], truth['L'], truth['R_s'], truth['R_iso'], truth['branches'],
+                                       truth.get('acoustic'))
+
+
+def write_touchstone(path, freq, Z, noise = 0.0, seed = 0, shunt_series = constants.SERIES_THROUGH, Z0 = 50):
+    """
+    Function to write an impedance to a Touchstone (.s2p) file, as measured in series through or shunt through
+    configuration
+
+    :param path: The path of the file; the extension is added
+    :param freq: The frequency vector
+    :param Z: The impedance
+    :param noise: (optional) The relative standard deviation of complex gaussian noise added to S21
+    :param seed: (optional) The seed of the noise
+    :param shunt_series: (optional) The measurement configuration
+    :param Z0: (optional) The reference impedance
+    :return: The path of the written file
+    """
+    match shunt_series:
+        case constants.SERIES_THROUGH:
+            s21 = 2 * Z0 / (2 * Z0 + Z)
+        case constants.SHUNT_THROUGH:
+            s21 = 2 * Z / (2 * Z + Z0)
+
+    rng = np.random.default_rng(seed)
+    s21 = s21 * (1 + noise * (rng.standard_normal(len(freq)) + 1j * rng.standard_normal(len(freq))))
+
+    s = np.zeros((len(freq), 2, 2), dtype=complex)
+    s[:, 1, 0] = s[:, 0, 1] = s21
+    s[:, 0, 0] = s[:, 1, 1] = 1 - s21
+
+    network = rf.Network(frequency=rf.Frequency.from_f(freq, unit='hz'), s=s, name=os.path.basename(path))
+    network.write_touchstone(path)
+    return path + '.s2p'
+
+
+def generate(kind, directory, points = 4001, order = 5, noise = 1e-4, bias_values = (0, 0.5, 1.0), f_min = 1e3,
+             f_max = 2e9, seed = 0):
+    """
+    Function to generate the measurement files of a DUT
+
+    :param kind: One of MODEL_KINDS
+    :param directory: The directory the files are written to
+    :param points: (optional) The number of frequency points
+    :param order: (optional) The number of higher order circuits
+    :param noise: (optional) The relative noise of S21
+    :param bias_values: (optional) The DC bias values (relative to saturation); one file per value. Electrolytic
+        capacitors and CMCs only use the first value
+    :param f_min: (optional) The lower frequency limit
+    :param f_max: (optional) The upper frequency limit
+    :param seed: (optional) The seed of the noise
+    :return: A list of dicts containing 'path', 'bias' and 'truth' for every file (for CMCs also 'mode')
+    """
+    os.makedirs(directory, exist_ok=True)
+    # the upper limit is kept just below f_max, since the fitter drops points at and above the limit
+    freq = np.geomspace(f_min, f_max * (1 - 1e-6), points)
+
+    measurements = []
+    if kind == 'cmc':
+        for mode in ['DM', 'CM']:
+            truth = create_truth('cmc ' + mode, order, bias_values[0], f_max)
+            path = write_touchstone(os.path.join(directory, "cmc_%s" % mode), freq, model_impedance(truth, freq),
+                                    noise, seed)
+            measurements.append({'path': path, 'bias': bias_values[0], 'truth': truth, 'mode': mode})
+        return measurements
+
+    if kind == 'electrolytic':
+        bias_values = bias_values[:1]
+
+    for it, bias in enumerate(bias_values):
+        truth = create_truth(kind, order, bias, f_max)
+        path = write_touchstone(os.path.join(directory, "%s_%d" % (kind, it)), freq, model_impedance(truth, freq),
+                                noise, seed + it)
+        measurements.append({'path': path, 'bias': bias, 'truth': truth})
+    return measurements
@@ -0,0 +1,53 @@
+"""
+Cooperative cancellation of a fitting run.
+
+A run is executed in a background thread of the GUI; it can not be interrupted from the outside, so it checks the
+cancel event at the boundaries of its stages and while it waits for the tasks of the multiprocessing pool. Fits that are
+running when the event is set are stopped by the optimizer (see optimizer.ConvergenceMonitor) and return the best
+parameters found so far. Tasks that run on the pool can not check the event; the pool is terminated instead.
+"""
+
+import multiprocessing
+import threading
+import time
+
+import constants
+
+# set to request the cancellation of the current run
+CANCEL_EVENT = threading.Event()
+
+
+class FitCancelled(Exception):
+    """
+    Exception that is raised in the fitting pipeline if the run has been cancelled
+    """
+    pass
+
+
+def check_cancelled():
+    """
+    Function to raise a FitCancelled exception if the cancellation of the run has been requested
+
+    :return: None
+    """
+    if CANCEL_EVENT.is_set():
+        raise FitCancelled("Fit cancelled")
+
+
+def wait_for(async_result, timeout = None):
+    """
+    Function to wait for the result of a pool task. Unlike AsyncResult.get(), this returns if the run is cancelled;
+    the result of a task of a terminated pool would never be set.
+
+    :param async_result: An AsyncResult of a multiprocessing pool
+    :param timeout: (optional) The maximum time to wait in seconds
+    :return: The result of the task
+    :raises multiprocessing.TimeoutError: If the task is not done within the timeout
+    """
+    deadline = None if timeout is None else time.perf_counter() + timeout
+    while not async_result.ready():
+        check_cancelled()
+        if deadline is not None and time.perf_counter() > deadline:
+            raise multiprocessing.TimeoutError("Task not done after %.1f s" % timeout)
+        async_result.wait(constants.CANCEL_POLL_INTERVAL)
+    return async_result.get()
@@ -0,0 +1,245 @@
+"""
+Command line interface; runs the fitting routines of the GUI without opening a window, e.g.
+
+    python cli.py --bias 0 0.5 1 ref.s2p bias_500mA.s2p bias_1A.s2p
+
+The first file is the reference file. The stages of the run (see events.py) are printed to the console as they finish,
+with their file, order, number of evaluations and elapsed time; --run-log writes all events to a JSON-lines file and
+--profile prints a profile of the run (see profiling.py), --memory the memory used by its stages and workers
+(see memory_profiling.py). The exit status is 1 if the fit failed.
+"""
+
+import argparse
+import logging
+import os
+import queue
+import sys
+import threading
+
+import matplotlib
+# the plots are only saved, there is no window to show them in
+matplotlib.use('Agg')
+
+import skrf as rf
+
+import config
+import constants
+import events
+import GUI_config
+from GUI import GUI
+from iohandler import IOhandler
+from worker_pool import WorkerPool
+
+CAPTYPES = {'generic': constants.captype.GENERIC, 'mlcc': constants.captype.MLCC,
+            'electrolytic': constants.captype.HIGH_C}
+
+
+class ConsoleReporter:
+    """
+    Subscriber that prints the progress messages and the finished stages of a run to the console
+    """
+
+    def __init__(self, show_fits = False):
+        """
+        :param show_fits: (optional) print every optimizer call as well
+        """
+        self.show_fits = show_fits
+
+    def __call__(self, event):
+        match event['event']:
+            case 'progress':
+                print("== %s" % event['message'])
+            case 'stage_end':
+                order = event.get('order')
+                print("{file:<24} {stage:<24} order {order:<4} {nfev:>8} evaluations {elapsed:8.2f} s  {status}"
+                      .format(file=str(event['file'] or '-'), stage=event['stage'],
+                              order=str(order) if order is not None else '-', nfev=event['nfev'],
+                              elapsed=event['elapsed'], status=event['status']))
+            case 'reduction':
+                print("{file:<24} model reduced from order {order} to {reduced_order}, rms error {error:.3f} dB -> "
+                      "{reduced_error:.3f} dB".format(**event))
+            case 'fit' if self.show_fits:
+                print("{file:<24} {stage:<24} {nvarys:>4} parameters {nfev:>8} evaluations {elapsed:8.2f} s  "
+                      "residual {residual:.4E}".format(file=str(event['file'] or '-'), stage=str(event['stage']),
+                                                      nvarys=event['nvarys'], nfev=event['nfev'],
+                                                      elapsed=event['elapsed'], residual=event['residual']))
+
+
+class CLI(GUI):
+    """
+    Runs the fitting routines of the GUI in the foreground; the inputs are taken from the command line instead of the
+    widgets
+    """
+
+    def __init__(self, processes = None, logger_instance = logging.getLogger()):
+        """
+        :param processes: (optional) A fixed number of workers of the pool; if not supplied, the pool is sized per
+            batch (see worker_pool.plan_batch())
+        :param logger_instance: A logger instance
+        """
+        self.logger = logger_instance
+        self.iohandler = IOhandler(self.logger)
+        self.worker_pool = WorkerPool(processes, logger_instance=self.logger)
+        self.mp_pool = None
+        self.timeouts = []
+        self.run_failed = False
+        self.run_queue = queue.Queue()
+        # serializes the calls that the GUI would run on the Tk main thread (pyplot is not thread-safe)
+        self.main_thread_lock = threading.Lock()
+        self.selected_s2p_files = None
+        self.gui_layout = None
+        self.cmc_files = {}
+
+    def run_on_main_thread(self, function, *args):
+        """
+        Method to call a function that the GUI would call on the Tk main thread; the CLI has no main loop, so the
+        function is called directly, one call at a time
+
+        :param function: The function to call
+        :param args: The arguments of the function
+        :return: None
+        """
+        with self.main_thread_lock:
+            function(*args)
+
+    def report_profile(self, report):
+        """
+        Method to print the report of the profiling mode to the console
+
+        :param report: The report as a string
+        :return: None
+        """
+        print(report)
+
+    def run(self, files, fit_type, captype = None, dc_bias = None, nominal_value = None, series_resistance = None,
+            prominence = None, shunt_series = constants.SERIES_THROUGH):
+        """
+        Method to load the files and run the fitting routine
+
+        :param files: The paths of the Touchstone files; the first one is the reference file
+        :param fit_type: The type of DUT (coil or capacitor)
+        :param captype: (optional) The type of capacitor
+        :param dc_bias: (optional) The DC bias values of the files; if not supplied, the files are numbered
+        :param nominal_value: (optional) The nominal value in H/F
+        :param series_resistance: (optional) The series resistance in Ohm
+        :param prominence: (optional) The prominence of the peak detection in dB
+        :param shunt_series: (optional) The calculation method of the impedance (shunt/series through)
+        :return: None
+        """
+        paths = [os.path.abspath(file) for file in files]
+        self.selected_s2p_files = paths
+        self.gui_layout = GUI_config.DROP_DOWN_ELEMENTS[0 if fit_type == constants.El.INDUCTOR else 1]
+        self.iohandler.files = []
+        self.iohandler.load_file(paths)
+
+        if dc_bias is None:
+            dc_bias = list(range(len(paths)))
+        if len(dc_bias) != len(self.iohandler.files):
+            raise ValueError("Number of DC bias values does not match the number of files")
+
+        gui_values = [nominal_value, series_resistance, prominence, shunt_series, self.iohandler.files, dc_bias]
+
+        match fit_type:
+            case constants.El.INDUCTOR:
+                self.run_pipeline(self.fit_coil, gui_values, None)
+            case constants.El.CAPACITOR:
+                self.run_pipeline(self.fit_cap, gui_values, captype)
+
+    def run_cmc(self, files, nominal_value = None, series_resistance = None, prominence = None,
+                shunt_series = constants.SERIES_THROUGH):
+        """
+        Method to load the measurements of a common mode choke and run the CMC fitting routine
+
+        :param files: A dict containing the paths of the Touchstone files for the keys of
+            config.CMC_REQUIRED_CONFIGURATIONS and optionally 'OC' (e.g. {'DM': ..., 'CM': ...}), or the path of a
+            4-port measurement (.s4p) the configurations are derived from
+        :param nominal_value: (optional) The nominal value in H
+        :param series_resistance: (optional) The series resistance in Ohm
+        :param prominence: (optional) The prominence of the peak detection in dB
+        :param shunt_series: (optional) The calculation method of the impedance (shunt/series through)
+        :return: None
+        """
+        if isinstance(files, str):
+            networks = self.iohandler.load_cmc_s4p(files)
+            self.gui_layout = GUI_config.DROP_DOWN_ELEMENTS[2]
+            self.cmc_files = networks
+            self.selected_s2p_files = [os.path.abspath(files)]
+            self.run_pipeline(self.fit_cmc, [nominal_value, series_resistance, prominence, shunt_series], None)
+            return
+
+        if not set(config.CMC_REQUIRED_CONFIGURATIONS).issubset(set(files.keys())):
+            raise ValueError("Not all required files present: " + ", ".join(config.CMC_REQUIRED_CONFIGURATIONS))
+
+        self.gui_layout = GUI_config.DROP_DOWN_ELEMENTS[2]
+        self.cmc_files = {}
+        for mode, file in files.items():
+            with events.stage('load', file=os.path.basename(file)):
+                self.cmc_files[mode] = rf.Network(os.path.abspath(file))
+            self.selected_s2p_files = [os.path.abspath(file)]
+
+        gui_values = [nominal_value, series_resistance, prominence, shunt_series]
+        self.run_pipeline(self.fit_cmc, gui_values, None)
+
+    def close(self):
+        """
+        Method to shut down the worker pool
+
+        :return: None
+        """
+        self.worker_pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit equivalent circuit models to impedance measurements")
+    parser.add_argument('files', nargs='+', help="Touchstone files; the first one is the reference file; for CMCs the "
+                                                "DM and the CM measurement or a single 4-port measurement (.s4p)")
+    parser.add_argument('--type', choices=['inductor', 'capacitor', 'cmc'], default='inductor',
+                        help="type of the DUT")
+    parser.add_argument('--captype', choices=list(CAPTYPES.keys()), default='generic', help="type of capacitor")
+    parser.add_argument('--bias', nargs='+', type=float, help="DC bias value (A/V) of every file")
+    parser.add_argument('--nominal', type=float, help="nominal value (H/F)")
+    parser.add_argument('--resistance', type=float, help="series resistance (Ohm)")
+    parser.add_argument('--prominence', type=float, help="prominence of the peak detection (dB)")
+    parser.add_argument('--shunt', action='store_true', help="calculate the impedance as shunt through")
+    parser.add_argument('--processes', type=int, help="number of worker processes")
+    parser.add_argument('--run-log', help="append the events of the run to this JSON-lines file")
+    parser.add_argument('--show-fits', action='store_true', help="print every optimizer call")
+    parser.add_argument('--profile', action='store_true', help="print a profile of the stages and fits of the run")
+    parser.add_argument('--profile-dir', help="write the cProfile statistics of every stage to this directory")
+    parser.add_argument('--memory', action='store_true', help="print the memory of the stages and workers of the run and "
+                                                              "suggest the number of workers")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(message)s')
+    if args.run_log is not None:
+        config.RUN_LOG_FILE = args.run_log
+    if args.profile or args.profile_dir is not None:
+        config.PROFILING = True
+        config.PROFILE_DUMP_DIR = args.profile_dir
+    if args.memory:
+        config.MEMORY_PROFILING = True
+
+    events.subscribe(ConsoleReporter(args.show_fits))
+
+    shunt_series = constants.SHUNT_THROUGH if args.shunt else constants.SERIES_THROUGH
+    cli = CLI(args.processes)
+    try:
+        if args.type == 'cmc':
+            files = args.files[0] if len(args.files) == 1 and args.files[0].lower().endswith('.s4p') else \
+                dict(zip(config.CMC_REQUIRED_CONFIGURATIONS, args.files))
+            cli.run_cmc(files, nominal_value=args.nominal,
+                        series_resistance=args.resistance, prominence=args.prominence, shunt_series=shunt_series)
+        else:
+            fit_type = constants.El.INDUCTOR if args.type == 'inductor' else constants.El.CAPACITOR
+            cli.run(args.files, fit_type, captype=CAPTYPES[args.captype], dc_bias=args.bias,
+                    nominal_value=args.nominal, series_resistance=args.resistance, prominence=args.prominence,
+                    shunt_series=shunt_series)
+    finally:
+        cli.close()
+
+    if cli.run_failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
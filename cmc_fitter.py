@@ -1,131 +1,367 @@
+import functools
+
 import matplotlib.pyplot as plt
 
 from fitter import *
 import config
 from lmfit import Parameters
 import constants
+import kernels
+import events
 
 #derive a class from the fitter
 class CMC_Fitter(Fitter):
-    def __init__(self, logger):
-        #init the Fitter class
-        super().__init__(logger)
-        #specific variables for CMC
+    """
+    Fitter for the configurations of a common mode choke (DM, CM and, if measured, OC).
+
+    All configurations are loaded and preprocessed in one go; the smoothing is done for all configurations at once. The
+    state of every configuration is kept in the dicts of the instance (file_dict, data_dict, smooth_data_dict,
+    main_res_dict, ...) and select_configuration() loads it into the instance variables of the Fitter, so the methods
+    of the Fitter work on the selected configuration.
+
+    The OC configuration is fit if it is measured, but the netlist of the CMC is made of the DM and CM models only.
+    """
+
+    # the configurations that are fit
+    FIT_CONFIGURATIONS = ['DM', 'CM', 'OC']
+
+    def __init__(self, files, shunt_series = SERIES_THROUGH, logger_instance = logging.getLogger(), Z0 = 50,
+                 nominal_value = None, series_resistance = None, peak_detection_prominence = PROMINENCE_DEFAULT):
+        """
+        :param files: A dict containing the measurement (skrf.Network) of every configuration, e.g. {'DM': ..., 'CM': ...}
+        :param shunt_series: (optional) The calculation method of the impedance; networks derived from a 4-port
+            measurement (see iohandler.mixed_mode_networks()) are always series through
+        :param logger_instance: (optional) A logger instance
+        :param Z0: (optional) The reference impedance of the measurements
+        :param nominal_value: (optional) A dict containing the nominal inductance (in H) of the configurations; the
+            nominal values that are not supplied are calculated
+        :param series_resistance: (optional) The series resistance in Ohm; calculated per configuration if not supplied
+        :param peak_detection_prominence: (optional) The prominence of the peak detection in dB
+        """
+        # the Fitter is not initialized with a single measurement; the instance variables it sets are set by
+        # select_configuration() instead
         self.fit_type = constants.El.INDUCTOR
+        self.captype = constants.captype.GENERIC
+        self.logger = logger_instance
+        self.prominence = PROMINENCE_DEFAULT if peak_detection_prominence is None else peak_detection_prominence
+        self.selected = None
 
-        #TODO: Series resistance is hardcoded to one Ohm
-        self.series_resistance = 1
+        #specific variables for CMC
         self.cmcmodel = None
 
+        self.file_dict = {}
+        self.ser_shunt_dict = {}
+        self.freq_dict = {}
+        self.data_dict = {}
+        self.smooth_data_dict = {}
+        self.offset_dict = {}
+        self.main_res_dict = {}
+        self.nominals_dict = {}
+        self.series_resistance_dict = {}
+        self.params_dict = {}
+        self.order_dict = {}
+        self.bandwidth_dict = {}
+
+        for key, file in files.items():
+            self.file_dict[key] = file
+            self.ser_shunt_dict[key] = SERIES_THROUGH if getattr(file, 'mixed_mode', False) else shunt_series
+            match self.ser_shunt_dict[key]:
+                case constants.SERIES_THROUGH:
+                    data = self.calc_series_thru(file, Z0)
+                case constants.SHUNT_THROUGH:
+                    data = self.calc_shunt_thru(file, Z0)
+            in_range = (file.f > config.FREQ_LOWER_LIMIT) & (file.f < config.FREQ_UPPER_LIMIT)
+            self.freq_dict[key] = file.f[in_range]
+            self.data_dict[key] = data[in_range]
+
+        self._smooth_configurations()
+
+        for key in self.file_dict:
+            self.select_configuration(key)
+            self._calculate_linear_range_offset()
+            self.offset_dict[key] = self._offset
+
+            if nominal_value is not None and nominal_value.get(key) is not None:
+                self.get_main_resonance()
+                self.nominal_value = nominal_value[key]
+            else:
+                self.calculate_nominal_value()
+            self.main_res_dict[key] = (self.f0, self._f0_index)
+            self.nominals_dict[key] = self.nominal_value
+
+            if series_resistance is None:
+                self.calculate_nominal_Rs()
+            else:
+                self.series_resistance = series_resistance
+            self.series_resistance_dict[key] = self.series_resistance
+
+            self.params_dict[key] = Parameters()
+            self.order_dict[key] = 0
+            self.bandwidth_dict[key] = (np.zeros([0, 3]), [], [])
+
+    @events.stage_method('smoothing')
+    def _smooth_configurations(self):
+        """
+        Method to smooth the impedance data of all configurations (see Fitter._smooth_data()). Configurations with the
+        same number of points are filtered together, as one array
+
+        :return: None (stores the smoothed magnitude and phase in self.smooth_data_dict)
+        """
+        groups = {}
+        for key in self.file_dict:
+            # the window length is relative to the number of points of the measurement, as in the Fitter
+            window = int(np.floor(SAVGOL_WIN_LENGTH_REL * len(self.file_dict[key].f)))
+            groups.setdefault((len(self.freq_dict[key]), max(window, 3)), []).append(key)
+
+        for (points, window), keys in groups.items():
+            data = np.array([self.data_dict[key] for key in keys])
+            data_mag = signal.savgol_filter(abs(data), window, SAVGOL_POLY_ORDER, mode='interp', axis=-1)
+            data_ang = signal.savgol_filter(np.angle(data, deg=True), window, SAVGOL_POLY_ORDER, mode='interp', axis=-1)
+            #limit the phase data to +/- 90°
+            data_ang = np.clip(data_ang, -90, 90)
+            for it, key in enumerate(keys):
+                self.smooth_data_dict[key] = (data_mag[it], data_ang[it])
+
+    def select_configuration(self, key):
+        """
+        Method to load the state of a configuration into the instance variables the methods of the Fitter work on
+
+        :param key: The configuration, i.e. a key of self.file_dict
+        :return: None
+        """
+        self.selected = key
+        self.name = self.file_dict[key].name
+        self.ser_shunt = self.ser_shunt_dict[key]
+        self.freq = self.freq_dict[key]
+        self.z21_data = self.data_dict[key]
+        self.data_mag, self.data_ang = self.smooth_data_dict[key]
+        self._offset = self.offset_dict.get(key)
+        if key in self.main_res_dict:
+            self.f0, self._f0_index = self.main_res_dict[key]
+            self.nominal_value = self.nominals_dict[key]
+            self.series_resistance = self.series_resistance_dict[key]
+            self.parameters = self.params_dict[key]
+            self.order = self.order_dict[key]
+            self.modeled_bandwidths, self.bandwidths, self.peak_heights = self.bandwidth_dict[key]
 
+    def store_configuration(self):
+        """
+        Method to write the fit state of the selected configuration back to the dicts
 
-    def plot_plateau_model(self, params,N=0):
+        :return: None
+        """
+        key = self.selected
+        self.params_dict[key] = self.parameters
+        self.order_dict[key] = self.order
+        self.bandwidth_dict[key] = (self.modeled_bandwidths, self.bandwidths, self.peak_heights)
 
-        freq = self.freq
-        omega = freq*2*np.pi
+    def fit_configurations(self):
+        """
+        :return: The configurations that are fit, in the order of FIT_CONFIGURATIONS
+        """
+        return [key for key in self.FIT_CONFIGURATIONS if key in self.file_dict]
+
+    def plot_plateau_model(self, params,N=0):
 
         L= params['L'].value
         R= params['R'].value
 
-
-        ZL = 1j*omega*L
-        Z = 1/(1/ZL+1/R)
+        # the plateau model L || R is a parallel RLC circuit without capacitance
+        Z = kernels.ObjectiveContext(self.freq).rlc_impedance(R, L, 0.0, 2)
 
         plt.figure()
         plt.loglog(self.freq, abs(self.z21_data))
         plt.loglog(self.freq, abs(Z))
 
-    def create_nominal_parameters_CM(self):
-
-        key = 'CM'
-        params = Parameters()
-
-        self.parameters = params
-
-        match self.cmcmodel:
-            case cmctype.NANOCRYSTALLINE:
-                #TODO!!!!!
-                pass
-            case cmctype.MULTIRESONANCE:
-                #TODO!!!!!
-                pass
-            case cmctype.PLATEAU:
-                params.add('L', value = self.nominal_value)
-                params.add('R', value = abs(self.z21_data[self.f0_index]))
-
-
-
-
-
-
-                pass
-
-        self.params_dict[key] = super().create_nominal_parameters(self.params_dict[key])
-        #clear some parameters we obtain from the super() method
-        # self.params_dict[key].pop('R_s') EDIT: we might need R_s
-        self.params_dict[key]['L'].expr = ''
-        self.params_dict[key]['L'].vary = True
-        self.params_dict[key]['R_s'].vary = False
-        #set new boundaries for our parameters
-        self.params_dict[key]['C'].max = self.params_dict[key]['C'].value * 1e2
-        self.params_dict[key]['C'].min = self.params_dict[key]['C'].value * 1e-6
-        self.params_dict[key]['L'].max = self.params_dict[key]['L'].value * 1.01e0
-        self.params_dict[key]['L'].min = self.params_dict[key]['L'].value * 0.98e0
-        self.params_dict[key]['R_Fe'].max = self.params_dict[key]['R_Fe'].value * 1e3
-        self.params_dict[key]['R_Fe'].min = self.params_dict[key]['R_Fe'].value * 1e-3
+    def create_nominal_parameters_CMC(self, keys = None):
+        """
+        Method to create the main resonance parameters of all configurations that are fit; unlike for a coil, L is not
+        bound to C by the main resonance frequency but varies within narrow bounds around the nominal value. The OC
+        configuration gets the parallel capacitance C_p of its model (see calculate_Z_CMC())
+
+        :param keys: (optional) The configurations; all that are fit if not supplied
+        :return: None (writes the parameters to self.params_dict)
+        """
+        for key in (self.fit_configurations() if keys is None else keys):
+            self.select_configuration(key)
+
+            self.params_dict[key] = super().create_nominal_parameters(Parameters())
+            # self.params_dict[key].pop('R_s') EDIT: we might need R_s
+            self.params_dict[key]['L'].expr = ''
+            self.params_dict[key]['L'].value = self.nominal_value / config.INDUNIT
+            self.params_dict[key]['L'].vary = True
+            self.params_dict[key]['R_s'].vary = False
+            # the min. of |Z| overestimates R_s by far for large inductances (see calculate_nominal_Rs())
+            self.params_dict[key]['R_s'].min = self.params_dict[key]['R_s'].value * 1e-3
+            #set new boundaries for our parameters
+            self.params_dict[key]['C'].max = self.params_dict[key]['C'].value * 1e2
+            self.params_dict[key]['C'].min = self.params_dict[key]['C'].value * 1e-6
+            self.params_dict[key]['L'].max = self.params_dict[key]['L'].value * 1.1e0
+            self.params_dict[key]['L'].min = self.params_dict[key]['L'].value * 0.9e0
+            self.params_dict[key]['R_Fe'].max = self.params_dict[key]['R_Fe'].value * 1e3
+            self.params_dict[key]['R_Fe'].min = self.params_dict[key]['R_Fe'].value * 1e-3
+            if key == 'OC':
+                self.params_dict[key].add('C_p', value=self.params_dict[key]['C'].value,
+                                          min=self.params_dict[key]['C'].value * 1e-3,
+                                          max=self.params_dict[key]['C'].value * 1e3, vary=True)
+
+    def main_res_window(self, key):
+        """
+        Method to get the frequency window of the main resonance fit of a configuration (config.CMC_MAIN_RES_WINDOWS)
+
+        :param key: The configuration
+        :return: A boolean mask of the frequency vector of the configuration
+        """
+        f_lower, f_upper = config.CMC_MAIN_RES_WINDOWS.get(key, (None, None))
+        freq = self.freq_dict[key]
+        mask = np.ones(len(freq), dtype=bool)
+        if f_lower is None:
+            # start at the linear range, as for coils
+            mask[:self.offset_dict[key]] = False
+        else:
+            mask &= freq >= f_lower
+        if f_upper is None:
+            mask &= freq < self.main_res_dict[key][0] * constants.MIN_ZONE_OFFSET_FACTOR
+        else:
+            mask &= freq < f_upper
+        return mask
 
-    def fit_cmc_main_res(self):
-        for key in [k for k in self.file_dict.keys() if k != 'OC']:
-            self.data_mag = self.smooth_data_dict[key][0]
-            self.data_ang = self.smooth_data_dict[key][1]
-            self.z21_data = self.data_dict[key]
-            self.f0 = self.main_res_dict[key][0]
-            self.f0_index = self.main_res_dict[key][1]
+    def fit_cmc_main_res(self, keys = None):
+        """
+        Method to fit the main resonance of all configurations that are fit, with the CMC model of the configuration
+        (see calculate_Z_CMC()) in its frequency window (see main_res_window()). R_s is only part of the CM model; it is
+        fit via the phase of the data, as for coils (see Fitter.fit_main_res_inductor_file_1())
 
-            self.nominal_value = self.nominals_dict[key]
+        :param keys: (optional) The configurations; all that are fit if not supplied
+        :return: None (writes the parameters to self.params_dict)
+        """
+        for key in (self.fit_configurations() if keys is None else keys):
+            self.select_configuration(key)
 
-            freq = self.freq
-            data = self.data_dict[key]
-
-            #frequency limit data
-            #TODO: this is HARDCODED for the vogt j45 test
-            mask = [freq<2e8][0]
-            freq = freq[mask]
-            data = data[mask]
+            mask = self.main_res_window(key)
+            freq = self.freq[mask]
+            data = self.z21_data[mask]
 
             fit_order = 0
             fit_main_resonance = 1
-            mode = FIT_BY
-
-            out = minimize(self.calculate_Z_CMC, self.params_dict[key],
-                           args=(freq, data, fit_order, fit_main_resonance, mode, key),
-                           method='powell', options={'xtol': 1e-18, 'disp': True})
-            # out = minimize(self.calculate_Z_CMC, self.params_dict[key],
-            #                args=(freq, data, fit_order, fit_main_resonance, mode, key),
-            #                method='dual_annealing')#, options={'xtol': 1e-18, 'disp': True})
+            mode = config.FIT_BY
+
+            with events.stage('main resonance fit', file=self.name):
+                # The time budget and the objective context are shared by all fits of the main resonance
+                deadline = stage_deadline()
+                context = kernels.ObjectiveContext(freq, data)
+                out = minimize(self.calculate_Z_CMC, self.params_dict[key],
+                               args=(freq, context, fit_order, fit_main_resonance, mode, key),
+                               method='powell', stage='main resonance ' + key, deadline=deadline,
+                               logger_instance=self.logger)
+
+                if key == 'CM':
+                    # Fit R_s via the phase of the data with all other parameters fixed
+                    varying = [pname for pname, par in out.params.items() if par.vary]
+                    for pname in varying:
+                        out.params[pname].vary = False
+                    out.params['R_s'].vary = True
+                    out = minimize(self.calculate_Z_CMC, out.params,
+                                   args=(freq, context, fit_order, fit_main_resonance, constants.fcnmode.ANGLE, key),
+                                   method='powell', stage='main resonance ' + key, deadline=deadline,
+                                   logger_instance=self.logger)
+
+                    # Fitting R_s changes the main resonance fit, so fit the other parameters again
+                    out.params['R_s'].vary = False
+                    for pname in varying:
+                        out.params[pname].vary = True
+                    out = minimize(self.calculate_Z_CMC, out.params,
+                                   args=(freq, context, fit_order, fit_main_resonance, mode, key),
+                                   method='powell', stage='main resonance ' + key, deadline=deadline,
+                                   logger_instance=self.logger)
+                    self.series_resistance_dict[key] = out.params['R_s'].value
+            self.fix_main_resonance_parameters(out.params)
             self.params_dict[key] = out.params
-            pass
-
-            # self.params_dict[key] = super().fit_main_res_inductor_file_1(self.params_dict[key])
-
-    def fit_cmc_higher_order_res(self):
-        for key in [k for k in self.file_dict.keys() if k != 'OC']:
-            self.data_mag = self.smooth_data_dict[key][0]
-            self.data_ang = self.smooth_data_dict[key][1]
-            self.z21_data = self.data_dict[key]
-            self.f0 = self.main_res_dict[key][0]
-            self.f0_index = self.main_res_dict[key][1]
-
-            self.nominal_value = self.nominals_dict[key]
-            self.order = self.order_dict[key]
-            self.modeled_bandwidths = self.bandwidth_dict[key][0]
 
-            self.params_dict[key] = super().correct_parameters(self.params_dict[key], change_main=0, num_it=4)
-            self.params_dict[key] = self.fix_main_resonance_parameters(self.params_dict[key])
-
-            # self.fit_cmc_main_res()
-            self.params_dict[key] = super().pre_fit_bands(self.params_dict[key])
-            self.params_dict[key] = super().fit_curve_higher_order(self.params_dict[key])
+    def prepare_higher_order_res(self, keys = None):
+        """
+        Method to detect the higher order resonances of all configurations that are fit and to create and correct their
+        parameters
+
+        :param keys: (optional) The configurations; all that are fit if not supplied
+        :return: None (writes the parameters, the orders and the bandwidths to the dicts)
+        """
+        for key in (self.fit_configurations() if keys is None else keys):
+            self.select_configuration(key)
+            self.get_resonances()
+            self.create_higher_order_parameters()
+            self.correct_parameters(change_main=False, num_it=4)
+            self.fix_main_resonance_parameters(self.parameters)
+            self.store_configuration()
+
+    def fit_configuration(self, key, full_fit = True):
+        """
+        Method to run the fitting pipeline of a single configuration: main resonance fit and, for a full fit, detection,
+        pre-fit and fit of the higher order circuits. This is a task of fit_all_configurations() that can be run in a
+        worker of the pool
+
+        :param key: The configuration
+        :param full_fit: (optional) fit the higher order circuits as well
+        :return: A tuple (parameters, order, bandwidths, series resistance) of the configuration, as stored in the dicts
+        """
+        self.create_nominal_parameters_CMC([key])
+        self.fit_cmc_main_res([key])
+        if full_fit:
+            self.prepare_higher_order_res([key])
+            self.select_configuration(key)
+            self.pre_fit_bands()
+            self.fit_curve_higher_order()
+            self.store_configuration()
+        return self.params_dict[key], self.order_dict[key], self.bandwidth_dict[key], self.series_resistance_dict[key]
+
+    def fit_all_configurations(self, worker_pool = None, timeout = None, full_fit = True):
+        """
+        Method to fit all configurations that are fit. The configurations are independent; if a worker pool is given,
+        their whole pipelines run concurrently as one task per configuration (see fit_configuration()), so a CMC takes
+        about as long as its slowest configuration.
+
+        A configuration whose task times out (see WorkerPool.run_batch()) is fit again in this process, without the
+        higher order circuits.
+
+        :param worker_pool: (optional) A started WorkerPool (see worker_pool.py)
+        :param timeout: (optional) The wall time limit per task in seconds, measured from the start of the task
+        :param full_fit: (optional) fit the higher order circuits as well
+        :return: A list of the configurations whose task timed out
+        """
+        keys = self.fit_configurations()
+        if worker_pool is None:
+            for key in keys:
+                self.fit_configuration(key, full_fit)
+            return []
+
+        tasks = {key: functools.partial(self.fit_configuration, key, full_fit) for key in keys}
+        results, timed_out = worker_pool.run_batch(tasks, timeout)
+        for key, result in results.items():
+            (self.params_dict[key], self.order_dict[key], self.bandwidth_dict[key],
+             self.series_resistance_dict[key]) = result
+        for key in timed_out:
+            self.logger.warning("%s: fit timed out after %s s; fitting the main resonance only" %
+                                (self.file_dict[key].name, timeout))
+            self.fit_configuration(key, full_fit=False)
+        return timed_out
+
+    def fix_main_resonance_parameters(self, param_set):
+        """
+        Auxillary function to lock the main resonance parameters in place, including C_p of the OC configuration
+
+        :param param_set: A Parameters() object containing the main resonance parameters that shell be fixed
+        :return: None
+        """
+        super().fix_main_resonance_parameters(param_set)
+        if 'C_p' in param_set:
+            param_set['C_p'].vary = False
+
+    def _calculate_Z(self, parameters, frequency_vector, data, fit_order, fit_main_res, modeflag):
+        """
+        The model of the selected configuration (see calculate_Z_CMC()); the methods of the Fitter (pre-fit, curve fit,
+        correction, model output) evaluate the CMC model of the configuration instead of the coil model
+        """
+        return self.calculate_Z_CMC(parameters, frequency_vector, data, fit_order, fit_main_res, modeflag, self.selected)
 
     def calculate_Z_CMC(self, parameters, frequency_vector, data, fit_order, fit_main_res, modeflag, meas_type):
         # if we only want to fit the main resonant circuit, set order to zero to avoid "for" loops
@@ -134,90 +370,33 @@ class CMC_Fitter(Fitter):
         else:
             order = fit_order
 
-        # create array for frequency
-        freq = frequency_vector
-        w = freq * 2 * np.pi
+        # get the context holding the frequency vector, the data transforms and the buffers
+        context = kernels.get_context(frequency_vector, data)
 
         # get parameters for main circuit
-        C = parameters['C'].value * config.CAPUNIT
-        L = parameters['L'].value * config.INDUNIT
-        R_Fe = parameters['R_Fe'].value
-
-
-        # calculate main circuits resistance
-        XC = 1 / (1j * w * C)
-        XL = 1j * w * L
-        Zmain = 0
-        Z=0
-
-        Zmain = 1 / (1/R_Fe + 1/XL + 1/XC)
-
-
-        for actual in range(1, order + 1):
-            key_number = actual
-            C_key = "C%s" % key_number
-            L_key = "L%s" % key_number
-            R_key = "R%s" % key_number
-            C_act = parameters[C_key].value * config.CAPUNIT
-            L_act = parameters[L_key].value * config.INDUNIT
-            R_act = parameters[R_key].value
-            Z_C = 1 / (1j * w * C_act)
-            Z_L = (1j * w * L_act)
-            Z_R = R_act
-            Zmain += 1 / ((1 / Z_C) + (1 / Z_L) + (1 / Z_R))
-
-        if meas_type == 'CM':
-            Zmain += parameters['R_s'].value
-            Z = Zmain
-
-        if meas_type == 'DM' or meas_type == 'OC':
-
-            C_par = parameters['C_p'].value * config.CAPUNIT
-            # L_par = parameters['L_p'].value * config.INDUNIT
-            R_par = parameters['R_p'].value
-
-            # L_leak = parameters['L_leak'].value
-
-            # #configuration with R_s
-            # Rs =  parameters['R_s'].value
-            # Z_par = 1/(1j*w*C_par)
-            # Z_par = 1/(1j*w*C_par)+R_par+1j*w*L_par
-            # Z_terminal = (2*Rs*Z_par)/(2*Rs + Z_par)
-            # Zmain += Z_terminal
-            # Z_main = (Z_par*Zmain)/(Z_par+Zmain)
-            # Z = 2*Rs + Zmain
-
-            #configuration without R_s
-            Z_par =  1/(1j*w*C_par) #+ 1j*w*L_par + R_par
-
-            # Z_leak = 1j*w*L_leak
-            # Zmain += Z_leak
-
-
-            if meas_type == 'DM':
-                Z = Zmain #1/(1/Zmain + 1/Z_par)
+        main = np.array([parameters['C'].value * config.CAPUNIT, parameters['L'].value * config.INDUNIT,
+                         parameters['R_Fe'].value])
 
-            if meas_type == 'OC':
-                Z = 1/((1/Z_par) + (1/(Zmain+Z_par)))
+        # get parameters for the higher order circuits
+        R_b, L_b, C_b = self.get_branch_values(parameters, order)
 
+        # R_s is only present for CM, C_p for DM and OC
+        R_s = parameters['R_s'].value if meas_type == 'CM' else 0.0
+        C_p = parameters['C_p'].value * config.CAPUNIT if meas_type == 'OC' else 0.0
 
+        # #configuration with R_s
+        # Rs =  parameters['R_s'].value
+        # Z_par = 1/(1j*w*C_par)
+        # Z_par = 1/(1j*w*C_par)+R_par+1j*w*L_par
+        # Z_terminal = (2*Rs*Z_par)/(2*Rs + Z_par)
+        # Zmain += Z_terminal
+        # Z_main = (Z_par*Zmain)/(Z_par+Zmain)
+        # Z = 2*Rs + Zmain
 
+        if modeflag == fcnmode.OUTPUT:
+            return context.cmc_impedance(main, R_b, L_b, C_b, kernels.CMC_MEAS_TYPES[meas_type], R_s, C_p)
 
-        match modeflag:
-            case fcnmode.FIT:
-                diff = abs(data) - abs(Z)
-                return (diff)
-            case fcnmode.FIT_LOG:
-                diff = np.log10(abs(data)) - np.log10(abs(Z))
-                return (diff)
-            case fcnmode.OUTPUT:
-                return Z
-            case fcnmode.ANGLE:
-                return np.angle(data) - np.angle(Z)
-            case fcnmode.FIT_REAL:
-                return np.real(data) - np.real(Z)
-            case fcnmode.FIT_IMAG:
-                return np.imag(data) - np.imag(Z)
+        return context.cmc_residual(main, R_b, L_b, C_b, kernels.CMC_MEAS_TYPES[meas_type], R_s, C_p, modeflag)
 
 
     def one_sided_params_to_sym_params(self):
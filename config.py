@@ -2,7 +2,53 @@
 import constants
 
 FULL_FIT = True
-MULTIPROCESSING_COUNT = 16
+# fit DC bias files in order of their bias, starting each fit from the neighbouring file's parameters
+BIAS_SWEEP_WARM_START = False
+# fit all DC bias files as one problem with shared bias-independent parameters (R_s, C for coils; R_iso for caps)
+JOINT_BIAS_FIT = False
+# estimate the higher order circuits by vector fitting instead of fitting a bandwidth model to every resonance
+VECTOR_FIT_INIT = False
+# pre-fit the higher order circuits band by band against a fixed background, with the bands of all files fit
+# concurrently; off by default (False), True = always, None = decide per batch, for batches with too few files to keep
+# the workers busy (see worker_pool.plan_batch())
+BAND_PARALLEL_PRE_FIT = False
+# remove the higher order circuits that contribute less than MODEL_REDUCTION_THRESHOLD to |Z| (|Y| for capacitors) in
+# all files and merge circuits whose resonance frequencies differ by less than MODEL_REDUCTION_MERGE_DISTANCE (relative;
+# None = no merging); the reduced models are refit with at most MODEL_REDUCTION_REFIT_NFEV evaluations
+# (see model_reduction.py)
+MODEL_REDUCTION = False
+MODEL_REDUCTION_THRESHOLD = 0.005
+MODEL_REDUCTION_MERGE_DISTANCE = 0.02
+MODEL_REDUCTION_REFIT_NFEV = 2000
+# fit positive, bounded parameters on a log10 scale
+LOG_PARAMETER_TRANSFORM = True
+# use JIT-compiled impedance kernels if Numba is installed
+USE_JIT_KERNELS = True
+
+# convergence policy for all fits
+FIT_FTOL = 1e-4 # relative change of the residual at which a fit is considered converged
+FIT_XTOL = 1e-18 # tolerance of the line searches; e.g. 1e-6 converges faster, but changes the results of the fits
+FIT_MAX_NFEV = None # max. number of evaluations per fit (None = unlimited)
+FIT_STAGE_TIME_BUDGET = None # max. wall time per fitting stage in seconds (None = unlimited)
+MULTIPROCESSING_COUNT = 16 # max. number of worker processes; the pool is sized per batch up to this limit
+WORKER_MEMORY_ESTIMATE = 500e6 # memory (in bytes) reserved per worker when sizing the pool
+# wall time limit (in seconds) per pre-fit/curve fit task of a file, from the start of the task on a worker (None =
+# unlimited); a file whose task times out keeps the parameters it had before the task (PRE_FIT), or is fit again with
+# its order reduced by FIT_TIMEOUT_ORDER_FACTOR (REDUCED_ORDER)
+FIT_TASK_TIMEOUT = None
+FIT_TIMEOUT_FALLBACK = constants.timeout_fallback.PRE_FIT
+FIT_TIMEOUT_ORDER_FACTOR = 0.5
+# path of the run log; every stage and fit of a run is appended to it as a line of JSON (None = no run log)
+RUN_LOG_FILE = None
+# profiling mode: report evaluations, wall/CPU time and residuals of all fits per stage and file at the end of a run;
+# if PROFILE_DUMP_DIR is set, the cProfile statistics of every stage are written to this directory (see profiling.py)
+PROFILING = False
+PROFILE_DUMP_DIR = None
+# memory profiling mode: report the traced peak memory and the RSS of every stage in the main process and the workers
+# and suggest the number of workers for the batch; MEMORY_TOP_ALLOCATIONS source lines with the largest allocations are
+# listed per stage (0 = none; see memory_profiling.py)
+MEMORY_PROFILING = False
+MEMORY_TOP_ALLOCATIONS = 5
 
 FREQ_UPPER_LIMIT = 2e9
 FREQ_LOWER_LIMIT = 0
@@ -22,4 +68,10 @@ FIT_BY = constants.fcnmode.FIT
 
 
 CMC_REQUIRED_CONFIGURATIONS = ["DM", "CM"]
+# frequency windows (lower, upper limit in Hz) of the main resonance fits of the CMC configurations; None = from the
+# linear range (lower) and up to constants.MIN_ZONE_OFFSET_FACTOR times the main resonance (upper), as for coils
+CMC_MAIN_RES_WINDOWS = {"DM": (None, None), "CM": (None, None), "OC": (None, None)}
+# ports of a 4-port CMC measurement (.s4p) that are connected to the terminals A1, A2, B1, B2 of the windings; A1 and B1
+# are on the same side of the choke
+CMC_S4P_PORT_ORDER = [1, 2, 3, 4]
 
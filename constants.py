@@ -32,6 +32,14 @@ MIN_W_FACTOR = 1/MAX_W_FACTOR
 BW_MAX_FACTOR = 1.01
 BW_MIN_FACTOR = 1/BW_MAX_FACTOR
 
+# max. frequency ratio for a resonance to be matched to a resonance of the neighbouring file in a DC bias sweep
+WARM_START_MATCH_FACTOR = 1.25
+
+# vector fitting initializer for the higher order resonances
+VF_ITERATIONS = 8 # number of pole relocation iterations
+VF_STARTING_POLE_DAMPING = 0.01 # relative damping of the starting poles
+VF_MATCH_FACTOR = 1.1 # max. frequency ratio for a fitted pole pair to be matched to a detected resonance
+
 # factor to stretch the bandwidth of the last frequency zone (1 = no stretch)
 BANDWIDTH_STRETCH_LAST_ZONE = 1
 
@@ -107,6 +115,10 @@ class captype:
     MLCC = 2
     HIGH_C = 3
 
+class timeout_fallback:
+    PRE_FIT = 1
+    REDUCED_ORDER = 2
+
 class cmctype:
     MULTIRESONANCE = 1
     PLATEAU = 2
@@ -147,3 +159,6 @@ SHOW_BODE_PLOTS = False
 #logging
 LOGGING_VERBOSE = 0
 
+
+#interval (in seconds) in which a waiting run checks if it has been cancelled
+CANCEL_POLL_INTERVAL = 0.1
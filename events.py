@@ -0,0 +1,235 @@
+"""
+Events of the fitting pipeline.
+
+The stages of the pipeline (loading, pre-processing, main resonance fit, ...) report their start and end as events; every
+optimizer call reports its number of evaluations. Events are dicts with the keys 'event' (the event type), 'time' and
+'pid' and further fields depending on the type:
+
+- 'stage_start': stage, file
+- 'stage_end': stage, file, order, nfev (evaluations of all fits within the stage), elapsed (s), cpu_time (s), status
+- 'fit': stage, pipeline_stage, file, nfev, nvarys, elapsed, cpu_time, residual, aborted; in profiling mode also
+  residual_initial, evals and eval_time (see profiling.py)
+- 'progress': message
+- 'model': files, order, parameters (the values of the fitted parameters of every file, in config units)
+- 'reduction': file, order, reduced_order, merged, error, reduced_error (rms error of the model magnitude in dB before
+  and after the reduction; see model_reduction.py)
+- 'task_start': task (the id of a pool task, see worker_pool.run_task())
+- 'memory': stage, file, traced_peak, traced, rss, peak_rss (bytes), top; in memory profiling mode (see
+  memory_profiling.py)
+
+Consumers (the GUI's progress display, the console output of the CLI, the JSON-lines run log) subscribe a callback that is
+called with every event. Events of the pool workers are sent to the main process through a queue (see
+forward_to_queue() and start_forwarding()), so subscribers see the events of all processes.
+"""
+
+import contextlib
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+_subscribers = []
+_subscribers_lock = threading.Lock()
+
+# stack of the open stages of each thread; used to count the evaluations per stage
+_open_stages = threading.local()
+
+
+def subscribe(callback):
+    """
+    Function to subscribe a callback to all events
+
+    :param callback: A callable that takes the event dict as only argument
+    :return: None
+    """
+    with _subscribers_lock:
+        _subscribers.append(callback)
+
+
+def unsubscribe(callback):
+    """
+    Function to remove a subscribed callback
+
+    :param callback: The callback
+    :return: None
+    """
+    with _subscribers_lock:
+        if callback in _subscribers:
+            _subscribers.remove(callback)
+
+
+def clear_subscribers():
+    """
+    Function to remove all subscribed callbacks (e.g. in a worker process that inherited them)
+
+    :return: None
+    """
+    with _subscribers_lock:
+        _subscribers.clear()
+
+
+def dispatch(event):
+    """
+    Function to pass an event to all subscribers; an exception of a subscriber is logged and does not affect the others
+
+    :param event: The event dict
+    :return: None
+    """
+    with _subscribers_lock:
+        subscribers = list(_subscribers)
+    for callback in subscribers:
+        try:
+            callback(event)
+        except Exception:
+            logging.getLogger().debug("Event subscriber failed", exc_info=True)
+
+
+def emit(event_type, **fields):
+    """
+    Function to emit an event
+
+    :param event_type: The type of the event, e.g. 'stage_start'
+    :param fields: The fields of the event
+    :return: The event dict
+    """
+    event = {'event': event_type, 'time': time.time(), 'pid': os.getpid()}
+    event.update(fields)
+
+    # count the evaluations of fits for all open stages; a fit belongs to the innermost stage and its file
+    if event_type == 'fit':
+        stack = getattr(_open_stages, 'stack', [])
+        for open_stage in stack:
+            open_stage['nfev'] += fields.get('nfev', 0)
+        if stack:
+            event['pipeline_stage'] = stack[-1]['stage']
+            if event.get('file') is None:
+                event['file'] = stack[-1]['file']
+
+    dispatch(event)
+    return event
+
+
+@contextlib.contextmanager
+def stage(name, file = None, **fields):
+    """
+    Context manager for a stage of the pipeline; emits 'stage_start' on entry and 'stage_end' on exit.
+
+    The yielded dict holds the fields of the 'stage_end' event, so the stage can add to them (e.g. the order of the
+    model once it is known).
+
+    :param name: The name of the stage
+    :param file: (optional) The name of the file the stage works on
+    :param fields: Further fields of the events
+    :return: None
+    """
+    info = {'stage': name, 'file': file, 'nfev': 0}
+    info.update(fields)
+    emit('stage_start', stage=name, file=file, **fields)
+
+    if not hasattr(_open_stages, 'stack'):
+        _open_stages.stack = []
+    _open_stages.stack.append(info)
+
+    start_time = time.perf_counter()
+    start_cpu_time = time.thread_time()
+    status = 'failed'
+    try:
+        yield info
+        status = 'done'
+    except BaseException as e:
+        status = 'cancelled' if type(e).__name__ == 'FitCancelled' else 'failed'
+        raise
+    finally:
+        _open_stages.stack.remove(info)
+        info['elapsed'] = time.perf_counter() - start_time
+        info['cpu_time'] = time.thread_time() - start_cpu_time
+        info['status'] = status
+        emit('stage_end', **info)
+
+
+def stage_method(name):
+    """
+    Decorator for Fitter methods that are a stage of the pipeline; the file is taken from the name of the instance and
+    the order of the model at the end of the stage is added to the 'stage_end' event
+
+    :param name: The name of the stage
+    :return: The decorator
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with stage(name, file=getattr(self, 'name', None)) as info:
+                out = method(self, *args, **kwargs)
+                info['order'] = getattr(self, 'order', None)
+                return out
+        return wrapper
+    return decorator
+
+
+class JsonLinesWriter:
+    """
+    Subscriber that writes every event as a line of JSON to a file (the run log)
+    """
+
+    def __init__(self, path):
+        """
+        :param path: The path of the log file; events are appended
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, 'a')
+
+    def __call__(self, event):
+        line = json.dumps(event, default=str)
+        with self.lock:
+            self.file.write(line + '\n')
+            self.file.flush()
+
+    def close(self):
+        """
+        Method to close the log file
+
+        :return: None
+        """
+        with self.lock:
+            self.file.close()
+
+
+def forward_to_queue(event_queue):
+    """
+    Function to send all events of this process to a queue instead of the subscribers it inherited; used by the pool
+    workers
+
+    :param event_queue: A multiprocessing queue
+    :return: None
+    """
+    clear_subscribers()
+    subscribe(event_queue.put)
+    # a forked worker inherits the open stages of the thread that started it
+    _open_stages.stack = []
+
+
+def start_forwarding(event_queue):
+    """
+    Function to start a thread that dispatches the events of a queue to the subscribers of this process. The thread
+    stops when None is put into the queue
+
+    :param event_queue: A multiprocessing queue
+    :return: The thread
+    """
+    def forward():
+        while True:
+            try:
+                event = event_queue.get()
+            except Exception:
+                # the queue is broken, e.g. a worker was terminated while sending
+                break
+            if event is None:
+                break
+            dispatch(event)
+
+    thread = threading.Thread(target=forward, daemon=True)
+    thread.start()
+    return thread
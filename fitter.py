@@ -3,12 +3,14 @@ import matplotlib.pyplot as plt
 import numpy
 import numpy as np
 import scipy
+import scipy.optimize
 import skrf
 from scipy import signal
-from lmfit import minimize, Parameters
+from lmfit import Parameters
 from scipy.signal import find_peaks
 import decimal
 import copy
+import functools
 import sys
 import logging
 
@@ -18,6 +20,27 @@ import constants
 from config import MAX_ORDER
 from constants import *
 import config
+import vector_fitting
+import band_fitting
+import model_reduction
+import kernels
+import cancellation
+import events
+from optimizer import minimize, stage_deadline
+
+
+@functools.lru_cache(maxsize=None)
+def branch_keys(order):
+    """
+    Function to get the keys of the elements of the higher order circuits; the keys are created once per order instead
+    of in every evaluation of the objective functions
+
+    :param order: The number of circuits
+    :return: A tuple of tuples (R keys, L keys, C keys)
+    """
+    return (tuple(["R%s" % key_number for key_number in range(1, order + 1)]),
+            tuple(["L%s" % key_number for key_number in range(1, order + 1)]),
+            tuple(["C%s" % key_number for key_number in range(1, order + 1)]))
 
 
 
@@ -134,6 +157,7 @@ class Fitter:
         z21_data = (Z0 * file.s[:, 1, 0]) / (2 * (1 - file.s[:, 1, 0]))
         return z21_data
 
+    @events.stage_method('smoothing')
     def _smooth_data(self, window, poly_order):
         """
         Function to smooth the impedance data
@@ -151,6 +175,7 @@ class Fitter:
         #limit the phase data to +/- 90°
         self.data_ang = np.clip(self.data_ang, -90, 90)
 
+    @events.stage_method('nominal value')
     def calculate_nominal_value(self):
         """
         Function to calculate the nominal value of the DUT, if it was not provided.
@@ -258,6 +283,7 @@ class Fitter:
 
         return self.series_resistance
 
+    @events.stage_method('offset')
     def _calculate_linear_range_offset(self):
         """
         Method to calculate the offset for the linear range.
@@ -306,6 +332,7 @@ class Fitter:
         else:
             self._offset = offset
 
+    @events.stage_method('f0 detection')
     def get_main_resonance(self) -> float:
         """
         Method to calculate the main resonant frequency of the DUT.
@@ -368,6 +395,7 @@ class Fitter:
 
         return f0
 
+    @events.stage_method('resonance detection')
     def get_resonances(self):
         """
         Method to get the higher order resonances.
@@ -508,6 +536,7 @@ class Fitter:
 
         return bandwidth_list
 
+    @events.stage_method('acoustic resonance fit')
     def fit_acoustic_resonance(self, param_set: lmfit.Parameters = None):
         """
         Method to fit the acoustic resonance of MLCCs
@@ -569,7 +598,7 @@ class Fitter:
         [bl,bu,R,L,C] = self.model_bandwidth(freq_mdl, data_mdl, res_fq)
 
         # correct the effect the main resonance has on the peak height
-        main_res_here = self._calculate_Z(param_set, res_fq, 2, 0, 1, constants.fcnmode.OUTPUT)
+        main_res_here = self._calculate_Z(param_set, np.array([res_fq]), 2, 0, 1, constants.fcnmode.OUTPUT)[0]
         data_here = data[freq<=res_fq][0]
         w_c = res_fq * 2 * np.pi
         Q = res_fq / (bu - bl)
@@ -597,9 +626,10 @@ class Fitter:
         modelfreq = freq[np.logical_and(freq > bl, freq < bu)]
         modeldata = data[np.logical_and(freq > bl, freq < bu)]
 
+        context = kernels.ObjectiveContext(modelfreq, modeldata)
         out1 = minimize(self._calculate_Z, params,
-                        args=(modelfreq, modeldata, 0, 0, config.FIT_BY,),
-                        method='powell', options={'xtol': 1e-18, 'disp': True})
+                        args=(modelfreq, context, 0, 0, config.FIT_BY,),
+                        method='powell', stage='acoustic resonance', logger_instance=self.logger)
 
         # copy the parameters of the fit result
         params = out1.params
@@ -646,6 +676,7 @@ class Fitter:
         self.acoustic_resonance_frequency = res_fq
         return res_fq
 
+    @events.stage_method('parameter creation')
     def create_hi_C_parameters(self, param_set: lmfit.Parameters = None) -> lmfit.Parameters:
         """
         Function to create the parameter set for the bathtub model (electrolytic capacitor model).
@@ -756,6 +787,7 @@ class Fitter:
         # Now simply take the median, this has shown to perform well on electrolytic caps
         return np.median(L_test_valid)
 
+    @events.stage_method('high C model fit')
     def fit_hi_C_model(self, param_set: lmfit.Parameters = None) -> lmfit.Parameters:
         """
         Function to fit the bathtub model
@@ -775,21 +807,23 @@ class Fitter:
 
         modelfreq = self.freq[self.freq<=config.FREQ_UPPER_LIMIT]
         modeldata = data[self.freq<=config.FREQ_UPPER_LIMIT]
+        context = kernels.ObjectiveContext(modelfreq, modeldata)
 
         if self.order:
             fit_main_resonance = 0
             out = minimize(self._calculate_Z, param_set,
-                           args=(modelfreq, modeldata, fit_order, fit_main_resonance, mode,),
-                           method='powell', options={'xtol': 1e-18, 'disp': True})
+                           args=(modelfreq, context, fit_order, fit_main_resonance, mode,),
+                           method='powell', stage='high C model', logger_instance=self.logger)
         else:
             fit_main_resonance = 1
             out = minimize(self._calculate_Z, param_set,
-                           args=(modelfreq, modeldata, fit_order, fit_main_resonance, mode,),
-                           method='powell', options={'xtol': 1e-18, 'disp': True})
+                           args=(modelfreq, context, fit_order, fit_main_resonance, mode,),
+                           method='powell', stage='high C model', logger_instance=self.logger)
 
         self.parameters = out.params
         return out.params
 
+    @events.stage_method('parameter creation')
     def create_nominal_parameters(self, param_set: lmfit.Parameters = None) -> lmfit.Parameters:
         """
         Function to create parameters for the elements of the main resonance.
@@ -862,7 +896,9 @@ class Fitter:
         self.parameters = param_set
         return param_set
 
-    def create_higher_order_parameters(self, param_set: lmfit.Parameters = None) -> lmfit.Parameters:
+    @events.stage_method('parameter creation')
+    def create_higher_order_parameters(self, param_set: lmfit.Parameters = None,
+                                       seed_set: lmfit.Parameters = None) -> lmfit.Parameters:
         """
         Method to create the circuit elements for the higher order resonances.
         Can create parameters in two configurations.
@@ -872,8 +908,16 @@ class Fitter:
         GUI_config 2 only constrains one energy storing element to the other by resonant frequency. This is the configuration
         known to perform better if the main resonance fit is fairly accurate.
 
+        If a seed set is supplied (warm start of a DC bias sweep), the detected resonances are matched to the circuits
+        of the seed set by their resonant frequency. Matched resonances take their R, C and bandwidth from the seed set
+        and skip the bandwidth model; resonances without a match are estimated as usual.
+
+        If config.VECTOR_FIT_INIT is set, R, C and the bandwidth of all (unseeded) resonances are estimated at once by
+        vector fitting the data; only resonances the vector fit could not resolve are passed to the bandwidth model.
+
         :param config_number: selecting the configuration of the resulting parameters. Can be either 1 or 2.
         :param param_set: A Parameters() object that the circuit elements will be written to
+        :param seed_set: (optional) A Parameters() object of an already fitted file with a neighbouring DC bias
         :return: A Parameters() object containing the higher order circuit elements
         """
 
@@ -895,6 +939,17 @@ class Fitter:
         # Initialize array for the modeled bandwidths
         self.modeled_bandwidths = np.zeros([self.order, 3])
 
+        # Match the detected resonances to the circuits of the seed set (if any); key numbers of the seed set that
+        # are matched are stored per resonance, -1 means "no match"
+        seed_keys = self.match_seed_resonances(seed_set)
+        self.seeded_bands = seed_keys != -1
+
+        # Estimate all resonances at once by vector fitting; resonances without an estimate hold NaN
+        if config.VECTOR_FIT_INIT and not all(self.seeded_bands):
+            vf_estimates = self.vector_fit_resonances(param_set)
+        else:
+            vf_estimates = np.full([self.order, 3], np.nan)
+
         ############################## MAIN LOOP #######################################################################
 
         # Iterate through all detected resonances; note that we iterate by index since we need a key number
@@ -912,60 +967,96 @@ class Fitter:
             f_center = self.bandwidths[key_number - 1][1]
             f_upper = self.bandwidths[key_number - 1][2]
 
-            ############################## BANDWIDTH MODEL #############################################################
-            # handle bandwidths here -> since the bandwidth detection relies on the 3dB points, which are not always
-            # present, we need to model the bandwidth (this is done by brute-force stepping in a separate function)
+            if seed_keys[key_number - 1] != -1:
+                ############################## WARM START FROM SEED SET ###############################################
+                # take R, C and the bandwidth from the matched circuit of the seed set; the center frequency is taken
+                # from this file's data, since the resonances shift with DC bias
+                seed_key = seed_keys[key_number - 1]
+                r_value = seed_set['R%s' % seed_key].value
+                value_cap = seed_set['C%s' % seed_key].value * config.CAPUNIT
+                BW_seed = seed_set['BW%s' % seed_key].value * config.FUNIT
+                f_lower = f_center - BW_seed / 2
+                f_upper = f_center + BW_seed / 2
+
+                self.modeled_bandwidths[key_number - 1][0] = f_lower
+                self.modeled_bandwidths[key_number - 1][1] = f_center
+                self.modeled_bandwidths[key_number - 1][2] = f_upper
+
+                w_c = f_center * 2 * np.pi
+                min_w = w_c * constants.MIN_W_FACTOR
+                max_w = w_c * constants.MAX_W_FACTOR
+
+            elif not np.isnan(vf_estimates[key_number - 1][0]):
+                ############################## VECTOR FIT ESTIMATE #####################################################
+                # the vector fit yields R and C of the circuit directly, so no correction is necessary; the center
+                # frequency is taken from the detected resonance
+                [r_value, value_cap, BW_vf] = vf_estimates[key_number - 1]
+                f_lower = f_center - BW_vf / 2
+                f_upper = f_center + BW_vf / 2
+
+                self.modeled_bandwidths[key_number - 1][0] = f_lower
+                self.modeled_bandwidths[key_number - 1][1] = f_center
+                self.modeled_bandwidths[key_number - 1][2] = f_upper
+
+                w_c = f_center * 2 * np.pi
+                min_w = w_c * constants.MIN_W_FACTOR
+                max_w = w_c * constants.MAX_W_FACTOR
 
-            # Get indices of the band
-            f_center_index = np.where(np.isclose(self.freq, f_center))[0][0]
-            f_lower_index = np.where(np.isclose(self.freq, f_lower))[0][0]
-            f_upper_index = np.where(np.isclose(self.freq, f_upper))[0][0]
-
-            # Calculate an offset so the bandwidth model receives a bit more datapoints than needed
-            # this is done relative to the bandwidth since the datapoints have log-spacing
-            n_pts_offset = int(np.floor(((f_upper_index - f_lower_index) / 2) * BW_MODEL_DATA_OFFSET_STRETCH))
-            f_lower_index = f_center_index - n_pts_offset
-            f_upper_index = f_center_index + n_pts_offset
-
-            # Get data for bandwidth model. Note that we are operating with the smoothed data here
-            freq_BW_mdl = self.freq[f_lower_index:f_upper_index]
-            data_BW_mdl = self.data_mag[f_lower_index:f_upper_index]*np.exp(1j*np.radians(self.data_ang[f_lower_index:f_upper_index]))
-
-            # invoke bandwidth model
-            [f_lower,f_upper,r_value,value_ind,value_cap] = self.model_bandwidth(freq_BW_mdl,data_BW_mdl,f_center)
-
-            #rewrite the obtained bandwidth
-            self.modeled_bandwidths[key_number - 1][0] = f_lower
-            self.modeled_bandwidths[key_number - 1][1] = f_center
-            self.modeled_bandwidths[key_number - 1][2] = f_upper
-
-            # center frequency (omega)
-            w_c = f_center * 2 * np.pi
-            min_w = w_c * constants.MIN_W_FACTOR
-            max_w = w_c * constants.MAX_W_FACTOR
-
-            ############################# BANDWIDTH MODEL PARAMETER CORRECTION #########################################
-            # adjust the value of R; since the BW model provides us with an R for the "standalone" circuit, we need
-            # to correct it to account for the model data as well, since the model has a non-zero impedance at the
-            # point of the newly introduced resonance
-
-            # Calculate impedance data for all resonances we already have, except for the one in question
-            curve_data = self._calculate_Z(param_set, self.freq, 2, key_number - 1, 0, constants.fcnmode.OUTPUT)
-            data_here = self.z21_data[np.where(np.isclose(self.freq, f_center))[0][0]]
-            model_here = curve_data[np.where(np.isclose(self.freq, f_center))[0][0]]
-            w_c = f_center * 2 * np.pi
-            Q = f_center / (f_upper - f_lower)
-
-            if self.fit_type == constants.El.CAPACITOR:
-                R_adjusted = abs(1 / (1 / data_here - 1 / model_here))
-                C_adjusted = 1 / (R_adjusted * w_c * Q)
-
-            if self.fit_type == constants.El.INDUCTOR:
-                R_adjusted = abs( abs(data_here) -  abs(model_here) )
-                C_adjusted = Q / (R_adjusted * w_c)
-
-            r_value = R_adjusted
-            value_cap = C_adjusted
+            else:
+                ############################## BANDWIDTH MODEL #########################################################
+                # handle bandwidths here -> since the bandwidth detection relies on the 3dB points, which are not always
+                # present, we need to model the bandwidth (this is done by brute-force stepping in a separate function)
+
+                # Get indices of the band
+                f_center_index = np.where(np.isclose(self.freq, f_center))[0][0]
+                f_lower_index = np.where(np.isclose(self.freq, f_lower))[0][0]
+                f_upper_index = np.where(np.isclose(self.freq, f_upper))[0][0]
+
+                # Calculate an offset so the bandwidth model receives a bit more datapoints than needed
+                # this is done relative to the bandwidth since the datapoints have log-spacing
+                n_pts_offset = int(np.floor(((f_upper_index - f_lower_index) / 2) * BW_MODEL_DATA_OFFSET_STRETCH))
+                f_lower_index = f_center_index - n_pts_offset
+                f_upper_index = f_center_index + n_pts_offset
+
+                # Get data for bandwidth model. Note that we are operating with the smoothed data here
+                freq_BW_mdl = self.freq[f_lower_index:f_upper_index]
+                data_BW_mdl = self.data_mag[f_lower_index:f_upper_index]*np.exp(1j*np.radians(self.data_ang[f_lower_index:f_upper_index]))
+
+                # invoke bandwidth model
+                [f_lower,f_upper,r_value,value_ind,value_cap] = self.model_bandwidth(freq_BW_mdl,data_BW_mdl,f_center)
+
+                #rewrite the obtained bandwidth
+                self.modeled_bandwidths[key_number - 1][0] = f_lower
+                self.modeled_bandwidths[key_number - 1][1] = f_center
+                self.modeled_bandwidths[key_number - 1][2] = f_upper
+
+                # center frequency (omega)
+                w_c = f_center * 2 * np.pi
+                min_w = w_c * constants.MIN_W_FACTOR
+                max_w = w_c * constants.MAX_W_FACTOR
+
+                ############################# BANDWIDTH MODEL PARAMETER CORRECTION #####################################
+                # adjust the value of R; since the BW model provides us with an R for the "standalone" circuit, we need
+                # to correct it to account for the model data as well, since the model has a non-zero impedance at the
+                # point of the newly introduced resonance
+
+                # Calculate impedance data for all resonances we already have, except for the one in question
+                curve_data = self._calculate_Z(param_set, self.freq, 2, key_number - 1, 0, constants.fcnmode.OUTPUT)
+                data_here = self.z21_data[np.where(np.isclose(self.freq, f_center))[0][0]]
+                model_here = curve_data[np.where(np.isclose(self.freq, f_center))[0][0]]
+                w_c = f_center * 2 * np.pi
+                Q = f_center / (f_upper - f_lower)
+
+                if self.fit_type == constants.El.CAPACITOR:
+                    R_adjusted = abs(1 / (1 / data_here - 1 / model_here))
+                    C_adjusted = 1 / (R_adjusted * w_c * Q)
+
+                if self.fit_type == constants.El.INDUCTOR:
+                    R_adjusted = abs( abs(data_here) -  abs(model_here) )
+                    C_adjusted = Q / (R_adjusted * w_c)
+
+                r_value = R_adjusted
+                value_cap = C_adjusted
 
             #################### WRITE TO PARAMETER SET ################################################################
 
@@ -1017,7 +1108,8 @@ class Fitter:
         self.parameters = param_set
         return param_set
 
-    def pre_fit_bands(self, param_set: lmfit.Parameters = None) -> lmfit.Parameters:
+    @events.stage_method('pre-fit')
+    def pre_fit_bands(self, param_set: lmfit.Parameters = None, bands = None) -> lmfit.Parameters:
         """
         Method to fit the resonant circuits one-by-one to the impedance data
 
@@ -1028,6 +1120,7 @@ class Fitter:
 
         :param param_set: (optional) A Parameters() object containing the resonant circuits; if not supplied, this
             method takes the instance variable self.parameters
+        :param bands: (optional) Indices of the bands to pre-fit (zero based). If not supplied, all bands are pre-fit
         :return: A Parameters() object containing the fitted bands; also writes the parameters to instance variable
             self.parameters
         """
@@ -1036,10 +1129,17 @@ class Fitter:
         if param_set is None:
             param_set = self.parameters
 
+        if bands is None:
+            bands = range(len(self.modeled_bandwidths))
+
         # First fix all parameters in place
         self.fix_parameters(param_set)
 
-        for it, band in enumerate(self.modeled_bandwidths):
+        # The time budget is shared by all bands
+        deadline = stage_deadline()
+
+        for it in bands:
+            band = self.modeled_bandwidths[it]
             # "Cut" the data and frequency vector, so the fitter only looks at the band in question
             fit_freq = self.freq[np.logical_and(self.freq > band[0], self.freq < band[2])]
             fit_data = self.z21_data[np.logical_and(self.freq > band[0], self.freq < band[2])]
@@ -1065,9 +1165,10 @@ class Fitter:
 
 
             # Do the fit
+            context = kernels.ObjectiveContext(fit_freq, fit_data)
             out = minimize(self._calculate_Z, param_set,
-                           args=(fit_freq, fit_data, self.order, 0, config.FIT_BY,),
-                           method='powell', options={'xtol': 1e-18, 'disp': True})
+                           args=(fit_freq, context, self.order, 0, config.FIT_BY,),
+                           method='powell', stage='pre-fit', deadline=deadline, logger_instance=self.logger)
 
             # Write fit results to parameters and set their 'vary' to False
             R = out.params[R_key].value
@@ -1086,6 +1187,104 @@ class Fitter:
         self.parameters = param_set
         return param_set
 
+    @events.stage_method('pre-fit')
+    def pre_fit_bands_concurrent(self, pool = None, param_set: lmfit.Parameters = None, bands = None) \
+            -> lmfit.Parameters:
+        """
+        Method to fit the resonant circuits band by band, concurrently.
+
+        Other than pre_fit_bands(), the model of each band is reduced to the circuit in question plus a background
+        impedance (main resonance and all other circuits), which is calculated once per band. The bands are sorted into
+        waves of non-overlapping bands; the bands of a wave are independent small problems and are fit on the pool,
+        the background of the next wave is calculated with the results of the previous waves.
+
+        :param pool: (optional) A multiprocessing pool. If not supplied, the band fits are done in this process
+        :param param_set: (optional) A Parameters() object containing the resonant circuits; if not supplied, this
+            method takes the instance variable self.parameters
+        :param bands: (optional) Indices of the bands to pre-fit (zero based). If not supplied, all bands are pre-fit
+        :return: A Parameters() object containing the fitted bands; also writes the parameters to instance variable
+            self.parameters
+        """
+
+        # Check if parameters have been supplied, otherwise take instance parameters
+        if param_set is None:
+            param_set = self.parameters
+
+        if bands is None:
+            bands = range(len(self.modeled_bandwidths))
+
+        # Fix all parameters in place, like the sequential pre-fit does
+        self.fix_parameters(param_set)
+
+        for wave in band_fitting.get_band_waves(self.modeled_bandwidths, bands):
+            # the backgrounds of a wave are calculated before any of its results is written
+            band_args = [self.band_fit_arguments(it, param_set) for it in wave]
+            if pool is None:
+                results = [band_fitting.fit_band(*args) for args in band_args]
+            else:
+                tasks = [pool.apply_async(band_fitting.fit_band, args) for args in band_args]
+                results = [cancellation.wait_for(task) for task in tasks]
+
+            for it, result in zip(wave, results):
+                self.write_band_result(it, result, param_set)
+
+        # Free parameters for further fitting
+        self.free_parameters_higher_order(param_set)
+        self.parameters = param_set
+        return param_set
+
+    def band_fit_arguments(self, it, param_set: lmfit.Parameters = None):
+        """
+        Method to create the arguments of the band-local fit of a circuit (see band_fitting.fit_band()); the background
+        of the band is calculated with the current parameters
+
+        :param it: The index of the band (zero based)
+        :param param_set: (optional) A Parameters() object; if not supplied, self.parameters is taken as the parameter set
+        :return: A tuple of arguments for band_fitting.fit_band()
+        """
+        if param_set is None:
+            param_set = self.parameters
+
+        band = self.modeled_bandwidths[it]
+        key_number = it + 1
+        # "Cut" the data and frequency vector, so the fitter only looks at the band in question
+        band_mask = np.logical_and(self.freq > band[0], self.freq < band[2])
+        fit_freq = self.freq[band_mask]
+        fit_data = self.z21_data[band_mask]
+
+        # Calculate the background, i.e. the model without the circuit in question
+        Z_model = self._calculate_Z(param_set, fit_freq, [], self.order, 0, constants.fcnmode.OUTPUT)
+        Z_branch = band_fitting.calculate_branch_Z(self.fit_type, fit_freq, param_set['R%s' % key_number].value,
+                                                   param_set['L%s' % key_number].value,
+                                                   param_set['C%s' % key_number].value)
+        background = band_fitting.remove_from_background(self.fit_type, Z_model, Z_branch)
+
+        circuit = {}
+        for key in ['R', 'C', 'w']:
+            param = param_set[key + str(key_number)]
+            circuit[key] = (param.value, param.min, param.max)
+
+        return self.fit_type, fit_freq, fit_data, background, circuit, config.FIT_BY
+
+    def write_band_result(self, it, result, param_set: lmfit.Parameters = None):
+        """
+        Method to write the result of a band-local fit to the parameter set; the bounds of the circuit are narrowed to
+        the obtained estimates, as in pre_fit_bands()
+
+        :param it: The index of the band (zero based)
+        :param result: The result of band_fitting.fit_band()
+        :param param_set: (optional) A Parameters() object; if not supplied, self.parameters is taken as the parameter set
+        :return: None
+        """
+        if param_set is None:
+            param_set = self.parameters
+
+        key_number = it + 1
+        for key in ['R', 'L', 'C', 'w']:
+            value = result[key]
+            self.change_parameter(param_set, key + str(key_number), value=value, min=value * 0.9, max=value * 1.1)
+
+    @events.stage_method('correction')
     def correct_parameters(self, param_set: lmfit.Parameters = None, change_main = False, num_it = 2) -> lmfit.Parameters:
         """
         Method to correct the parameters of the set. Corrects higher order resonances, but can also correct the main
@@ -1199,6 +1398,22 @@ class Fitter:
         self.parameters = params
         return params
 
+    @staticmethod
+    def get_branch_values(parameters, order):
+        """
+        Method to get the element values of the higher order circuits of a parameter set as arrays, as the impedance
+        kernels take them
+
+        :param parameters: A Parameters() object containing the higher order circuits
+        :param order: The number of circuits
+        :return: A tuple of arrays (R, L, C) of the circuits in SI units
+        """
+        R_keys, L_keys, C_keys = branch_keys(order)
+        R_b = np.fromiter([parameters[key].value for key in R_keys], dtype=float, count=order)
+        L_b = np.fromiter([parameters[key].value * config.INDUNIT for key in L_keys], dtype=float, count=order)
+        C_b = np.fromiter([parameters[key].value * config.CAPUNIT for key in C_keys], dtype=float, count=order)
+        return R_b, L_b, C_b
+
     def _calculate_Z(self, parameters, frequency_vector, data, fit_order, fit_main_res, modeflag):
         """
         Objective function that is invoked by the optimizer. Calculates the impedance for the model.
@@ -1218,7 +1433,8 @@ class Fitter:
 
         :param parameters: A Parameters() object containing the parameters of the model
         :param frequency_vector: The frequency vector over which the impedance is requested.
-        :param data: The data to be used for all kinds of FIT output
+        :param data: The data to be used for all kinds of FIT output; may be a kernels.ObjectiveContext created for
+                frequency_vector, which avoids recalculating the data transforms in every evaluation
         :param fit_order: The order of the model (i.e. the number of resonant circuits)
         :param fit_main_res: Boolean. Decides if only the main resonance shall be fit (TRUE) or if higher order
                 resonances shall be calculated too (FALSE)
@@ -1232,79 +1448,42 @@ class Fitter:
         else:
             order = fit_order
 
-        #create array for frequency
-        freq = frequency_vector
-        w = freq * 2 * np.pi
+        #get the context holding the frequency vector, the data transforms and the buffers
+        context = kernels.get_context(frequency_vector, data)
 
         #get parameters for main circuit
-        C = parameters['C'].value * config.CAPUNIT
-        L = parameters['L'].value * config.INDUNIT
-        R_s = parameters['R_s'].value
-
-        match self.fit_type:
-            case 1:
-                R_Fe = parameters['R_Fe'].value
-            case 2:
-                R_iso = parameters['R_iso'].value
-
-        #calculate main circuits resistance
-        XC = 1 / (1j * w * C)
-        XL = 1j * w * L
-        Z = 0
+        main = np.array([parameters['C'].value * config.CAPUNIT, parameters['L'].value * config.INDUNIT,
+                         parameters['R_s'].value, 0.0])
         match self.fit_type:
-            case El.INDUCTOR: #INDUCTOR
-                Z_part1 = 1 / ((1 / R_Fe) + (1 / XL))
-                Z_main = 1 / ((1 / (R_s + Z_part1)) + (1 / XC))
-            case El.CAPACITOR: #CAPACITOR
-                Z_main = (1 / ((1 / R_iso) + (1 / XC))) + XL + R_s
-
-        Z = Z_main
+            case El.INDUCTOR:
+                main[3] = parameters['R_Fe'].value
+            case El.CAPACITOR:
+                main[3] = parameters['R_iso'].value
 
         #if MLCC
         if self.captype == constants.captype.MLCC and not fit_main_res:
-            Z_A = parameters['R_A'].value + (1j*w*parameters['L_A'].value*config.INDUNIT) + (1/(1j*w*parameters['C_A'].value*config.CAPUNIT))
-            Z = 1/(1/Z_main + 1/Z_A)
+            acoustic = np.array([parameters['R_A'].value, parameters['L_A'].value * config.INDUNIT,
+                                 parameters['C_A'].value * config.CAPUNIT])
+        else:
+            acoustic = np.empty(0)
 
+        #get parameters for the higher order circuits
+        R_b, L_b, C_b = self.get_branch_values(parameters, order)
 
-        for actual in range(1, order + 1):
-            key_number = actual
-            C_key = "C%s" % key_number
-            L_key = "L%s" % key_number
-            R_key = "R%s" % key_number
-            C_act = parameters[C_key].value * config.CAPUNIT
-            L_act = parameters[L_key].value * config.INDUNIT
-            R_act = parameters[R_key].value
-            Z_C   = 1 / (1j * w * C_act)
-            Z_L   = (1j * w * L_act)
-            Z_R   = R_act
-            match self.fit_type:
-                case constants.El.INDUCTOR:
-                    Z    += 1 / ( (1/Z_C) + (1/Z_L) + (1/Z_R) )
-                case constants.El.CAPACITOR:
-                    Z = 1 / ( 1/Z + 1/(Z_R + Z_L + Z_C))
+        if modeflag == fcnmode.OUTPUT:
+            return context.model_impedance(self.fit_type, main, acoustic, R_b, L_b, C_b)
 
-        match modeflag:
-            case fcnmode.FIT:
-                diff = abs(data)-abs(Z)
-                return (diff)
-            case fcnmode.FIT_LOG:
-                diff = np.log10(abs(data)) - np.log10(abs(Z))
-                return (diff)
-            case fcnmode.OUTPUT:
-                return Z
-            case fcnmode.ANGLE:
-                return np.angle(data)-np.angle(Z)
-            case fcnmode.FIT_REAL:
-                return np.real(data)-np.real(Z)
-            case fcnmode.FIT_IMAG:
-                return np.imag(data)-np.imag(Z)
+        return context.model_residual(self.fit_type, main, acoustic, R_b, L_b, C_b, modeflag)
 
-    def fit_curve_higher_order(self, param_set: lmfit.Parameters = None) -> lmfit.Parameters:
+    @events.stage_method('full fit')
+    def fit_curve_higher_order(self, param_set: lmfit.Parameters = None, max_nfev = None) -> lmfit.Parameters:
         """
         Method to fit all higher order resonances.
 
         :param param_set: (optional) A Parameters() object containing the lumped element representation of the model; if
             not supplied, self.parameters is taken as the parameter set
+        :param max_nfev: (optional) The max. number of evaluations of the fit, e.g. for a brief refit; if not supplied,
+            config.FIT_MAX_NFEV applies
         :return: A Parameters() object containing the fitted circuits; also writes the parameters to instance variable
             self.parameters
         """
@@ -1321,9 +1500,10 @@ class Fitter:
         # Fit the parameter set, given that we have an order, otherwise just pass back the parameter set
         if self.order:
             fit_main_resonance = 0
+            context = kernels.ObjectiveContext(freq_data_frq_lim, fit_data_frq_lim)
             out = minimize(self._calculate_Z, param_set,
-                           args=(freq_data_frq_lim, fit_data_frq_lim, self.order, fit_main_resonance, config.FIT_BY,),
-                           method='powell', options={'xtol': 1e-18, 'disp': True})
+                           args=(freq_data_frq_lim, context, self.order, fit_main_resonance, config.FIT_BY,),
+                           method='powell', stage='higher order', max_nfev=max_nfev, logger_instance=self.logger)
 
             self.parameters = out.params
             return out.params
@@ -1331,6 +1511,7 @@ class Fitter:
             self.parameters = param_set
             return param_set
 
+    @events.stage_method('main resonance fit')
     def fit_main_res_inductor_file_1(self, param_set: lmfit.Parameters = None) -> lmfit.Parameters:
         """
         Method to fit the main resonance circuit for an inductor for the first file (i.e. the reference file)
@@ -1357,10 +1538,14 @@ class Fitter:
 
         #################### Main Resonance ############################################################################
 
+        # The time budget and the objective context are shared by all fits of the main resonance
+        deadline = stage_deadline()
+        context = kernels.ObjectiveContext(freq_for_fit, data_for_fit)
+
         # Start by fitting the main res with all parameters set to vary
         out = minimize(self._calculate_Z, param_set,
-                       args=(freq_for_fit, data_for_fit, self.order, fit_main_resonance, config.FIT_BY,),
-                       method='powell', options={'xtol': 1e-18, 'disp': True})
+                       args=(freq_for_fit, context, self.order, fit_main_resonance, config.FIT_BY,),
+                       method='powell', stage='main resonance', deadline=deadline, logger_instance=self.logger)
 
         # Set all parameters to not vary; let only R_s vary
         for pname, par in out.params.items():
@@ -1370,8 +1555,8 @@ class Fitter:
         # Fit R_s via the phase of the data
         out = minimize(self._calculate_Z, out.params,
                        args=(
-                           freq_for_fit, data_for_fit, self.order, fit_main_resonance, constants.fcnmode.ANGLE,),
-                       method='powell', options={'xtol': 1e-18, 'disp': True})
+                           freq_for_fit, context, self.order, fit_main_resonance, constants.fcnmode.ANGLE,),
+                       method='powell', stage='main resonance', deadline=deadline, logger_instance=self.logger)
 
         # Fitting R_s again does change the main res fit, so set L an C to vary
         out.params['R_s'].vary = False
@@ -1380,8 +1565,8 @@ class Fitter:
 
         # And fit again
         out = minimize(self._calculate_Z, out.params,
-                       args=(freq_for_fit, data_for_fit, self.order, fit_main_resonance, config.FIT_BY,),
-                       method='powell', options={'xtol': 1e-18, 'disp': True})
+                       args=(freq_for_fit, context, self.order, fit_main_resonance, config.FIT_BY,),
+                       method='powell', stage='main resonance', deadline=deadline, logger_instance=self.logger)
 
         # Write series resistance to class variable (important if other files are fit)
         self.series_resistance = out.params['R_s'].value
@@ -1393,6 +1578,7 @@ class Fitter:
         self.parameters = out.params
         return out.params
 
+    @events.stage_method('main resonance fit')
     def fit_main_res_capacitor_file_1(self, param_set: lmfit.Parameters = None) -> lmfit.Parameters:
         """
         Method to fit the main resonance circuit for a capacitor for the first file (i.e. the reference file)
@@ -1426,8 +1612,9 @@ class Fitter:
             param_set['R_s'].vary = False
 
         out = minimize(self._calculate_Z, param_set,
-                       args=(freq_for_fit, data_for_fit, self.order, fit_main_resonance, mode,),
-                       method='powell', options={'xtol': 1e-18, 'disp': True})
+                       args=(freq_for_fit, kernels.ObjectiveContext(freq_for_fit, data_for_fit), self.order,
+                             fit_main_resonance, mode,),
+                       method='powell', stage='main resonance', logger_instance=self.logger)
 
         # Create datasets for data before/after fit
         old_data = self._calculate_Z(param_set, freq_for_fit, [], 0, fit_main_resonance,
@@ -1456,6 +1643,7 @@ class Fitter:
 
     #TODO: those two methods are rather redundant (fit_cap/coil_file_n) to the point where they are essentially the
     # same function
+    @events.stage_method('main resonance fit')
     def fit_main_res_inductor_file_n(self, param_set: lmfit.Parameters = None) -> lmfit.Parameters:
         """
         Method to fit the main resonance circuit for an inductor for a file that is not the reference file
@@ -1479,8 +1667,9 @@ class Fitter:
 
         # Fit main resonance
         out = minimize(self._calculate_Z, param_set,
-                       args=(freq_for_fit, data_for_fit, self.order, fit_main_resonance, config.FIT_BY,),
-                       method='powell', options={'xtol': 1e-18, 'disp': True})
+                       args=(freq_for_fit, kernels.ObjectiveContext(freq_for_fit, data_for_fit), self.order,
+                             fit_main_resonance, config.FIT_BY,),
+                       method='powell', stage='main resonance', logger_instance=self.logger)
 
         # Fix main resonance parameters in place
         self.fix_main_resonance_parameters(out.params)
@@ -1489,6 +1678,7 @@ class Fitter:
         self.parameters = out.params
         return out.params
 
+    @events.stage_method('main resonance fit')
     def fit_main_res_capacitor_file_n(self, param_set: lmfit.Parameters = None) -> lmfit.Parameters:
         """
         Method to fit the main resonance circuit for a capacitor for a file that is not the reference file
@@ -1512,8 +1702,9 @@ class Fitter:
 
         # Fit main resonance
         out = minimize(self._calculate_Z, param_set,
-                       args=(freq_for_fit, data_for_fit, self.order, fit_main_resonance, config.FIT_BY,),
-                       method='powell', options={'xtol': 1e-18, 'disp': True})
+                       args=(freq_for_fit, kernels.ObjectiveContext(freq_for_fit, data_for_fit), self.order,
+                             fit_main_resonance, config.FIT_BY,),
+                       method='powell', stage='main resonance', logger_instance=self.logger)
 
         # Fix main resonance parameters in place
         self.fix_main_resonance_parameters(out.params)
@@ -1598,6 +1789,48 @@ class Fitter:
         self.parameters = param_set
         return param_set
 
+    def seed_main_res_parameters(self, param_set0: lmfit.Parameters, param_set: lmfit.Parameters = None)\
+            -> lmfit.Parameters:
+        """
+        Method to warm-start the main resonance parameters from an already fitted file with a neighbouring DC bias.
+
+        The resistors and the parasitic element (C for inductors, L for capacitors) are taken from the fitted file. The
+        nominal element stays bound to the parasitic element via this file's resonant frequency, so the initial guess
+        already matches the main resonance of this file.
+
+        :param param_set0: A Parameters() object containing the fitted main resonance of the neighbouring file
+        :param param_set: (optional) A Parameters() object containing the main resonance parameters for this file, as
+            created by create_nominal_parameters(). If not supplied, self.parameters is used
+        :return: A Parameters() object containing the seeded main resonance parameters
+        """
+
+        if param_set is None:
+            param_set = self.parameters
+
+        R_s = param_set0['R_s'].value
+
+        match self.fit_type:
+            case constants.El.INDUCTOR:
+                C_val = param_set0['C'].value
+                R_Fe = param_set0['R_Fe'].value
+                self.change_parameter(param_set, param_name='C', value=C_val,
+                                      min=C_val * constants.MAIN_RES_PARASITIC_LOWER_BOUND,
+                                      max=C_val * constants.MAIN_RES_PARASITIC_UPPER_BOUND)
+                self.change_parameter(param_set, param_name='R_Fe', value=R_Fe)
+                self.change_parameter(param_set, param_name='R_s', value=R_s, min=R_s * 0.1, max=R_s * 1.111)
+
+            case constants.El.CAPACITOR:
+                L_val = param_set0['L'].value
+                R_iso = param_set0['R_iso'].value
+                self.change_parameter(param_set, param_name='L', value=L_val,
+                                      min=L_val * constants.MAIN_RES_PARASITIC_LOWER_BOUND,
+                                      max=L_val * constants.MAIN_RES_PARASITIC_UPPER_BOUND)
+                self.change_parameter(param_set, param_name='R_iso', value=R_iso)
+                self.change_parameter(param_set, param_name='R_s', value=R_s, min=R_s * 0.01, max=R_s * 1.111)
+
+        self.parameters = param_set
+        return param_set
+
     def add_higher_order_resonances_MR_fit(self, order: int, param_set0: lmfit.Parameters,
                                            param_set: lmfit.Parameters = None) -> lmfit.Parameters:
         """
@@ -1630,6 +1863,153 @@ class Fitter:
 
 
     ####################################V AUXILLIARY V##################################################################
+    def reduce_order(self, order, param_set: lmfit.Parameters = None) -> lmfit.Parameters:
+        """
+        Method to reduce the order of the model by removing the circuits of the highest resonances
+
+        :param order: The new order of the model
+        :param param_set: (optional) A Parameters() object; if not supplied, self.parameters is taken as the parameter set
+        :return: The Parameters() object without the removed circuits; also writes the parameters to instance variable
+            self.parameters
+        """
+        if param_set is None:
+            param_set = self.parameters
+
+        for key_number in range(order + 1, self.order + 1):
+            # L is bound to C and w by an expression, so it has to be removed first
+            for key in ["L%s", "BW%s", "R%s", "C%s", "w%s"]:
+                if key % key_number in param_set:
+                    param_set.pop(key % key_number)
+
+        self.order = order
+        self.bandwidths = self.bandwidths[:order]
+        self.modeled_bandwidths = self.modeled_bandwidths[:order]
+        self.parameters = param_set
+        return param_set
+
+    def branch_contributions(self, param_set: lmfit.Parameters = None):
+        """
+        Method to rank the higher order circuits by their contribution to the model over the frequency range of the
+        fit (see model_reduction.relative_contributions())
+
+        :param param_set: (optional) A Parameters() object; if not supplied, self.parameters is taken as the parameter set
+        :return: An array containing the max. contribution of every circuit, as a fraction of |Z| (inductors) or |Y|
+            (capacitors)
+        """
+        if param_set is None:
+            param_set = self.parameters
+
+        freq = self.freq[self.freq < config.FREQ_UPPER_LIMIT]
+        Z_model = self._calculate_Z(param_set, freq, [], self.order, 0, constants.fcnmode.OUTPUT)
+        R_b, L_b, C_b = self.get_branch_values(param_set, self.order)
+        Z_branches = band_fitting.calculate_branch_Z(self.fit_type, freq[np.newaxis, :], R_b[:, np.newaxis],
+                                                     L_b[:, np.newaxis] / config.INDUNIT,
+                                                     C_b[:, np.newaxis] / config.CAPUNIT)
+        return model_reduction.relative_contributions(self.fit_type, Z_model, Z_branches)
+
+    def merge_circuits(self, key_number, other_key_numbers, param_set: lmfit.Parameters = None) -> lmfit.Parameters:
+        """
+        Method to merge higher order circuits into one (see model_reduction.merged_circuit()); the merged circuit takes
+        the place of key_number, the other circuits are left in place and have to be removed with remove_circuits()
+
+        :param key_number: The key number of the circuit the others are merged into
+        :param other_key_numbers: The key numbers of the circuits that are merged into it
+        :param param_set: (optional) A Parameters() object; if not supplied, self.parameters is taken as the parameter set
+        :return: The Parameters() object containing the merged circuit; also writes the parameters to instance variable
+            self.parameters
+        """
+        if param_set is None:
+            param_set = self.parameters
+
+        key_numbers = [key_number] + list(other_key_numbers)
+        R, L, C = model_reduction.merged_circuit(self.fit_type,
+                                                 np.array([param_set['R%s' % key].value for key in key_numbers]),
+                                                 np.array([param_set['L%s' % key].value for key in key_numbers]),
+                                                 np.array([param_set['C%s' % key].value for key in key_numbers]))
+
+        # w is in config.FUNIT of an angular frequency, L is bound to C and w by its expression
+        w_c = 1 / np.sqrt(L * config.INDUNIT * C * config.CAPUNIT)
+        match self.fit_type:
+            case El.INDUCTOR:
+                Q = R * np.sqrt(C * config.CAPUNIT / (L * config.INDUNIT))
+                r_min, r_max, c_min, c_max = RMINFACTOR_COIL, RMAXFACTOR_COIL, CMINFACTOR_COIL, CMAXFACTOR_COIL
+            case El.CAPACITOR:
+                Q = np.sqrt(L * config.INDUNIT / (C * config.CAPUNIT)) / R
+                r_min, r_max, c_min, c_max = RMINFACTOR_CAP, RMAXFACTOR_CAP, CMINFACTOR_CAP, CMAXFACTOR_CAP
+
+        # the parameters are rewritten with new bounds, since the merged values may lie outside of the old ones
+        param_set.add('R%s' % key_number, value=R, min=R * r_min, max=R * r_max, vary=param_set['R%s' % key_number].vary)
+        param_set.add('C%s' % key_number, value=C, min=C * c_min, max=C * c_max, vary=param_set['C%s' % key_number].vary)
+        param_set.add('w%s' % key_number, value=w_c / config.FUNIT, min=w_c * constants.MIN_W_FACTOR / config.FUNIT,
+                      max=w_c * constants.MAX_W_FACTOR / config.FUNIT, vary=param_set['w%s' % key_number].vary)
+        param_set['BW%s' % key_number].value = w_c / (2 * np.pi * Q) / config.FUNIT
+        if not param_set['L%s' % key_number].expr:
+            param_set['L%s' % key_number].value = L
+
+        f_center = w_c / (2 * np.pi)
+        bandwidth = [f_center * (1 - 1 / (2 * Q)), f_center, f_center * (1 + 1 / (2 * Q))]
+        self.bandwidths[key_number - 1] = list(bandwidth)
+        self.modeled_bandwidths[key_number - 1] = list(bandwidth)
+        self.parameters = param_set
+        return param_set
+
+    def remove_circuits(self, key_numbers, param_set: lmfit.Parameters = None) -> lmfit.Parameters:
+        """
+        Method to remove higher order circuits from the model; the remaining circuits are renumbered in their order
+
+        :param key_numbers: The key numbers of the circuits to remove
+        :param param_set: (optional) A Parameters() object; if not supplied, self.parameters is taken as the parameter set
+        :return: A Parameters() object without the removed circuits; also writes the parameters to instance variable
+            self.parameters
+        """
+        if param_set is None:
+            param_set = self.parameters
+
+        kept = [key_number for key_number in range(1, self.order + 1) if key_number not in key_numbers]
+        circuit_keys = set(["%s%s" % (element, key_number) for key_number in range(1, self.order + 1)
+                            for element in ['BW', 'C', 'R', 'w', 'L']])
+
+        new_set = Parameters()
+        for name, param in param_set.items():
+            if name not in circuit_keys:
+                new_set.add(name, value=param.value, min=param.min, max=param.max, vary=param.vary, expr=param.expr)
+
+        for new_key_number, key_number in enumerate(kept, start=1):
+            for element in ['BW', 'C', 'R', 'w']:
+                param = param_set["%s%s" % (element, key_number)]
+                new_set.add("%s%s" % (element, new_key_number), value=param.value, min=param.min, max=param.max,
+                            vary=param.vary)
+            L_param = param_set["L%s" % key_number]
+            if L_param.expr:
+                # L is bound to C and w by an expression (see create_higher_order_parameters())
+                expression_string_L = ('(1/((C%s*' % new_key_number + str(config.CAPUNIT) + ')*(w%s*' % new_key_number
+                                       + str(config.FUNIT) + ')**2))/' + str(config.INDUNIT))
+                new_set.add("L%s" % new_key_number, expr=expression_string_L)
+            else:
+                new_set.add("L%s" % new_key_number, value=L_param.value, min=L_param.min, max=L_param.max,
+                            vary=L_param.vary)
+
+        # detected resonances beyond the order of the model are kept at the end of the list
+        self.bandwidths = [self.bandwidths[key_number - 1] for key_number in kept] + list(self.bandwidths[self.order:])
+        self.modeled_bandwidths = np.asarray(self.modeled_bandwidths)[np.array(kept, dtype=int) - 1]
+        self.order = len(kept)
+        self.parameters = new_set
+        return new_set
+
+    def model_error_dB(self, param_set: lmfit.Parameters = None) -> float:
+        """
+        Method to calculate the rms deviation of the model magnitude from the data over the frequency range of the fit
+
+        :param param_set: (optional) A Parameters() object; if not supplied, self.parameters is taken as the parameter set
+        :return: The rms error in dB
+        """
+        if param_set is None:
+            param_set = self.parameters
+
+        band = self.freq < config.FREQ_UPPER_LIMIT
+        Z_model = self._calculate_Z(param_set, self.freq[band], [], self.order, 0, constants.fcnmode.OUTPUT)
+        return float(np.sqrt(np.mean((20 * np.log10(abs(Z_model) / abs(self.z21_data[band]))) ** 2)))
+
     def write_model_data(self, param_set, model_order):
         """
         Auxilliary function to calculate the impedance of the model
@@ -1643,6 +2023,113 @@ class Fitter:
         fit_main_resonance = 0
         self.model_data = self._calculate_Z(param_set, freq, [], order, fit_main_resonance, constants.fcnmode.OUTPUT)
 
+    def vector_fit_resonances(self, param_set: lmfit.Parameters = None):
+        """
+        Auxilliary function to estimate the higher order circuits by vector fitting.
+
+        The main resonance model is removed from the data (in impedance for coils, where the circuits are in series, and
+        in admittance for capacitors, where the circuits are in parallel) and the remainder is vector fit with starting
+        poles at the detected resonances. The fitted pole pairs are mapped to RLC circuits and matched to the detected
+        resonances by their resonant frequency.
+
+        :param param_set: A Parameters() object containing the main resonance parameters
+        :return: An array with one row [R, C, bandwidth] per resonance (up to self.order); C in F, bandwidth in Hz.
+            Rows of resonances that could not be estimated hold NaN
+        """
+        if param_set is None:
+            param_set = self.parameters
+
+        estimates = np.full([self.order, 3], np.nan)
+        if not self.order:
+            return estimates
+
+        f_detected = np.array([band[1] for band in self.bandwidths[:self.order]])
+
+        # Fit the data from the start of the higher order zone (or the first resonance) up to the frequency limit
+        f_min = min(self.f0 * constants.MIN_ZONE_OFFSET_FACTOR, self.bandwidths[0][0])
+        mask = (self.freq >= f_min) & (self.freq < config.FREQ_UPPER_LIMIT)
+        freq = self.freq[mask]
+        data = self.data_mag[mask] * np.exp(1j * np.radians(self.data_ang[mask]))
+
+        Z_main = self._calculate_Z(param_set, freq, [], 0, 0, constants.fcnmode.OUTPUT)
+        # weighting by the measured impedance (admittance) makes the fit work on the relative error of the model
+        match self.fit_type:
+            case constants.El.INDUCTOR:
+                data_vf = data - Z_main
+                weight = 1 / abs(data)
+            case constants.El.CAPACITOR:
+                data_vf = 1 / data - 1 / Z_main
+                weight = abs(data)
+
+        try:
+            poles, residues, d, e = vector_fitting.vector_fit(freq, data_vf, vector_fitting.starting_poles(f_detected),
+                                                              weight = weight)
+        except np.linalg.LinAlgError:
+            self.logger.info("Vector fit failed, falling back to the bandwidth model")
+            return estimates
+
+        f_res, R, L, C = vector_fitting.poles_to_rlc(poles, residues, self.fit_type)
+        valid = np.flatnonzero(np.logical_not(np.isnan(R)))
+        if not len(valid):
+            return estimates
+
+        # match the realizable circuits to the detected resonances
+        distance = abs(np.log10(f_detected)[:, np.newaxis] - np.log10(f_res[valid])[np.newaxis, :])
+        rows, cols = scipy.optimize.linear_sum_assignment(distance)
+
+        for row, col in zip(rows, cols):
+            if distance[row, col] <= np.log10(constants.VF_MATCH_FACTOR):
+                it = valid[col]
+                match self.fit_type:
+                    case constants.El.INDUCTOR:
+                        Q = R[it] * np.sqrt(C[it] / L[it])
+                    case constants.El.CAPACITOR:
+                        Q = np.sqrt(L[it] / C[it]) / R[it]
+                estimates[row] = [R[it], C[it], f_res[it] / Q]
+
+        self.logger.info("Vector fit: {matched} of {order} resonances estimated".format(
+            matched=np.count_nonzero(np.logical_not(np.isnan(estimates[:, 0]))), order=self.order))
+
+        return estimates
+
+    def match_seed_resonances(self, seed_set):
+        """
+        Auxilliary function to match the detected resonances to the higher order circuits of a seed parameter set.
+
+        The matching is done by the distance of the resonant frequencies on a logarithmic scale and solved as an
+        assignment problem, so every circuit of the seed set is used at most once. Pairs that are further apart than
+        WARM_START_MATCH_FACTOR are not matched.
+
+        :param seed_set: A Parameters() object containing higher order circuits, or None
+        :return: An integer array with one entry per resonance (up to self.order) holding the matched key number of the
+            seed set; -1 means that the resonance could not be matched
+        """
+        seed_keys = np.full(self.order, -1, dtype=np.int64)
+
+        if seed_set is None:
+            return seed_keys
+
+        # Collect the resonant frequencies of the seed set; keys are consecutive, starting at 1
+        seed_order = 0
+        while "w%s" % (seed_order + 1) in seed_set:
+            seed_order += 1
+
+        if not seed_order or not self.order:
+            return seed_keys
+
+        f_seed = np.array([seed_set["w%s" % key].value for key in range(1, seed_order + 1)])
+        f_seed = f_seed * config.FUNIT / (2 * np.pi)
+        f_detected = np.array([band[1] for band in self.bandwidths[:self.order]])
+
+        distance = abs(np.log10(f_detected)[:, np.newaxis] - np.log10(f_seed)[np.newaxis, :])
+        rows, cols = scipy.optimize.linear_sum_assignment(distance)
+
+        for row, col in zip(rows, cols):
+            if distance[row, col] <= np.log10(constants.WARM_START_MATCH_FACTOR):
+                seed_keys[row] = col + 1
+
+        return seed_keys
+
     @staticmethod
     def change_parameter(param_set, param_name, min=None, max=None, value=None, vary=None, expr=None):
         """
@@ -1732,34 +2219,28 @@ class Fitter:
 
         :param parameters: A Parameters() object, containing R, L and C
         :param freq: The frequency vector over which the impedance is required
-        :param data: The corresponding data; needed if FIT mode is selected.
+        :param data: The corresponding data; needed if FIT mode is selected. May be a kernels.ObjectiveContext
         :param ser_par: Whether the RLC is a serial or parallel resonant circuit (1=serial;2=parallel)
         :param mode: Can be FIT or OUTPUT, selects what will be returned.
         :return: if mode == FIT, will return the difference in magnitude between the data and the model;
                 if mode == OUTPUT, will return the impedance of the resonant circuit
         """
-        w = np.pi*2*freq
-        Z_R = parameters['R'].value
-        Z_L = parameters['L'].value * 1j * w
-        Z_C = 1 / (parameters['C'].value * 1j * w)
-
-        match ser_par:
-            case 1:#serial
-                Z = Z_R + Z_L + Z_C
-            case 2:#parallel
-                Z = 1/(1/Z_R + 1/Z_C + 1/Z_L)
+        context = kernels.get_context(freq, data)
+        R = parameters['R'].value
+        L = parameters['L'].value
+        C = parameters['C'].value
 
         match mode:
             case constants.fcnmode.FIT:
                 # diff = (np.real(data) - np.real(Z)) + (np.imag(data) - np.imag(Z))
                 # diff = np.linalg.norm(data-Z)
-                diff = abs(data) - abs(Z)
+                diff = context.rlc_residual(R, L, C, ser_par, mode)
                 if constants.DEBUG_BW_MODEL_VERBOSE:
                     test_data = self.calc_Z_simple_RLC(parameters, freq, [], ser_par, 2)
                     plt.loglog(freq,abs(test_data))
                 return (diff)
             case constants.fcnmode.OUTPUT:
-                return Z
+                return context.rlc_impedance(R, L, C, ser_par)
 
     def model_bandwidth(self, freqdata, data, peakfreq):
         """
@@ -1883,8 +2364,9 @@ class Fitter:
         temp_params.add('C',value=C_val_rough_fit, min=C_val_rough_fit * 0.1, max=C_val_rough_fit * 10)
 
         #do a fit then after we have the approximate value of the cap
-        out = minimize(self.calc_Z_simple_RLC, temp_params, args=(modelfreq,modeldata,ser_par_flag,1),
-                            method='powell', options={'xtol': 1e-18, 'disp': True})
+        context = kernels.ObjectiveContext(modelfreq, modeldata)
+        out = minimize(self.calc_Z_simple_RLC, temp_params, args=(modelfreq,context,ser_par_flag,1),
+                            method='powell', stage='bandwidth model', logger_instance=self.logger)
 
         ################################################################################################################
         # #PLOTS ( for when you are in the mood for visual analysis ¯\_(ツ)_/¯ )
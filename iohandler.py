@@ -1,12 +1,79 @@
 import config
 import skrf as rf
+from skrf.network import s2y, y2s
 import pandas as pd
 import os
 from fitter import *
 import constants
+import events
+from parameter_matrix import main_parameter_names
 import matplotlib
 from matplotlib import pyplot as plt
 
+# single-ended waves (A1, A2, B1, B2) to mixed-mode waves (d1, d2, c1, c2); the matrix is orthogonal, so its transpose is
+# its inverse
+MIXED_MODE_MATRIX = np.array([[1, 0, -1, 0],
+                              [0, 1, 0, -1],
+                              [1, 0, 1, 0],
+                              [0, 1, 0, 1]]) / np.sqrt(2)
+
+
+def renormalize_2_port(s, z0_old, z0_new):
+    """
+    Function to change the (real) reference impedance of the S-parameters of a 2-port
+
+    :param s: The S-parameters, an array of shape (frequencies, 2, 2)
+    :param z0_old: The reference impedance of s
+    :param z0_new: The new reference impedance
+    :return: The renormalized S-parameters
+    """
+    gamma = (z0_new - z0_old) / (z0_new + z0_old)
+    identity = np.eye(2)
+    # S' = (S - gamma I)(I - gamma S)^-1, solved for all frequencies at once
+    return np.swapaxes(np.linalg.solve(np.swapaxes(identity - gamma * s, 1, 2),
+                                       np.swapaxes(s - gamma * identity, 1, 2)), 1, 2)
+
+
+def mixed_mode_networks(network, port_order):
+    """
+    Function to derive the 2-port networks of the CMC measurement configurations from a 4-port measurement.
+
+    The S-parameters are converted to mixed-mode S-parameters; the differential and the common mode block are
+    renormalized from their mode impedances (2*Z0 and Z0/2) to Z0. They correspond to a series through measurement of
+    both windings in series (DM) and in parallel (CM). The OC configuration is winding A with winding B left open.
+
+    :param network: The 4-port measurement (skrf.Network) with the same real reference impedance at all ports
+    :param port_order: The ports (1-based) that are connected to the winding terminals A1, A2, B1 and B2; the A1 and B1
+        are on the same side of the choke
+    :return: A dict containing a 2-port skrf.Network for each of 'DM', 'CM' and 'OC'
+    :raises Exception: if the network is not a 4-port
+    """
+    if network.nports != 4:
+        raise Exception("\"" + str(network.name) + "\" is not a 4-port measurement")
+
+    index = [port - 1 for port in port_order]
+    s = network.s[:, index][:, :, index]
+    z0 = np.real(network.z0[0, 0])
+
+    s_mm = MIXED_MODE_MATRIX @ s @ MIXED_MODE_MATRIX.T
+    s_dm = renormalize_2_port(s_mm[:, :2, :2], 2 * z0, z0)
+    s_cm = renormalize_2_port(s_mm[:, 2:, 2:], z0 / 2, z0)
+
+    # leave the ports of winding B open (no current), i.e. eliminate them from the admittance matrix; the potential of
+    # an open winding is undetermined without parasitic capacitances, hence the pseudo-inverse
+    y = s2y(s, z0)
+    y_oc = y[:, :2, :2] - y[:, :2, 2:] @ np.linalg.pinv(y[:, 2:, 2:]) @ y[:, 2:, :2]
+    s_oc = y2s(y_oc, z0)
+
+    networks = {}
+    for mode, s_mode in [('DM', s_dm), ('CM', s_cm), ('OC', s_oc)]:
+        networks[mode] = rf.Network(frequency=network.frequency, s=s_mode, z0=z0,
+                                    name=str(network.name) + "_" + mode)
+        # the configurations are series through by construction, independent of the setting of the measurements
+        networks[mode].mixed_mode = True
+    return networks
+
+
 class IOhandler:
     """
     The IOHandler class takes care of the filehandling.
@@ -17,6 +84,8 @@ class IOhandler:
     def __init__(self, logger_instance = logging.getLogger()):
         self.logger = logger_instance
         self.files = list()
+        # networks derived from 4-port CMC measurements, by path, modification time and port order
+        self.s4p_cache = {}
         self.autoname = True
         self.outpath = None
         self.filename = None
@@ -59,7 +128,8 @@ class IOhandler:
 
         try:
             for actual_path in path:
-                ntwk = rf.Network(actual_path)
+                with events.stage('load', file=os.path.basename(actual_path)):
+                    ntwk = rf.Network(actual_path)
 
                 #check if file is already loaded -> if so, skip it
                 if ntwk.name in [file.name for file in self.files]:
@@ -71,6 +141,25 @@ class IOhandler:
         except Exception as e:
             raise e
 
+    def load_cmc_s4p(self, path):
+        """
+        Method to load the 4-port measurement of a common mode choke and derive the networks of its DM, CM and OC
+        configurations (see mixed_mode_networks()). The derived networks are cached; loading an unchanged file again
+        does not read or convert it
+
+        :param path: The path of the .s4p file
+        :return: A dict containing a 2-port skrf.Network for each of 'DM', 'CM' and 'OC'
+        """
+        path = os.path.abspath(path)
+        key = (path, os.path.getmtime(path), tuple(config.CMC_S4P_PORT_ORDER))
+        if key not in self.s4p_cache:
+            with events.stage('load', file=os.path.basename(path)):
+                network = rf.Network(path)
+            with events.stage('mixed-mode conversion', file=os.path.basename(path)):
+                self.s4p_cache[key] = mixed_mode_networks(network, config.CMC_S4P_PORT_ORDER)
+            self.logger.info("Opened file: \"" + network.name + "\"")
+        return self.s4p_cache[key]
+
     def generate_Netlist_2_port(self, parameters, fit_order, fit_type, saturation_table, captype = None):
         """
         Writes an LTSpice Netlist to the path that is stored in the IOhandlers instance variable.
@@ -80,8 +169,8 @@ class IOhandler:
         dependent in this form of output.
 
 
-        :param parameters: The Parameters for the model. A Parameters() object containing the model parameters for
-            reference file
+        :param parameters: The parameters of the model of the reference file. A dict containing the values of the
+            model parameters (see ParameterMatrix.row())
         :param fit_order: The order of the model i.e. the number of circuits
         :param fit_type: Whether the element is a coil or capacitor
         :param saturation_table: The saturation table for the elements. A dict type object with a key equal to that of
@@ -102,10 +191,10 @@ class IOhandler:
                     model_name = self.modelname
 
                 # main element parameters
-                L = out['L'].value*config.INDUNIT
-                C = out['C'].value*config.CAPUNIT
-                R_s = out['R_s'].value
-                R_p = out['R_Fe'].value
+                L = out['L']*config.INDUNIT
+                C = out['C']*config.CAPUNIT
+                R_s = out['R_s']
+                R_p = out['R_Fe']
 
                 lib = '* Netlist for Inductor Model {name} (L={value}H)\n' \
                       '* Including {number} Serially Chained Parallel Resonant Circuits\n*\n'.format(name=model_name,
@@ -116,9 +205,9 @@ class IOhandler:
 
                 ############### HIGHER ORDER ELEMENTS ##################################################################
                 for circuit in range(1, order + 1):
-                    Cx = out['C%s' % circuit].value*config.CAPUNIT
-                    Lx = out['L%s' % circuit].value*config.INDUNIT
-                    Rx = out['R%s' % circuit].value
+                    Cx = out['C%s' % circuit]*config.CAPUNIT
+                    Lx = out['L%s' % circuit]*config.INDUNIT
+                    Rx = out['R%s' % circuit]
                     node2 = circuit + 1 if circuit < order else 'PORT2'
                     lib += 'C{no} {node1} {node2} '.format(no=circuit, node1=circuit, node2=node2) + str(Cx) + "\n"
                     lib += 'L{no} {node1} {node2} '.format(no=circuit, node1=circuit, node2=node2) + str(Lx) + "\n"
@@ -169,10 +258,10 @@ class IOhandler:
                     model_name = self.modelname
 
                 # main element parameters
-                C = out['C'].value*config.CAPUNIT
-                Ls = out['L'].value*config.INDUNIT
-                R_s = out['R_s'].value
-                R_iso = out['R_iso'].value
+                C = out['C']*config.CAPUNIT
+                Ls = out['L']*config.INDUNIT
+                R_s = out['R_s']
+                R_iso = out['R_iso']
 
                 lib = '* Netlist for Capacitor Model {name} (C={value}F)\n' \
                       '* Including {number} Parallely Chained Serial Resonant Circuits\n*\n'.format(name=model_name,
@@ -183,9 +272,9 @@ class IOhandler:
                 ############### ACOUSTIC RESONANCE PARAMETERS FOR MLCCs ################################################
 
                 if captype == constants.captype.MLCC:
-                    RA = out['R_A'].value
-                    LA = out['L_A'].value*config.INDUNIT
-                    CA = out['C_A'].value*config.CAPUNIT
+                    RA = out['R_A']
+                    LA = out['L_A']*config.INDUNIT
+                    CA = out['C_A']*config.CAPUNIT
                     # current dependent coil for higher order res:
                     lib += 'BL{no} PORT1 NL{node1} '.format(no='A', node1='A') + 'V=V(VL{no})*V(K_L{no})'.format(no='A') + "\n"
                     lib += 'L{no} VL{no} 0 '.format(no='A') + str(LA) + "\n"
@@ -216,9 +305,9 @@ class IOhandler:
 
                 ############### HIGHER ORDER ELEMENTS ##################################################################
                 for circuit in range(1, order + 1):
-                    Cx = out['C%s' % circuit].value*config.CAPUNIT
-                    Lx = out['L%s' % circuit].value*config.INDUNIT
-                    Rx = out['R%s' % circuit].value
+                    Cx = out['C%s' % circuit]*config.CAPUNIT
+                    Lx = out['L%s' % circuit]*config.INDUNIT
+                    Rx = out['R%s' % circuit]
 
                     lib += 'R{no} PORT1 NR{node2} '.format(no=circuit, node2=circuit) + str(Rx) + "\n"
                     lib += 'L{no} NR{node1} NL{node2} '.format(no=circuit, node1=circuit, node2=circuit) + str(
@@ -284,8 +373,8 @@ class IOhandler:
         This method **does output fully parametric models**, i.e. the higher order resonant circuits **will be**
         current/voltage dependent as well as the main element.
 
-        :param parameters: The Parameters for the model. A Parameters() object containing the parameters of the
-            reference file
+        :param parameters: The parameters of the model of the reference file. A dict containing the values of the
+            model parameters (see ParameterMatrix.row())
         :param fit_order: The order of the model i.e. the number of circuits
         :param fit_type: Whether the element is a coil or capacitor
         :param saturation_table: The saturation table for the elements. A dict type object with a key equal to that of
@@ -306,10 +395,10 @@ class IOhandler:
                     model_name = self.modelname
 
                 # parameters for the main elements
-                L = out['L'].value*config.INDUNIT
-                C = out['C'].value*config.CAPUNIT
-                R_s = out['R_s'].value
-                R_p = out['R_Fe'].value
+                L = out['L']*config.INDUNIT
+                C = out['C']*config.CAPUNIT
+                R_s = out['R_s']
+                R_p = out['R_Fe']
 
                 lib = '* Netlist for Inductor Model {name} (L={value}H)\n' \
                       '* Including {number} Serially Chained Parallel Resonant Circuits\n*\n'.format(name=model_name,
@@ -318,9 +407,9 @@ class IOhandler:
 
                 ############### HIGHER ORDER ELEMENTS ##################################################################
                 for circuit in range(1, order + 1):
-                    Cx = out['C%s' % circuit].value*config.CAPUNIT
-                    Lx = out['L%s' % circuit].value*config.INDUNIT
-                    Rx = out['R%s' % circuit].value
+                    Cx = out['C%s' % circuit]*config.CAPUNIT
+                    Lx = out['L%s' % circuit]*config.INDUNIT
+                    Rx = out['R%s' % circuit]
                     node2 = circuit + 1 if circuit < order else 'PORT2'
 
                     #current dependent coil for higher order res:
@@ -391,10 +480,10 @@ class IOhandler:
                     model_name = self.modelname
 
                 # main element parameters
-                C = out['C'].value*config.CAPUNIT
-                Ls = out['L'].value*config.INDUNIT
-                R_s = out['R_s'].value
-                R_iso = out['R_iso'].value
+                C = out['C']*config.CAPUNIT
+                Ls = out['L']*config.INDUNIT
+                R_s = out['R_s']
+                R_iso = out['R_iso']
 
                 lib = '* Netlist for Capacitor Model {name} (C={value}F)\n' \
                       '* Including {number} Parallely Chained Serial Resonant Circuits\n*\n'.format(name=model_name,
@@ -404,9 +493,9 @@ class IOhandler:
 
                 ############### HIGHER ORDER ELEMENTS ##################################################################
                 for circuit in range(1, order + 1):
-                    Cx = out['C%s' % circuit].value*config.CAPUNIT
-                    Lx = out['L%s' % circuit].value*config.INDUNIT
-                    Rx = out['R%s' % circuit].value
+                    Cx = out['C%s' % circuit]*config.CAPUNIT
+                    Lx = out['L%s' % circuit]*config.INDUNIT
+                    Rx = out['R%s' % circuit]
                     node2 = circuit + 1 if circuit < order else 'PORT2'
 
                     # Voltage dependent coil for higher order res:
@@ -440,9 +529,9 @@ class IOhandler:
 
                 ############### ACOUSTIC RESONANCE FOR MLCCs ###########################################################
                 if captype == constants.captype.MLCC:
-                    RA = out['R_A'].value
-                    LA = out['L_A'].value*config.INDUNIT
-                    CA = out['C_A'].value*config.CAPUNIT
+                    RA = out['R_A']
+                    LA = out['L_A']*config.INDUNIT
+                    CA = out['C_A']*config.CAPUNIT
 
                     # Voltage dependent inductance:
                     # B source mimicking the inductor
@@ -546,10 +635,10 @@ class IOhandler:
 
 
         # DM main resonance
-        L = parametersDM['L'].value * config.INDUNIT / 4
-        C = parametersDM['C'].value * config.CAPUNIT * 2
-        R_s = parametersDM['R_s'].value / 2
-        R_p = parametersDM['R_Fe'].value / 2
+        L = parametersDM['L'] * config.INDUNIT / 4
+        C = parametersDM['C'] * config.CAPUNIT * 2
+        R_s = parametersDM['R_s'] / 2
+        R_p = parametersDM['R_Fe'] / 2
 
         lib += 'R_sADM {port1} BDM1A {Rs}'.format(port1=nextnodeA, Rs=R_s) + "\n"
         lib += 'R_pADM BDM1A {MRterminal} {Rp}'.format(MRterminal=DMCMnodeA, Rp=R_p) + "\n"
@@ -571,10 +660,10 @@ class IOhandler:
         nextnodeB = "MRB" if (fit_orderCM > 0 or fit_orderDM > 0) else node4
 
         # CM main resonance
-        L = parametersCM['L'].value * config.INDUNIT
-        C = parametersCM['C'].value * config.CAPUNIT / 2
-        R_s = parametersCM['R_s'].value * 2
-        R_p = parametersCM['R_Fe'].value * 2
+        L = parametersCM['L'] * config.INDUNIT
+        C = parametersCM['C'] * config.CAPUNIT / 2
+        R_s = parametersCM['R_s'] * 2
+        R_p = parametersCM['R_Fe'] * 2
 
         lib += 'R_sACM {port1} BCM1A {Rs}'.format(port1=DMCMnodeA, Rs=R_s) + "\n"
         lib += 'R_pACM BCM1A {MRterminal} {Rp}'.format(MRterminal=nextnodeA, Rp=R_p) + "\n"
@@ -598,9 +687,9 @@ class IOhandler:
         for circuit in range(1, fit_orderDM + 1):
             ID = "DM" + str(circuit)
 
-            Cx = (parametersDM['C%s' % circuit].value*2) * config.CAPUNIT
-            Lx = (parametersDM['L%s' % circuit].value/4) * config.INDUNIT
-            Rx = (parametersDM['R%s' % circuit].value/2)
+            Cx = (parametersDM['C%s' % circuit]*2) * config.CAPUNIT
+            Lx = (parametersDM['L%s' % circuit]/4) * config.INDUNIT
+            Rx = (parametersDM['R%s' % circuit]/2)
 
             n2A = "DM_A_" + str(circuit) if not(circuit == fit_orderDM and fit_orderCM == 0) else node2
             n2B = "DM_B_" + str(circuit) if not(circuit == fit_orderDM and fit_orderCM == 0) else node4
@@ -628,9 +717,9 @@ class IOhandler:
         for circuit in range(1, fit_orderCM + 1):
             ID = "CM" + str(circuit)
 
-            Cx = (parametersCM['C%s' % circuit].value / 2) * config.CAPUNIT
-            Lx = (parametersCM['L%s' % circuit].value) * config.INDUNIT
-            Rx = (parametersCM['R%s' % circuit].value * 2)
+            Cx = (parametersCM['C%s' % circuit] / 2) * config.CAPUNIT
+            Lx = (parametersCM['L%s' % circuit]) * config.INDUNIT
+            Rx = (parametersCM['R%s' % circuit] * 2)
 
             n2A = "CM_A_" + str(circuit) if not(circuit == fit_orderCM) else node2
             n2B = "CM_B_" + str(circuit) if not(circuit == fit_orderCM) else node4
@@ -702,8 +791,8 @@ class IOhandler:
         dependent in this form of output.
 
 
-        :param parameters: The Parameters for the model. A Parameters() object containing the model parameters for
-            reference file
+        :param parameters: The parameters of the model of the reference file. A dict containing the values of the
+            model parameters (see ParameterMatrix.row())
         :param fit_order: The order of the model i.e. the number of circuits
         :param fit_type: Whether the element is a coil or capacitor
         :param saturation_table: The saturation table for the elements. A dict type object with a key equal to that of
@@ -724,10 +813,10 @@ class IOhandler:
                     model_name = self.modelname
 
                 # main element parameters
-                L = out['L'].value*config.INDUNIT
-                C = out['C'].value*config.CAPUNIT
-                R_s = out['R_s'].value
-                R_p = out['R_Fe'].value
+                L = out['L']*config.INDUNIT
+                C = out['C']*config.CAPUNIT
+                R_s = out['R_s']
+                R_p = out['R_Fe']
 
                 lib = '* Netlist for Inductor Model {name} (L={value}H)\n' \
                       '* Including {number} Serially Chained Parallel Resonant Circuits\n*\n'.format(name=model_name,
@@ -738,9 +827,9 @@ class IOhandler:
 
                 ############### HIGHER ORDER ELEMENTS ##################################################################
                 for circuit in range(1, order + 1):
-                    Cx = out['C%s' % circuit].value*config.CAPUNIT
-                    Lx = out['L%s' % circuit].value*config.INDUNIT
-                    Rx = out['R%s' % circuit].value
+                    Cx = out['C%s' % circuit]*config.CAPUNIT
+                    Lx = out['L%s' % circuit]*config.INDUNIT
+                    Rx = out['R%s' % circuit]
                     node2 = circuit + 1 if circuit < order else 'PORT2'
                     lib += 'C{no} {node1} {node2} '.format(no=circuit, node1=circuit, node2=node2) + str(Cx) + "\n"
                     lib += 'L{no} {node1} {node2} '.format(no=circuit, node1=circuit, node2=node2) + str(Lx) + "\n"
@@ -771,10 +860,10 @@ class IOhandler:
                     model_name = self.modelname
 
                 # main element parameters
-                C = out['C'].value*config.CAPUNIT
-                Ls = out['L'].value*config.INDUNIT
-                R_s = out['R_s'].value
-                R_iso = out['R_iso'].value
+                C = out['C']*config.CAPUNIT
+                Ls = out['L']*config.INDUNIT
+                R_s = out['R_s']
+                R_iso = out['R_iso']
 
                 lib = '* Netlist for Capacitor Model {name} (C={value}F)\n' \
                       '* Including {number} Parallely Chained Serial Resonant Circuits\n*\n'.format(name=model_name,
@@ -796,9 +885,9 @@ class IOhandler:
 
                 ############### HIGHER ORDER ELEMENTS ##################################################################
                 for circuit in range(1, order + 1):
-                    Cx = out['C%s' % circuit].value*config.CAPUNIT
-                    Lx = out['L%s' % circuit].value*config.INDUNIT
-                    Rx = out['R%s' % circuit].value
+                    Cx = out['C%s' % circuit]*config.CAPUNIT
+                    Lx = out['L%s' % circuit]*config.INDUNIT
+                    Rx = out['R%s' % circuit]
 
                     lib += 'R{no} PORT1 {node2} '.format(no=circuit, node2=circuit) + str(Rx) + "\n"
                     lib += 'L{no} {node1} {node2} '.format(no=circuit, node1=circuit, node2=order + circuit) + str(
@@ -807,9 +896,9 @@ class IOhandler:
 
                 # Add acoustic resonance if present
                 if captype == constants.captype.MLCC:
-                    RA = out['R_A'].value
-                    LA = out['L_A'].value*config.INDUNIT
-                    CA = out['C_A'].value*config.CAPUNIT
+                    RA = out['R_A']
+                    LA = out['L_A']*config.INDUNIT
+                    CA = out['C_A']*config.CAPUNIT
 
                     lib += 'R{no} PORT1 {node2} '.format(no="A", node2="nA1") + str(RA) + "\n"
                     lib += 'L{no} {node1} {node2} '.format(no="A", node1="nA1", node2="nA2") + str(
@@ -844,100 +933,27 @@ class IOhandler:
             file.write(lib)
             file.close()
 
-    def export_parameters(self, param_array, order, fit_type, captype = None):
+    def export_parameters(self, results, order, fit_type, captype = None):
         """
         Method to output the obtained model parameters as an .xlsx file to the directory in IOhandlers output path.
 
-        :param param_array: An array containing Parameters() type objects for each file
+        :param results: A ParameterMatrix containing the parameters of all files
         :param order: The order of the model, i.e. the number of resonance circuits
         :param fit_type: Whether the model is for a coil or capacitor
         :param captype: The type of capacitor. Can be GENERIC or MLCC
         :return: None
         """
 
-        out_dict = {}
+        #the main resonance parameters, followed by the circuits in the order C, L, R, w, BW
+        names = main_parameter_names(fit_type, captype)
+        for key in range(1, order + 1):
+            names += [element + str(key) for element in ['C', 'L', 'R', 'w', 'BW']]
 
-        #write the main resonance parameters to the dict
-        match fit_type:
-            case constants.El.INDUCTOR:
-                R_s_list = []
-                R_Fe_list =[]
-                L_list = []
-                C_list = []
-                for param_set in param_array:
-                    R_s_list.append(param_set['R_s'].value)
-                    R_Fe_list.append(param_set['R_Fe'].value)
-                    L_list.append(param_set['L'].value*config.INDUNIT)
-                    C_list.append(param_set['C'].value*config.CAPUNIT)
-
-                out_dict['R_s'] = R_s_list
-                out_dict['R_Fe'] = R_Fe_list
-                out_dict['L'] = L_list
-                out_dict['C'] = C_list
-
-
-            case constants.El.CAPACITOR:
-                R_s_list = []
-                R_Iso_list = []
-                L_list = []
-                C_list = []
-                for param_set in param_array:
-                    R_s_list.append(param_set['R_s'].value)
-                    R_Iso_list.append(param_set['R_iso'].value)
-                    L_list.append(param_set['L'].value*config.INDUNIT)
-                    C_list.append(param_set['C'].value*config.CAPUNIT)
-
-                out_dict['R_s'] = R_s_list
-                out_dict['R_iso'] = R_Iso_list
-                out_dict['L'] = L_list
-                out_dict['C'] = C_list
-
-                if captype == constants.captype.MLCC:
-                    R_A_list = []
-                    L_A_list = []
-                    C_A_list = []
-                    for param_set in param_array:
-                        R_A_list.append(param_set['R_A'].value)
-                        L_A_list.append(param_set['L_A'].value*config.INDUNIT)
-                        C_A_list.append(param_set['C_A'].value*config.CAPUNIT)
-                    out_dict['R_A'] = R_A_list
-                    out_dict['L_A'] = L_A_list
-                    out_dict['C_A'] = C_A_list
-
-
-
-
-
-        for key  in range(1,order+1):
-            #generate key numbers and empty lists for the parameters
-            C_key = "C%s" % key
-            L_key = "L%s" % key
-            R_key = "R%s" % key
-            w_key = "w%s" % key
-            BW_key = "BW%s" % key
-
-            clist = []
-            llist = []
-            rlist = []
-            wlist = []
-            bwlist = []
-
-            #iterate through parameter sets
-            for param_set in param_array:
-                clist.append(param_set[C_key].value*config.CAPUNIT)
-                llist.append(param_set[L_key].value*config.INDUNIT)
-                rlist.append(param_set[R_key].value)
-                wlist.append(param_set[w_key].value*config.FUNIT)
-                bwlist.append(param_set[BW_key].value*config.FUNIT)
-
-            out_dict[C_key] = clist
-            out_dict[L_key] = llist
-            out_dict[R_key] = rlist
-            out_dict[w_key] = wlist
-            out_dict[BW_key] = bwlist
+        #all columns are converted to SI units at once
+        si_values = results.si_values()[:, [results.columns[name] for name in names]]
 
         #write parameters to a pandas dataframe and transpose
-        data_out = pd.DataFrame(out_dict)
+        data_out = pd.DataFrame(si_values, columns=names)
         # data_out.transpose()
         if self.autoname:
             out_path = os.path.split(self.outpath)[0]
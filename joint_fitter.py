@@ -0,0 +1,291 @@
+import copy
+import logging
+import time
+
+import numpy as np
+import scipy.optimize
+import scipy.sparse
+
+import cancellation
+import config
+import constants
+import events
+import kernels
+from optimizer import stage_deadline
+
+
+class _FitAborted(Exception):
+    """
+    Raised by the objective function of the joint fit to stop the optimizer (see JointFitter._residual())
+    """
+
+
+class JointFitter:
+    """
+    The JointFitter fits the models of all DC bias files of one component as one least squares problem.
+
+    Parameters that are physically independent of the DC bias (e.g. R_s and the parasitic C of a coil or R_iso of a
+    capacitor) are shared between all files, i.e. they are represented by a single optimization variable. All other
+    free parameters are local to their file. Since the residual of a file only depends on the shared parameters and its
+    own local parameters, the Jacobian is block-sparse; this is passed to the optimizer so that the finite difference
+    Jacobian needs only (number of shared + max. number of local parameters) evaluations instead of one per parameter.
+    """
+
+    # main resonance parameters that are set free for the joint fit
+    MAIN_RES_KEYS = {constants.El.INDUCTOR: ['R_s', 'C', 'R_Fe'],
+                     constants.El.CAPACITOR: ['R_iso', 'L']}
+
+    # main resonance parameters that are shared between all files
+    SHARED_MAIN_RES_KEYS = {constants.El.INDUCTOR: ['R_s', 'C'],
+                            constants.El.CAPACITOR: ['R_iso']}
+
+    def __init__(self, fitters, share_higher_order = None, logger_instance = logging.getLogger()):
+        """
+        :param fitters: A list of Fitter instances (one per DC bias file) with fitted main resonances and created
+            higher order parameters
+        :param share_higher_order: Boolean. Whether the higher order circuits are shared between all files. If not
+            supplied, the circuits are shared if config.FULL_FIT is not set
+        :param logger_instance: A logger instance
+        """
+        if share_higher_order is None:
+            share_higher_order = not config.FULL_FIT
+
+        self.fitters = fitters
+        self.fit_type = fitters[0].fit_type
+        self.share_higher_order = share_higher_order
+        self.logger = logger_instance
+
+        self.shared_keys = []
+        self.local_keys = []
+        self.nfev = 0
+        self.accepted = False
+
+        # convergence policy (see optimizer.py): deadline of the fit, best vector found and the reason of an abort
+        self.deadline = None
+        self.best_cost = np.inf
+        self.best_x = None
+        self.abort_reason = None
+
+    def get_shared_keys(self):
+        """
+        Method to get the keys of the parameters that are shared between all files
+
+        :return: A list of parameter keys
+        """
+        shared_keys = list(self.SHARED_MAIN_RES_KEYS[self.fit_type])
+
+        if self.share_higher_order:
+            for key_number in range(1, self.fitters[0].order + 1):
+                shared_keys += ["R%s" % key_number, "C%s" % key_number, "w%s" % key_number]
+
+        return shared_keys
+
+    def _prepare_parameters(self):
+        """
+        Method to free the parameters for the joint fit and to collect the shared and local parameter keys.
+
+        If the higher order circuits are shared, the circuits of the reference file (first fitter) are copied to all
+        other files, including bounds and expressions.
+
+        :return: None
+        """
+        reference_set = self.fitters[0].parameters
+
+        for fitter in self.fitters:
+            param_set = fitter.parameters
+
+            for key in self.MAIN_RES_KEYS[self.fit_type]:
+                if not param_set[key].expr:
+                    param_set[key].vary = True
+
+            if self.share_higher_order:
+                fitter.order = self.fitters[0].order
+                for key_number in range(1, fitter.order + 1):
+                    for key in ["BW%s", "R%s", "C%s", "w%s", "L%s"]:
+                        ref_param = reference_set[key % key_number]
+                        param_set.add(key % key_number, value=ref_param.value, min=ref_param.min, max=ref_param.max,
+                                      vary=ref_param.vary, expr=ref_param.expr)
+
+        self.shared_keys = [key for key in self.get_shared_keys()
+                            if reference_set[key].vary and not reference_set[key].expr]
+
+        # Shared parameters get the widest bounds of all files, so writing a shared value never gets clipped
+        for key in self.shared_keys:
+            param_min = min([fitter.parameters[key].min for fitter in self.fitters])
+            param_max = max([fitter.parameters[key].max for fitter in self.fitters])
+            for fitter in self.fitters:
+                fitter.parameters[key].set(min=param_min, max=param_max)
+
+        self.local_keys = []
+        for fitter in self.fitters:
+            self.local_keys.append([key for key, param in fitter.parameters.items()
+                                    if param.vary and not param.expr and key not in self.shared_keys])
+
+    def _get_fit_data(self, fitter):
+        """
+        Method to get the frequency vector and the data the joint fit is done on for a single file; that is the data
+        above the linear range offset up to the upper frequency limit. The data is wrapped in an ObjectiveContext (see
+        kernels.py), which is shared by all evaluations of the joint fit
+
+        :param fitter: A Fitter instance
+        :return: Tuple (freq, context)
+        """
+        freq = fitter.freq[fitter._offset:]
+        data = fitter.z21_data[fitter._offset:]
+        mask = freq < config.FREQ_UPPER_LIMIT
+        return freq[mask], kernels.ObjectiveContext(freq[mask], data[mask])
+
+    def _write_vector(self, x):
+        """
+        Method to write an optimization vector to the Parameters() objects of all files
+
+        :param x: The optimization vector; shared parameters first, followed by the local parameters of each file
+        :return: None
+        """
+        n_shared = len(self.shared_keys)
+
+        for fitter in self.fitters:
+            for key, value in zip(self.shared_keys, x[:n_shared]):
+                fitter.parameters[key].value = value
+
+        offset = n_shared
+        for fitter, keys in zip(self.fitters, self.local_keys):
+            for key, value in zip(keys, x[offset:offset + len(keys)]):
+                fitter.parameters[key].value = value
+            offset += len(keys)
+
+    def _residual(self, x, fit_data):
+        """
+        Objective function for the joint fit. Concatenates the residuals of all files; keeps track of the best vector
+        and stops the optimizer if the run is cancelled or the time budget of the stage is exceeded
+
+        :param x: The optimization vector
+        :param fit_data: A list of (freq, context) tuples, one per file (see _get_fit_data())
+        :return: The residual vector
+        :raises _FitAborted: if the fit is to be stopped
+        """
+        if cancellation.CANCEL_EVENT.is_set():
+            self.abort_reason = "cancelled"
+        elif self.deadline is not None and time.perf_counter() > self.deadline:
+            self.abort_reason = "time budget exceeded"
+        if self.abort_reason is not None:
+            raise _FitAborted()
+
+        self.nfev += 1
+        self._write_vector(x)
+
+        residuals = []
+        for fitter, (freq, context) in zip(self.fitters, fit_data):
+            residuals.append(fitter._calculate_Z(fitter.parameters, freq, context, fitter.order, 0, config.FIT_BY))
+
+        residual = np.concatenate(residuals)
+        cost = 0.5 * np.sum(residual ** 2)
+        if cost < self.best_cost:
+            self.best_cost = cost
+            self.best_x = np.array(x, dtype=float)
+        return residual
+
+    def _jacobian_sparsity(self, fit_data):
+        """
+        Method to create the block sparsity structure of the Jacobian
+
+        :param fit_data: A list of (freq, context) tuples, one per file (see _get_fit_data())
+        :return: A scipy.sparse matrix with ones where the Jacobian can be non-zero
+        """
+        n_shared = len(self.shared_keys)
+        n_rows = sum([len(freq) for freq, context in fit_data])
+        n_cols = n_shared + sum([len(keys) for keys in self.local_keys])
+
+        sparsity = scipy.sparse.lil_matrix((n_rows, n_cols), dtype=np.int8)
+
+        row = 0
+        col = n_shared
+        for (freq, context), keys in zip(fit_data, self.local_keys):
+            sparsity[row:row + len(freq), :n_shared] = 1
+            sparsity[row:row + len(freq), col:col + len(keys)] = 1
+            row += len(freq)
+            col += len(keys)
+
+        return sparsity
+
+    def fit(self, max_nfev = None):
+        """
+        Method to run the joint fit. The fitted parameters are written back to the fitters' parameters
+
+        :param max_nfev: (optional) The max. number of evaluations of the fit, e.g. for a brief refit; if not supplied,
+            config.FIT_MAX_NFEV applies
+        :return: A list containing the fitted Parameters() objects of all files; if the joint fit does not improve the
+            model, the parameters of the independent fits are kept and self.accepted is False
+        """
+        fit_data = [self._get_fit_data(fitter) for fitter in self.fitters]
+
+        # Keep a copy of the independent fits, in case the joint fit turns out worse; their cost is evaluated with every
+        # file's own parameters, before the shared parameters are unified
+        initial_sets = [copy.deepcopy(fitter.parameters) for fitter in self.fitters]
+        initial_orders = [fitter.order for fitter in self.fitters]
+        initial_cost = 0.5 * sum([np.sum(fitter._calculate_Z(fitter.parameters, freq, context, fitter.order, 0,
+                                                             config.FIT_BY) ** 2)
+                                  for fitter, (freq, context) in zip(self.fitters, fit_data)])
+
+        self._prepare_parameters()
+
+        # Initial values and bounds; shared parameters start at the median over all files
+        x0, lower, upper = [], [], []
+        for key in self.shared_keys:
+            param = self.fitters[0].parameters[key]
+            x0.append(np.median([fitter.parameters[key].value for fitter in self.fitters]))
+            lower.append(param.min)
+            upper.append(param.max)
+
+        for fitter, keys in zip(self.fitters, self.local_keys):
+            for key in keys:
+                param = fitter.parameters[key]
+                x0.append(param.value)
+                lower.append(param.min)
+                upper.append(param.max)
+
+        x0 = np.clip(np.array(x0, dtype=float), lower, upper)
+
+        self.nfev = 0
+        self.best_cost = np.inf
+        self.best_x = None
+        self.abort_reason = None
+        self.deadline = stage_deadline()
+        start_time = time.perf_counter()
+        start_cpu_time = time.thread_time()
+        # the convergence policy of config.py applies to the joint fit as well (see optimizer.py); the relative change
+        # of the cost and the step tolerance are passed to the solver, the evaluations are limited by the solver, the
+        # time budget and cancellation by the objective function; the solver does not take a step tolerance below the
+        # machine epsilon
+        try:
+            scipy.optimize.least_squares(self._residual, x0, args=(fit_data,), bounds=(lower, upper),
+                                         jac_sparsity=self._jacobian_sparsity(fit_data), x_scale='jac', method='trf',
+                                         ftol=config.FIT_FTOL, xtol=max(config.FIT_XTOL, np.finfo(float).eps),
+                                         max_nfev=config.FIT_MAX_NFEV if max_nfev is None else max_nfev)
+        except _FitAborted:
+            pass
+
+        # the best vector is taken, since the solver's last evaluation may have been a rejected step
+        if self.best_x is None:
+            self.best_x = x0
+            self.best_cost = initial_cost
+        self._write_vector(self.best_x)
+        events.emit('fit', stage='joint', nfev=self.nfev, nvarys=len(x0), elapsed=time.perf_counter() - start_time,
+                    cpu_time=time.thread_time() - start_cpu_time, residual=float(np.sqrt(2 * self.best_cost)),
+                    residual_initial=float(np.sqrt(2 * initial_cost)), aborted=self.abort_reason)
+
+        self.logger.info("Joint fit: {files} files, {shared} shared and {local} local parameters, {nfev} evaluations, "
+                         "cost {before:.4E} -> {after:.4E}{aborted}".format(
+                            files=len(self.fitters), shared=len(self.shared_keys),
+                            local=sum([len(k) for k in self.local_keys]), nfev=self.nfev, before=initial_cost,
+                            after=self.best_cost,
+                            aborted="; stopped: " + self.abort_reason if self.abort_reason else ""))
+
+        self.accepted = self.best_cost <= initial_cost
+        if not self.accepted:
+            self.logger.info("Joint fit did not improve the model; keeping the independent fits")
+            for fitter, param_set, order in zip(self.fitters, initial_sets, initial_orders):
+                fitter.parameters = param_set
+                fitter.order = order
+
+        return [fitter.parameters for fitter in self.fitters]
@@ -0,0 +1,531 @@
+"""
+Impedance kernels of the models.
+
+The kernels calculate the impedance of a model (main resonance, acoustic resonance of MLCCs and the higher order
+circuits) or directly the residual for a set of measurement data. Element values are passed in SI units.
+
+All kernels are evaluated through an ObjectiveContext. A context is created once per fit and holds everything that does
+not change during the fit: the angular frequency and its inverse, the transforms of the measurement data (magnitude,
+log-magnitude, phase, ...) and preallocated buffers the model and the residual are written to. An objective function
+that receives a context therefore does not allocate any arrays per evaluation.
+
+If Numba is installed and config.USE_JIT_KERNELS is set, JIT-compiled kernels are used. They evaluate the model and the
+residual in one loop over the frequency, without any temporary arrays or complex arithmetic. Otherwise the kernels fall
+back to NumPy ufuncs that work in-place on the buffers of the context; the higher order circuits are evaluated as one
+broadcast operation over all circuits and frequencies.
+
+Coils, capacitors and common mode chokes (DM, CM and OC configuration) share these kernels and the context.
+"""
+
+import numpy as np
+
+import config
+import constants
+
+try:
+    import numba
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+USE_NUMBA = HAS_NUMBA and config.USE_JIT_KERNELS
+
+# mode flags as module level integers; these are compile time constants for the JIT kernels
+_FIT = constants.fcnmode.FIT
+_FIT_LOG = constants.fcnmode.FIT_LOG
+_ANGLE = constants.fcnmode.ANGLE
+_FIT_REAL = constants.fcnmode.FIT_REAL
+_FIT_IMAG = constants.fcnmode.FIT_IMAG
+_INDUCTOR = constants.El.INDUCTOR
+
+# measurement types of common mode chokes
+CMC_MEAS_TYPES = {'DM': 1, 'CM': 2, 'OC': 3}
+_CMC_CM = CMC_MEAS_TYPES['CM']
+_CMC_OC = CMC_MEAS_TYPES['OC']
+
+
+def _jit(function):
+    """
+    Decorator to JIT-compile a kernel if Numba is available; without Numba, the plain Python function is returned
+    """
+    if HAS_NUMBA:
+        return numba.njit(cache=True)(function)
+    return function
+
+
+############################## NUMPY KERNELS ###########################################################################
+# The NumPy kernels write the impedance to the buffer Z; tmp and tmp2 are complex scratch buffers of the same length.
+
+def _series_rlc_numpy(w, w_inv, R, L, C, out, tmp):
+    # R + j(wL - 1/(wC))
+    np.multiply(w, 1j * L, out=out)
+    np.multiply(w_inv, 1j / C, out=tmp)
+    out -= tmp
+    out += R
+
+
+def _parallel_rlc_admittance_numpy(w, w_inv, R, L, C, out, tmp):
+    # 1/R + j(wC - 1/(wL))
+    np.multiply(w, 1j * C, out=out)
+    np.multiply(w_inv, 1j / L, out=tmp)
+    out -= tmp
+    out += 1 / R
+
+
+def _branches_numpy(w, w_inv, X, P, Q, branches, out, tmp):
+    # out += sum of 1/(X + j(P*w - Q/w)) over all circuits, evaluated on (circuits x frequencies) buffers;
+    # X, P, Q are (1/R, C, 1/L) for parallel and (R, L, 1/C) for series resonant circuits
+    if not len(X):
+        return
+    matrix, real, real2 = [buffer[:len(X)] for buffer in branches]
+    np.multiply.outer(P, w, out=real)
+    np.multiply.outer(Q, w_inv, out=real2)
+    real -= real2
+    matrix.real = X[:, np.newaxis]
+    matrix.imag = real
+    np.reciprocal(matrix, out=matrix)
+    np.sum(matrix, axis=0, out=tmp)
+    out += tmp
+
+
+def _model_numpy(fit_type, w, w_inv, main, acoustic, R_b, L_b, C_b, Z, tmp, tmp2, branches):
+    match fit_type:
+        case constants.El.INDUCTOR:
+            # R_s in series with R_Fe || L, all parallel to C
+            np.multiply(w_inv, -1j / main[1], out=tmp)
+            tmp += 1 / main[3]
+            np.reciprocal(tmp, out=tmp)
+            tmp += main[2]
+            np.reciprocal(tmp, out=tmp)
+            np.multiply(w, 1j * main[0], out=Z)
+            Z += tmp
+            np.reciprocal(Z, out=Z)
+
+            if len(acoustic):
+                _series_rlc_numpy(w, w_inv, acoustic[0], acoustic[1], acoustic[2], tmp, tmp2)
+                np.reciprocal(tmp, out=tmp)
+                np.reciprocal(Z, out=Z)
+                Z += tmp
+                np.reciprocal(Z, out=Z)
+
+            _branches_numpy(w, w_inv, 1 / R_b, C_b, 1 / L_b, branches, Z, tmp)
+
+        case constants.El.CAPACITOR:
+            # R_iso || C in series with L and R_s; all other circuits are parallel, so their admittances are summed up
+            np.multiply(w, 1j * main[0], out=tmp)
+            tmp += 1 / main[3]
+            np.reciprocal(tmp, out=tmp)
+            np.multiply(w, 1j * main[1], out=Z)
+            Z += tmp
+            Z += main[2]
+            np.reciprocal(Z, out=Z)
+
+            if len(acoustic):
+                _series_rlc_numpy(w, w_inv, acoustic[0], acoustic[1], acoustic[2], tmp, tmp2)
+                np.reciprocal(tmp, out=tmp)
+                Z += tmp
+
+            _branches_numpy(w, w_inv, R_b, L_b, 1 / C_b, branches, Z, tmp)
+
+            np.reciprocal(Z, out=Z)
+
+
+def _rlc_numpy(w, w_inv, R, L, C, ser_par, Z, tmp):
+    if ser_par == 1:
+        _series_rlc_numpy(w, w_inv, R, L, C, Z, tmp)
+    else:
+        _parallel_rlc_admittance_numpy(w, w_inv, R, L, C, Z, tmp)
+        np.reciprocal(Z, out=Z)
+
+
+def _band_numpy(w, w_inv, background, R, L, C, ser_par, Z, tmp):
+    # a parallel RLC in series with the background impedance, or a serial RLC in parallel with the background admittance
+    _rlc_numpy(w, w_inv, R, L, C, ser_par, Z, tmp)
+    if ser_par == 1:
+        np.reciprocal(Z, out=Z)
+        Z += background
+        np.reciprocal(Z, out=Z)
+    else:
+        Z += background
+
+
+def _cmc_numpy(w, w_inv, main, R_b, L_b, C_b, meas_type, R_s, C_p, Z, tmp, tmp2, branches):
+    _parallel_rlc_admittance_numpy(w, w_inv, main[2], main[1], main[0], Z, tmp)
+    np.reciprocal(Z, out=Z)
+
+    _branches_numpy(w, w_inv, 1 / R_b, C_b, 1 / L_b, branches, Z, tmp)
+
+    if meas_type == _CMC_CM:
+        Z += R_s
+    elif meas_type == _CMC_OC:
+        # Z_par || (Z + Z_par)
+        np.multiply(w_inv, -1j / C_p, out=tmp)
+        tmp += Z
+        np.reciprocal(tmp, out=tmp)
+        np.multiply(w, 1j * C_p, out=Z)
+        Z += tmp
+        np.reciprocal(Z, out=Z)
+
+
+def _residual_numpy(target, Z, modeflag, real_buffer, out):
+    match modeflag:
+        case constants.fcnmode.FIT:
+            np.abs(Z, out=real_buffer)
+        case constants.fcnmode.FIT_LOG:
+            np.abs(Z, out=real_buffer)
+            np.log10(real_buffer, out=real_buffer)
+        case constants.fcnmode.ANGLE:
+            np.arctan2(Z.imag, Z.real, out=real_buffer)
+        case constants.fcnmode.FIT_REAL:
+            real_buffer[:] = Z.real
+        case constants.fcnmode.FIT_IMAG:
+            real_buffer[:] = Z.imag
+    np.subtract(target, real_buffer, out=out)
+
+
+############################## JIT KERNELS #############################################################################
+# The JIT kernels work on real and imaginary parts separately; the admittances of the circuits are calculated
+# directly, so every circuit needs a single division.
+
+@_jit
+def _inverse(re, im):
+    norm_inv = 1 / (re * re + im * im)
+    return re * norm_inv, -im * norm_inv
+
+
+@_jit
+def _point_residual(target, re, im, modeflag):
+    if modeflag == _FIT:
+        return target - np.sqrt(re * re + im * im)
+    elif modeflag == _FIT_LOG:
+        return target - 0.5 * np.log10(re * re + im * im)
+    elif modeflag == _ANGLE:
+        return target - np.arctan2(im, re)
+    elif modeflag == _FIT_REAL:
+        return target - re
+    else:
+        return target - im
+
+
+@_jit
+def _model_point(fit_type, w, w_inv, main, acoustic, G_b, L_b, C_b):
+    # G_b holds the conductances of the higher order circuits for coils, the resistances for capacitors; L_b holds the
+    # inverse inductances for coils and C_b the inverse capacitances for capacitors
+    if fit_type == _INDUCTOR:
+        # R_s in series with R_Fe || L, all parallel to C
+        re, im = _inverse(1 / main[3], -w_inv / main[1])
+        y_re, y_im = _inverse(main[2] + re, im)
+        re, im = _inverse(y_re, y_im + w * main[0])
+        if len(acoustic):
+            y_re, y_im = _inverse(re, im)
+            a_re, a_im = _inverse(acoustic[0], w * acoustic[1] - w_inv / acoustic[2])
+            re, im = _inverse(y_re + a_re, y_im + a_im)
+        for it in range(len(G_b)):
+            b_re, b_im = _inverse(G_b[it], w * C_b[it] - w_inv * L_b[it])
+            re += b_re
+            im += b_im
+        return re, im
+
+    # R_iso || C in series with L and R_s; all other circuits are parallel, so their admittances are summed up
+    re, im = _inverse(1 / main[3], w * main[0])
+    y_re, y_im = _inverse(re + main[2], im + w * main[1])
+    if len(acoustic):
+        a_re, a_im = _inverse(acoustic[0], w * acoustic[1] - w_inv / acoustic[2])
+        y_re += a_re
+        y_im += a_im
+    for it in range(len(G_b)):
+        b_re, b_im = _inverse(G_b[it], w * L_b[it] - w_inv * C_b[it])
+        y_re += b_re
+        y_im += b_im
+    return _inverse(y_re, y_im)
+
+
+@_jit
+def _branch_values(fit_type, R_b, L_b, C_b):
+    if fit_type == _INDUCTOR:
+        return 1 / R_b, 1 / L_b, C_b
+    return R_b, L_b, 1 / C_b
+
+
+@_jit
+def _model_impedance_jit(fit_type, w, w_inv, main, acoustic, R_b, L_b, C_b, out):
+    G_b, L_b, C_b = _branch_values(fit_type, R_b, L_b, C_b)
+    for k in range(len(w)):
+        re, im = _model_point(fit_type, w[k], w_inv[k], main, acoustic, G_b, L_b, C_b)
+        out[k] = complex(re, im)
+
+
+@_jit
+def _model_residual_jit(fit_type, w, w_inv, target, main, acoustic, R_b, L_b, C_b, modeflag, out):
+    G_b, L_b, C_b = _branch_values(fit_type, R_b, L_b, C_b)
+    for k in range(len(w)):
+        re, im = _model_point(fit_type, w[k], w_inv[k], main, acoustic, G_b, L_b, C_b)
+        out[k] = _point_residual(target[k], re, im, modeflag)
+
+
+@_jit
+def _rlc_residual_jit(w, w_inv, target, R, L, C, ser_par, modeflag, out):
+    for k in range(len(w)):
+        if ser_par == 1:
+            re, im = R, w[k] * L - w_inv[k] / C
+        else:
+            re, im = _inverse(1 / R, w[k] * C - w_inv[k] / L)
+        out[k] = _point_residual(target[k], re, im, modeflag)
+
+
+@_jit
+def _band_residual_jit(w, w_inv, target, background, R, L, C, ser_par, modeflag, out):
+    for k in range(len(w)):
+        if ser_par == 1:
+            re, im = _inverse(R, w[k] * L - w_inv[k] / C)
+            re, im = _inverse(re + background[k].real, im + background[k].imag)
+        else:
+            re, im = _inverse(1 / R, w[k] * C - w_inv[k] / L)
+            re += background[k].real
+            im += background[k].imag
+        out[k] = _point_residual(target[k], re, im, modeflag)
+
+
+@_jit
+def _cmc_point(w, w_inv, main, G_b, L_inv_b, C_b, meas_type, R_s, C_p):
+    re, im = _inverse(1 / main[2], w * main[0] - w_inv / main[1])
+    for it in range(len(G_b)):
+        b_re, b_im = _inverse(G_b[it], w * C_b[it] - w_inv * L_inv_b[it])
+        re += b_re
+        im += b_im
+
+    if meas_type == _CMC_CM:
+        return re + R_s, im
+    if meas_type == _CMC_OC:
+        # Z_par || (Z + Z_par)
+        y_re, y_im = _inverse(re, im - w_inv / C_p)
+        return _inverse(y_re, y_im + w * C_p)
+    return re, im
+
+
+@_jit
+def _cmc_residual_jit(w, w_inv, target, main, R_b, L_b, C_b, meas_type, R_s, C_p, modeflag, out):
+    G_b = 1 / R_b
+    L_inv_b = 1 / L_b
+    for k in range(len(w)):
+        re, im = _cmc_point(w[k], w_inv[k], main, G_b, L_inv_b, C_b, meas_type, R_s, C_p)
+        out[k] = _point_residual(target[k], re, im, modeflag)
+
+
+############################## OBJECTIVE CONTEXT #######################################################################
+
+class ObjectiveContext:
+    """
+    The ObjectiveContext holds the frequency dependent quantities of a fit that do not change between evaluations and
+    the buffers the model and the residual are written to.
+
+    Note: the residuals returned by the context are written to the same buffer on every evaluation, i.e. a returned
+    residual is only valid until the next evaluation. The optimizers evaluate the residual right away, so they are not
+    affected by this; impedances (OUTPUT mode) are returned as copies.
+    """
+
+    def __init__(self, freq, data = None):
+        """
+        :param freq: The frequency vector
+        :param data: (optional) The measured impedance; needed for residuals
+        """
+        self.freq = np.asarray(freq, dtype=float)
+        self.data = data
+        self.w = self.freq * 2 * np.pi
+        self.w_inv = 1 / self.w
+
+        # Data transforms are calculated on first use, one per mode flag
+        self._targets = {}
+
+        # Buffers
+        self._Z = np.empty(len(self.freq), dtype=complex)
+        self._tmp = np.empty(len(self.freq), dtype=complex)
+        self._tmp2 = np.empty(len(self.freq), dtype=complex)
+        self._real = np.empty(len(self.freq))
+        self._diff = np.empty(len(self.freq))
+        # (circuits x frequencies) buffers of the NumPy kernels; grown to the order of the model on first use
+        self._branches = [np.empty((0, len(self.freq)), dtype=complex), np.empty((0, len(self.freq))),
+                          np.empty((0, len(self.freq)))]
+
+    def branch_buffers(self, order):
+        """
+        Method to get the buffers the NumPy kernels evaluate the higher order circuits in
+
+        :param order: The number of circuits
+        :return: A list of a complex and two real buffers with at least order rows
+        """
+        if self._branches[0].shape[0] < order:
+            self._branches = [np.empty((order, len(self.freq)), dtype=buffer.dtype) for buffer in self._branches]
+        return self._branches
+
+    def target(self, modeflag):
+        """
+        Method to get the transform of the data the model is compared to for a given mode (e.g. the magnitude for FIT)
+
+        :param modeflag: The kind of difference (see constants.fcnmode)
+        :return: The transformed data
+        """
+        if modeflag not in self._targets:
+            data = np.asarray(self.data, dtype=complex)
+            match modeflag:
+                case constants.fcnmode.FIT:
+                    self._targets[modeflag] = abs(data)
+                case constants.fcnmode.FIT_LOG:
+                    self._targets[modeflag] = np.log10(abs(data))
+                case constants.fcnmode.ANGLE:
+                    self._targets[modeflag] = np.angle(data)
+                case constants.fcnmode.FIT_REAL:
+                    self._targets[modeflag] = np.ascontiguousarray(np.real(data))
+                case constants.fcnmode.FIT_IMAG:
+                    self._targets[modeflag] = np.ascontiguousarray(np.imag(data))
+        return self._targets[modeflag]
+
+    def model_impedance(self, fit_type, main, acoustic, R_b, L_b, C_b):
+        """
+        Method to calculate the impedance of a model
+
+        :param fit_type: The type of DUT (coil or capacitor)
+        :param main: Array of the main resonance elements [C, L, R_s, R_Fe] for coils or [C, L, R_s, R_iso] for
+            capacitors
+        :param acoustic: Array of the acoustic resonance elements [R_A, L_A, C_A] for MLCCs; empty otherwise
+        :param R_b: Array of the resistances of the higher order circuits
+        :param L_b: Array of the inductances of the higher order circuits
+        :param C_b: Array of the capacitances of the higher order circuits
+        :return: The impedance of the model
+        """
+        if USE_NUMBA:
+            _model_impedance_jit(fit_type, self.w, self.w_inv, main, acoustic, R_b, L_b, C_b, self._Z)
+        else:
+            _model_numpy(fit_type, self.w, self.w_inv, main, acoustic, R_b, L_b, C_b, self._Z, self._tmp, self._tmp2,
+                         self.branch_buffers(len(R_b)))
+        return self._Z.copy()
+
+    def model_residual(self, fit_type, main, acoustic, R_b, L_b, C_b, modeflag):
+        """
+        Method to calculate the difference between data and the model; see model_impedance() for the parameters
+
+        :param modeflag: The kind of difference (see constants.fcnmode)
+        :return: The difference
+        """
+        if USE_NUMBA:
+            _model_residual_jit(fit_type, self.w, self.w_inv, self.target(modeflag), main, acoustic, R_b, L_b, C_b,
+                                modeflag, self._diff)
+        else:
+            _model_numpy(fit_type, self.w, self.w_inv, main, acoustic, R_b, L_b, C_b, self._Z, self._tmp, self._tmp2,
+                         self.branch_buffers(len(R_b)))
+            _residual_numpy(self.target(modeflag), self._Z, modeflag, self._real, self._diff)
+        return self._diff
+
+    def rlc_impedance(self, R, L, C, ser_par):
+        """
+        Method to calculate the impedance of a single RLC circuit
+
+        :param R: Resistance
+        :param L: Inductance
+        :param C: Capacitance
+        :param ser_par: Whether the RLC is a serial or parallel resonant circuit (1=serial;2=parallel)
+        :return: The impedance of the circuit
+        """
+        _rlc_numpy(self.w, self.w_inv, R, L, C, ser_par, self._Z, self._tmp)
+        return self._Z.copy()
+
+    def rlc_residual(self, R, L, C, ser_par, modeflag):
+        """
+        Method to calculate the difference between data and a single RLC circuit; see rlc_impedance() for the
+        parameters
+
+        :param modeflag: The kind of difference (see constants.fcnmode)
+        :return: The difference
+        """
+        if USE_NUMBA:
+            _rlc_residual_jit(self.w, self.w_inv, self.target(modeflag), R, L, C, ser_par, modeflag, self._diff)
+        else:
+            _rlc_numpy(self.w, self.w_inv, R, L, C, ser_par, self._Z, self._tmp)
+            _residual_numpy(self.target(modeflag), self._Z, modeflag, self._real, self._diff)
+        return self._diff
+
+    def band_residual(self, background, R, L, C, ser_par, modeflag):
+        """
+        Method to calculate the difference between data and a single RLC circuit combined with a fixed background (see
+        band_fitting.py); a parallel RLC is in series with the background, a serial RLC in parallel with it
+
+        :param background: The background impedance for a parallel RLC, the background admittance for a serial RLC
+        :param modeflag: The kind of difference (see constants.fcnmode)
+        :return: The difference; see rlc_impedance() for the other parameters
+        """
+        if USE_NUMBA:
+            _band_residual_jit(self.w, self.w_inv, self.target(modeflag), background, R, L, C, ser_par, modeflag,
+                               self._diff)
+        else:
+            _band_numpy(self.w, self.w_inv, background, R, L, C, ser_par, self._Z, self._tmp)
+            _residual_numpy(self.target(modeflag), self._Z, modeflag, self._real, self._diff)
+        return self._diff
+
+    def cmc_impedance(self, main, R_b, L_b, C_b, meas_type, R_s, C_p):
+        """
+        Method to calculate the impedance of a common mode choke model
+
+        :param main: Array of the main resonance elements [C, L, R_Fe]
+        :param R_b: Array of the resistances of the higher order circuits
+        :param L_b: Array of the inductances of the higher order circuits
+        :param C_b: Array of the capacitances of the higher order circuits
+        :param meas_type: The measurement configuration (see CMC_MEAS_TYPES)
+        :param R_s: The series resistance (CM only)
+        :param C_p: The parallel capacitance (OC only)
+        :return: The impedance of the model
+        """
+        _cmc_numpy(self.w, self.w_inv, main, R_b, L_b, C_b, meas_type, R_s, C_p, self._Z, self._tmp, self._tmp2,
+                       self.branch_buffers(len(R_b)))
+        return self._Z.copy()
+
+    def cmc_residual(self, main, R_b, L_b, C_b, meas_type, R_s, C_p, modeflag):
+        """
+        Method to calculate the difference between data and a common mode choke model; see cmc_impedance() for the
+        parameters
+
+        :param modeflag: The kind of difference (see constants.fcnmode)
+        :return: The difference
+        """
+        if USE_NUMBA:
+            _cmc_residual_jit(self.w, self.w_inv, self.target(modeflag), main, R_b, L_b, C_b, meas_type, R_s, C_p,
+                              modeflag, self._diff)
+        else:
+            _cmc_numpy(self.w, self.w_inv, main, R_b, L_b, C_b, meas_type, R_s, C_p, self._Z, self._tmp, self._tmp2,
+                       self.branch_buffers(len(R_b)))
+            _residual_numpy(self.target(modeflag), self._Z, modeflag, self._real, self._diff)
+        return self._diff
+
+
+def get_context(freq, data):
+    """
+    Function to get an ObjectiveContext for an objective function call. If data already is a context, it is returned
+    as is; otherwise a context is created for this call only
+
+    :param freq: The frequency vector
+    :param data: The measured impedance or an ObjectiveContext
+    :return: An ObjectiveContext
+    """
+    if isinstance(data, ObjectiveContext):
+        return data
+    return ObjectiveContext(freq, data)
+
+
+def warm_up():
+    """
+    Function to evaluate all kernels once on a single frequency point. With JIT-compiled kernels, this loads them from
+    the cache (or compiles them), so the first fit does not pay for it
+
+    :return: None
+    """
+    freq = np.array([1e6])
+    context = ObjectiveContext(freq, np.array([1 + 1j]))
+    main = np.ones(4)
+    branch = np.ones(1)
+    for fit_type in [constants.El.INDUCTOR, constants.El.CAPACITOR]:
+        for acoustic in [np.empty(0), np.ones(3)]:
+            context.model_impedance(fit_type, main, acoustic, branch, branch, branch)
+            context.model_residual(fit_type, main, acoustic, branch, branch, branch, constants.fcnmode.FIT)
+    for ser_par in [1, 2]:
+        context.rlc_residual(1.0, 1.0, 1.0, ser_par, constants.fcnmode.FIT)
+        context.band_residual(np.array([1 + 1j]), 1.0, 1.0, 1.0, ser_par, constants.fcnmode.FIT)
+    context.cmc_residual(main[:3], branch, branch, branch, CMC_MEAS_TYPES['OC'], 0.0, 1.0, constants.fcnmode.FIT)
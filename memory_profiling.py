@@ -0,0 +1,259 @@
+"""
+Memory accounting of the fitting pipeline (config.MEMORY_PROFILING).
+
+In memory profiling mode every process (the main process and each pool worker) traces its allocations with tracemalloc
+and reports a 'memory' event at the end of every stage (see events.py): the peak of the traced memory during the stage,
+the resident set size (RSS) at its end and the peak RSS of the process so far. If config.MEMORY_TOP_ALLOCATIONS is
+set, the event also lists the source lines that allocated the most memory during the stage.
+
+At the end of the run, the MemoryProfiler of the main process prints a report per stage and per process and suggests the
+max. number of pool workers that fit into the available memory for a batch of the same size, based on the measured
+peak RSS of the workers (see plan_worker_count()).
+
+Notes:
+
+- tracemalloc slows the fits down considerably, the timings of a run in memory profiling mode are not representative
+- the traced memory and its peak are per process; stages that run concurrently in threads of the same process see each
+  other's allocations
+- the peak RSS of a process is its high-water mark since it was started; the workers of the pool are reused between
+  runs, so their peak RSS may stem from an earlier run
+"""
+
+import os
+import threading
+import tracemalloc
+from collections import defaultdict
+
+import config
+import events
+from worker_pool import available_memory
+
+MB = 1024 ** 2
+
+
+def current_rss():
+    """
+    Function to get the resident set size of the current process
+
+    :return: The RSS in bytes, or None if it can not be determined
+    """
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        return None
+
+
+def peak_rss():
+    """
+    Function to get the peak resident set size of the current process since it was started
+
+    :return: The peak RSS in bytes, or None if it can not be determined
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports the peak in kilobytes, macOS in bytes
+    return peak if os.uname().sysname == 'Darwin' else peak * 1024
+
+
+def plan_worker_count(worker_memory, tasks, available):
+    """
+    Function to calculate the max. number of pool workers that fit into the available memory
+
+    :param worker_memory: The memory needed per worker in bytes (e.g. the peak RSS of a worker)
+    :param tasks: The number of tasks of the batch; more workers than tasks are of no use
+    :param available: The memory available for the workers in bytes
+    :return: The number of workers (at least 1)
+    """
+    count = int(available // worker_memory) if worker_memory else tasks
+    return max(1, min(count, tasks, config.MULTIPROCESSING_COUNT))
+
+
+class MemoryProfiler:
+    """
+    Event subscriber of the memory profiling mode. Measures the memory of the stages of its own process and, in the main
+    process, collects the 'memory' events of all processes for the report.
+    """
+
+    def __init__(self, top_allocations = 0, collect = True):
+        """
+        :param top_allocations: (optional) The number of source lines with the largest allocations that are reported
+            per stage; 0 disables the snapshots
+        :param collect: (optional) collect the 'memory' events for the report; the pool workers only measure their
+            stages, their events are collected by the main process
+        """
+        self.top_allocations = top_allocations
+        self.collect = collect
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.records = []
+        self.start_rss = current_rss()
+
+        self._stages = threading.local()
+
+        # tracing that was started elsewhere is left running by close()
+        self.started_tracing = not tracemalloc.is_tracing()
+        if self.started_tracing:
+            tracemalloc.start()
+
+    def close(self):
+        """
+        Method to stop tracing the allocations, if the profiler started it
+
+        :return: None
+        """
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    def __call__(self, event):
+        match event['event']:
+            case 'stage_start' if event['pid'] == self.pid:
+                self._start_stage()
+            case 'stage_end' if event['pid'] == self.pid:
+                self._end_stage(event)
+            case 'memory' if self.collect:
+                with self.lock:
+                    self.records.append(event)
+
+    def _start_stage(self):
+        """
+        Method to start the measurement of a stage. tracemalloc has a single peak per process, so the peak of the
+        enclosing stage is saved before it is reset
+
+        :return: None
+        """
+        stack = getattr(self._stages, 'stack', None)
+        if stack is None:
+            stack = self._stages.stack = []
+
+        traced, peak = tracemalloc.get_traced_memory()
+        if stack:
+            stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+        tracemalloc.reset_peak()
+
+        snapshot = tracemalloc.take_snapshot() if self.top_allocations else None
+        stack.append({'start': traced, 'peak': traced, 'snapshot': snapshot})
+
+    def _end_stage(self, event):
+        """
+        Method to end the measurement of a stage and emit its 'memory' event; the peak of the stage is passed on to the
+        enclosing stage
+
+        :param event: The 'stage_end' event of the stage
+        :return: None
+        """
+        stack = getattr(self._stages, 'stack', None)
+        if not stack:
+            return
+
+        measurement = stack.pop()
+        traced, peak = tracemalloc.get_traced_memory()
+        peak = max(measurement['peak'], peak)
+        if stack:
+            stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+        tracemalloc.reset_peak()
+
+        top = []
+        if measurement['snapshot'] is not None:
+            # the allocations of the measurement itself are left out
+            snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, path) for path in
+                                                                  [tracemalloc.__file__, events.__file__, __file__]])
+            for statistic in snapshot.compare_to(measurement['snapshot'], 'lineno')[:self.top_allocations]:
+                if statistic.size_diff > 0:
+                    frame = statistic.traceback[0]
+                    top.append(["%s:%d" % (frame.filename, frame.lineno), statistic.size_diff])
+
+        events.emit('memory', stage=event['stage'], file=event['file'], traced_peak=peak - measurement['start'],
+                    traced=traced, rss=current_rss(), peak_rss=peak_rss(), top=top)
+
+    def report(self):
+        """
+        Method to create the report of the run, including the suggested number of pool workers
+
+        :return: The report as a string
+        """
+        with self.lock:
+            records = list(self.records)
+
+        lines = ["Memory of the run (traced peak: max. allocations of a stage above the memory at its start)", "",
+                 "{:<24} {:>6} {:>16} {:>14}".format("stage", "calls", "traced peak (MB)", "max. RSS (MB)")]
+        per_stage = defaultdict(lambda: [0, 0, 0])
+        for record in records:
+            entry = per_stage[record['stage']]
+            entry[0] += 1
+            entry[1] = max(entry[1], record['traced_peak'])
+            entry[2] = max(entry[2], record['rss'] or 0)
+        for stage, (calls, traced_peak, rss) in sorted(per_stage.items(), key=lambda it: -it[1][1]):
+            lines.append("{:<24} {:>6} {:>16.1f} {:>14.1f}".format(stage, calls, traced_peak / MB, rss / MB))
+
+        lines += ["", "{:<10} {:<8} {:>8} {:>16} {:>15}".format("process", "role", "stages", "traced peak (MB)",
+                                                               "peak RSS (MB)")]
+        per_process = {}
+        for record in records:
+            entry = per_process.setdefault(record['pid'], {'stages': 0, 'traced_peak': 0, 'peak_rss': 0, 'rss': 0})
+            entry['stages'] += 1
+            entry['traced_peak'] = max(entry['traced_peak'], record['traced_peak'])
+            entry['peak_rss'] = max(entry['peak_rss'], record['peak_rss'] or 0)
+            entry['rss'] = record['rss'] or 0
+        for pid, entry in sorted(per_process.items()):
+            lines.append("{:<10} {:<8} {:>8} {:>16.1f} {:>15.1f}".format(
+                pid, 'main' if pid == self.pid else 'worker', entry['stages'], entry['traced_peak'] / MB,
+                entry['peak_rss'] / MB))
+
+        top = {}
+        for record in records:
+            if record['top'] and record['traced_peak'] > top.get(record['stage'], {'traced_peak': -1})['traced_peak']:
+                top[record['stage']] = record
+        if top:
+            lines += ["", "Largest allocations of the stages (at the stage's largest traced peak)"]
+            for stage, record in top.items():
+                lines.append("  %s (%s):" % (stage, record['file'] or '-'))
+                lines += ["    {:>10.2f} MB  {}".format(size / MB, location) for location, size in record['top']]
+
+        lines += [""] + self.plan(records, per_process)
+        return "\n".join(lines) + "\n"
+
+    def plan(self, records, per_process):
+        """
+        Method to suggest the number of pool workers for a batch of the size of this run. The memory per worker is the
+        largest peak RSS of a worker; if the run did not use the pool, it is estimated as the RSS of the main process at
+        the start of the run plus the largest traced peak of a stage that works on a file
+
+        :param records: The 'memory' events of the run
+        :param per_process: The statistics per process (see report())
+        :return: The lines of the report
+        """
+        tasks = len(set([record['file'] for record in records if record['file'] is not None]))
+        workers = {pid: entry for pid, entry in per_process.items() if pid != self.pid}
+
+        if workers:
+            worker_memory = max([entry['peak_rss'] for entry in workers.values()])
+            source = "largest peak RSS of %d worker(s)" % len(workers)
+        else:
+            file_peaks = [record['traced_peak'] for record in records if record['file'] is not None]
+            worker_memory = (self.start_rss or 0) + max(file_peaks, default=0)
+            source = "estimated from the main process, the pool was not used"
+
+        available = available_memory()
+        if not worker_memory or available is None or not tasks:
+            return ["Worker planning: not enough data"]
+
+        # the memory of the running workers is released when the pool is resized
+        available += sum([entry['rss'] for entry in workers.values()])
+        count = plan_worker_count(worker_memory, tasks, available)
+        return ["Worker planning for %d file(s): %.1f MB per worker (%s), %.1f MB available" % (
+                    tasks, worker_memory / MB, source, available / MB),
+                "  max. safe number of workers: %d (config.MULTIPROCESSING_COUNT = %d)" % (
+                    count, config.MULTIPROCESSING_COUNT),
+                "  suggested config.WORKER_MEMORY_ESTIMATE: %.0f" % worker_memory]
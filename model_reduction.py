@@ -0,0 +1,114 @@
+"""
+Order reduction of the fitted models.
+
+Each higher order circuit is ranked by its contribution to the model: the impedance of a circuit relative to the
+impedance of the whole model for inductors, where the circuits are in series. For capacitors, where the circuits are in
+parallel, the admittance is used instead. The contribution is the maximum over the frequency band. Removing a circuit
+changes |Z| by at most this fraction.
+
+For a DC bias sweep, the circuits of all files are assigned to common key numbers as in parameter_matching.py. A key
+number is removed from all files only if it is negligible in every file, so the matched models keep the same circuits.
+Key numbers whose resonance frequencies are closer than a given distance in every file that has both are merged into one
+circuit. The remaining circuits are refit briefly afterwards (see GUI.reduce_models()).
+"""
+
+import numpy as np
+
+import constants
+from parameter_matching import assignment_matrices
+
+
+def relative_contributions(fit_type, Z_model, Z_branches):
+    """
+    Function to calculate the contribution of the higher order circuits to the impedance of a model
+
+    :param fit_type: The type of DUT (coil or capacitor)
+    :param Z_model: The impedance of the model, an array of shape (points,)
+    :param Z_branches: The impedances of the circuits, an array of shape (order, points)
+    :return: The max. contribution of every circuit over the band, an array of shape (order,); |Z_branch / Z| for
+        inductors, |Y_branch / Y| for capacitors
+    """
+    match fit_type:
+        case constants.El.INDUCTOR:
+            ratio = np.abs(Z_branches / Z_model[np.newaxis, :])
+        case constants.El.CAPACITOR:
+            ratio = np.abs(Z_model[np.newaxis, :] / Z_branches)
+    return ratio.max(axis=1, initial=0.0)
+
+
+def merged_circuit(fit_type, R, L, C):
+    """
+    Function to combine circuits that resonate at (almost) the same frequency into one; the parallel RLCs of an inductor
+    are in series, so their R and L add up, the serial RLCs of a capacitor are in parallel, so their C add up. The result
+    is exact for circuits with the same resonance frequency and quality factor
+
+    :param fit_type: The type of DUT (coil or capacitor)
+    :param R: The resistances of the circuits, an array
+    :param L: The inductances of the circuits, an array (any unit)
+    :param C: The capacitances of the circuits, an array (any unit)
+    :return: A tuple (R, L, C) of the merged circuit, in the units of the input
+    """
+    match fit_type:
+        case constants.El.INDUCTOR:
+            return np.sum(R), np.sum(L), 1 / np.sum(1 / C)
+        case constants.El.CAPACITOR:
+            return 1 / np.sum(1 / R), 1 / np.sum(1 / L), np.sum(C)
+
+
+def reduction_plan(w_array, contributions, threshold, merge_distance = None):
+    """
+    Function to decide which circuits of the files are removed and which are merged
+
+    :param w_array: The resonance frequencies of the circuits, an array of shape (files, order); NaN = not present
+    :param contributions: The contributions of the circuits (see relative_contributions()), an array of the shape of
+        w_array
+    :param threshold: Key numbers whose contribution is below this fraction in all files are removed
+    :param merge_distance: (optional) Key numbers whose resonance frequencies differ by less than this fraction in all
+        files that have both are merged; None = no merging
+    :return: A list with a tuple (merges, removed) per file; merges is a list of tuples (key number, key numbers merged
+        into it), removed is a list of the key numbers that are removed, including the merged ones
+    """
+    files, order = np.shape(w_array)
+    if not order:
+        return [([], []) for num_set in range(files)]
+
+    permutations = assignment_matrices(w_array)
+    present = permutations.any(axis=1)
+    # contribution and log. resonance frequency of every key number in every file
+    key_contributions = np.einsum('fi,fij->fj', np.nan_to_num(contributions), permutations)
+    key_log_w = np.einsum('fi,fij->fj', np.log(np.where(np.isnan(w_array), 1.0, w_array)), permutations)
+    negligible = np.where(present, key_contributions, -np.inf).max(axis=0) < threshold
+
+    # the strongest circuits absorb their neighbours
+    merge_groups = []
+    absorbed = negligible.copy()
+    if merge_distance is not None:
+        both = present[:, :, np.newaxis] & present[:, np.newaxis, :]
+        close = np.abs(key_log_w[:, :, np.newaxis] - key_log_w[:, np.newaxis, :]) < np.log1p(merge_distance)
+        mergeable = (close | ~both).all(axis=0) & both.any(axis=0)
+        for key in np.argsort(-np.where(present, key_contributions, -np.inf).max(axis=0), kind='stable'):
+            if absorbed[key]:
+                continue
+            group = np.flatnonzero(mergeable[key] & ~absorbed)
+            group = group[group != key]
+            if len(group):
+                absorbed[group] = True
+                merge_groups.append((key, group))
+
+    plan = []
+    for num_set in range(files):
+        # key number of the circuits of this file for every matched key
+        circuit_of_key = permutations[num_set].argmax(axis=0) + 1
+        merges = []
+        for key, group in merge_groups:
+            group = group[present[num_set, group]]
+            if present[num_set, key] and len(group):
+                merges.append((int(circuit_of_key[key]), [int(it) for it in circuit_of_key[group]]))
+            elif len(group):
+                # the strongest circuit is missing in this file; its first neighbour takes its place
+                merges.append((int(circuit_of_key[group[0]]), [int(it) for it in circuit_of_key[group[1:]]]))
+        kept = [key_number for key_number, others in merges]
+        removed = sorted([int(circuit_of_key[key]) for key in np.flatnonzero(absorbed & present[num_set])
+                          if circuit_of_key[key] not in kept])
+        plan.append(([(key_number, others) for key_number, others in merges if others], removed))
+    return plan
@@ -0,0 +1,263 @@
+"""
+Central entry point for the optimizer calls of the fitters.
+
+Wraps lmfit.minimize() with a parameter transformation layer: the circuit elements span many decades (e.g. R_Fe up to
+1e9 Ohm, higher order capacitances of a few fF), so parameters that are positive and bounded are fit on a log10 scale if
+config.LOG_PARAMETER_TRANSFORM is set. The optimizer only sees the free parameters (log-scaled where possible); they are
+written back to a working copy of the parameter set before every evaluation, so the objective function still receives
+the parameters by their original keys and in the units of config.CAPUNIT/INDUNIT/FUNIT. The returned result holds the
+parameters in their original form.
+
+All fits follow the convergence policy of config.py: the relative change of the residual and the line search tolerance
+are passed to the solver, the number of evaluations and the wall time of a fitting stage can be limited. If a fit is
+stopped by a limit or the run is cancelled (see cancellation.py), the best parameters found so far are returned. Every
+fit emits a 'fit' event (see events.py); in profiling mode (see profiling.py) it carries further statistics.
+"""
+
+import copy
+import logging
+import time
+
+import lmfit
+import numpy as np
+
+import cancellation
+import config
+import events
+import profiling
+
+# prefix for the keys of the log-scaled parameters
+LOG_KEY_PREFIX = 'log10_'
+
+
+def is_log_transformable(param: lmfit.Parameter) -> bool:
+    """
+    Function to check if a parameter can be fit on a log scale; that is if it is free, not bound by an expression and
+    has a positive value and positive, finite bounds
+
+    :param param: An lmfit Parameter
+    :return: Boolean
+    """
+    return (param.vary and not param.expr and param.value > 0 and param.min > 0 and np.isfinite(param.max)
+            and param.max > param.min)
+
+
+def to_log_parameters(param_set: lmfit.Parameters):
+    """
+    Function to create the set of parameters the optimizer works on. It only contains the free parameters that are not
+    bound by an expression; every transformable parameter is replaced by its log10 counterpart
+
+    :param param_set: A Parameters() object
+    :return: Tuple (Parameters() object for the optimizer, list of the keys of param_set the optimizer parameters
+        belong to)
+    """
+    fit_set = lmfit.Parameters()
+    fit_keys = []
+    for key, param in param_set.items():
+        if is_log_transformable(param):
+            fit_set.add(LOG_KEY_PREFIX + key, value=np.log10(param.value), min=np.log10(param.min),
+                        max=np.log10(param.max), vary=True)
+        elif param.vary and not param.expr:
+            fit_set.add(key, value=param.value, min=param.min, max=param.max, vary=True)
+        else:
+            continue
+        fit_keys.append(key)
+
+    return fit_set, fit_keys
+
+
+def from_log_parameters(fit_set: lmfit.Parameters, fit_keys, param_set: lmfit.Parameters):
+    """
+    Function to write the values of the optimizer parameters to a parameter set. Expressions of the parameter set are
+    evaluated when their value is requested, so they follow the written values
+
+    :param fit_set: The Parameters() object of the optimizer
+    :param fit_keys: The keys of param_set the optimizer parameters belong to
+    :param param_set: The Parameters() object the values are written to
+    :return: param_set
+    """
+    for fit_param, key in zip(fit_set.values(), fit_keys):
+        if fit_param.name == LOG_KEY_PREFIX + key:
+            param_set[key].value = 10 ** fit_param.value
+        else:
+            param_set[key].value = fit_param.value
+    return param_set
+
+
+def _log_objective(fit_set, fcn, param_set, fit_keys, *args):
+    """
+    Objective function for the log-scaled optimizer parameters; writes the parameters to the model's parameter set and
+    calls the original objective function with it
+
+    :param fit_set: The Parameters() object of the optimizer
+    :param fcn: The original objective function
+    :param param_set: The parameter set of the model (a working copy)
+    :param fit_keys: The keys of param_set the optimizer parameters belong to
+    :param args: Additional arguments for the objective function
+    :return: The return value of the objective function
+    """
+    return fcn(from_log_parameters(fit_set, fit_keys, param_set), *args)
+
+
+class ConvergenceMonitor:
+    """
+    Iteration callback for lmfit. Keeps track of the best parameters of a fit and aborts the fit if the maximum number
+    of evaluations or the deadline is exceeded, or if the run is cancelled.
+    """
+
+    def __init__(self, max_nfev = None, deadline = None):
+        """
+        :param max_nfev: (optional) The maximum number of evaluations
+        :param deadline: (optional) The deadline of the fit (a time.perf_counter() value)
+        """
+        self.max_nfev = max_nfev
+        self.deadline = deadline
+        self.best_cost = np.inf
+        self.best_values = None
+        self.abort_reason = None
+
+    def __call__(self, params, iteration, resid, *args, **kws):
+        cost = np.sum(abs(resid) ** 2)
+        if cost < self.best_cost:
+            self.best_cost = cost
+            self.best_values = params.valuesdict()
+
+        # lmfit evaluates the objective once more after an abort; this evaluation must not abort again
+        if self.abort_reason is not None:
+            return False
+
+        if cancellation.CANCEL_EVENT.is_set():
+            self.abort_reason = "cancelled"
+        elif self.max_nfev is not None and iteration >= self.max_nfev:
+            self.abort_reason = "max. evaluations reached"
+        elif self.deadline is not None and time.perf_counter() > self.deadline:
+            self.abort_reason = "time budget exceeded"
+
+        return self.abort_reason is not None
+
+    def restore_best(self, param_set: lmfit.Parameters):
+        """
+        Method to write the best parameters found to a parameter set
+
+        :param param_set: The Parameters() object the fit was done on
+        :return: None
+        """
+        if self.best_values is None:
+            return
+        for key, param in param_set.items():
+            if not param.expr:
+                param.value = self.best_values[key]
+
+
+# deadline of the pool task this process is running (see worker_pool.run_task()); all fits of the task stop at it
+_task_deadline = None
+
+
+def set_task_deadline(deadline):
+    """
+    Function to set the deadline of the pool task that is run by this process
+
+    :param deadline: A time.perf_counter() value, or None to remove the deadline
+    :return: None
+    """
+    global _task_deadline
+    _task_deadline = deadline
+
+
+def stage_deadline():
+    """
+    Function to get the deadline for a fitting stage that starts now, according to config.FIT_STAGE_TIME_BUDGET; within
+    a pool task, the stage ends at the deadline of the task at the latest
+
+    :return: A time.perf_counter() value, or None if there is no time budget
+    """
+    deadlines = [deadline for deadline in [_task_deadline] if deadline is not None]
+    if config.FIT_STAGE_TIME_BUDGET is not None:
+        deadlines.append(time.perf_counter() + config.FIT_STAGE_TIME_BUDGET)
+    return min(deadlines, default=None)
+
+
+def convergence_options(method):
+    """
+    Function to get the solver options of the convergence policy for a given method
+
+    :param method: The lmfit method
+    :return: A dict of options for the scipy solver
+    """
+    match method:
+        case 'powell':
+            return {'xtol': config.FIT_XTOL, 'ftol': config.FIT_FTOL}
+        case 'nelder':
+            return {'xatol': config.FIT_XTOL, 'fatol': config.FIT_FTOL}
+        case _:
+            return {}
+
+
+def minimize(fcn, params: lmfit.Parameters, args = (), method = 'powell', options = None, stage = None,
+             deadline = None, max_nfev = None, logger_instance = logging.getLogger(), **fit_kws) -> lmfit.minimizer.MinimizerResult:
+    """
+    Function to minimize an objective function; drop-in replacement for lmfit.minimize().
+
+    :param fcn: The objective function; called as fcn(params, *args)
+    :param params: A Parameters() object holding the initial values
+    :param args: Additional arguments for the objective function
+    :param method: The lmfit method
+    :param options: (optional) Options that are passed to the scipy solver; if not supplied, the options of the
+        convergence policy are used
+    :param stage: (optional) The name of the fitting stage, used for the report
+    :param deadline: (optional) The deadline of the stage (see stage_deadline()); if not supplied, the time budget
+        starts with this fit
+    :param max_nfev: (optional) The max. number of evaluations of this fit; if not supplied, config.FIT_MAX_NFEV applies
+    :param logger_instance: A logger instance the evaluations of the fit are reported to
+    :param fit_kws: Further keyword arguments for lmfit.minimize()
+    :return: The lmfit MinimizerResult; its params are in the original (not log-scaled) form
+    """
+    if options is None:
+        options = convergence_options(method)
+    if deadline is None:
+        deadline = stage_deadline()
+
+    if max_nfev is None:
+        max_nfev = config.FIT_MAX_NFEV
+
+    monitor = ConvergenceMonitor(max_nfev, deadline)
+
+    # profiling mode: evaluate the initial residual and time the model evaluations
+    profile = {}
+    if config.PROFILING:
+        profile['residual_initial'] = profiling.residual_norm(fcn(params, *args))
+        fcn = profiling.TimedObjective(fcn)
+
+    start_time = time.perf_counter()
+    start_cpu_time = time.thread_time()
+
+    if config.LOG_PARAMETER_TRANSFORM:
+        fit_params, fit_keys = to_log_parameters(params)
+        # the objective works on a copy, so the supplied parameters are not altered
+        out = lmfit.minimize(_log_objective, fit_params, args=(fcn, copy.deepcopy(params), fit_keys) + tuple(args),
+                             method=method, options=options, iter_cb=monitor, **fit_kws)
+        if out.aborted:
+            monitor.restore_best(out.params)
+        out.params = from_log_parameters(out.params, fit_keys, copy.deepcopy(params))
+        n_log = len([key for key in fit_keys if LOG_KEY_PREFIX + key in fit_params])
+    else:
+        out = lmfit.minimize(fcn, params, args=args, method=method, options=options, iter_cb=monitor, **fit_kws)
+        if out.aborted:
+            monitor.restore_best(out.params)
+        n_log = 0
+
+    elapsed = time.perf_counter() - start_time
+    cpu_time = time.thread_time() - start_cpu_time
+    logger_instance.info("Fit{stage}: {nvarys} parameters ({nlog} log-scaled), {nfev} evaluations, {time:.2f} s, "
+                         "residual {residual:.4E}{aborted}"
+                         .format(stage=" (" + stage + ")" if stage else "", nvarys=out.nvarys, nlog=n_log,
+                                 nfev=out.nfev, time=elapsed, residual=np.sqrt(monitor.best_cost),
+                                 aborted="; stopped: " + monitor.abort_reason if out.aborted else ""))
+    if config.PROFILING:
+        profile['evals'] = fcn.calls
+        profile['eval_time'] = fcn.time
+    events.emit('fit', stage=stage, nfev=out.nfev, nvarys=out.nvarys, elapsed=elapsed, cpu_time=cpu_time,
+                residual=float(np.sqrt(monitor.best_cost)), aborted=monitor.abort_reason if out.aborted else None,
+                **profile)
+
+    return out
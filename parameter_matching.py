@@ -0,0 +1,91 @@
+"""
+Matching of the higher order circuits of the files of a DC bias sweep.
+
+The circuits of every file are numbered by the order they were detected in, so the same resonance may have different
+key numbers in different files, and files may lack some of the resonances. The circuits of all files are held in one
+dense array and every file is assigned to the circuits of a reference file at once: the distances of the resonance
+frequencies (on a log scale) form a (files x order x order) tensor and each file's assignment is solved optimally with
+the Hungarian method. The result is a permutation matrix per file that is applied to the dense array; circuits that a
+file lacks are filled from the previous file.
+"""
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+# the elements of a higher order circuit, in the order of the last axis of the circuit arrays
+CIRCUIT_ELEMENTS = ('w', 'BW', 'R', 'L', 'C')
+
+
+def circuit_array(parameter_list, orders):
+    """
+    Function to collect the higher order circuits of all files in a dense array
+
+    :param parameter_list: A list containing the Parameters() objects of all files
+    :param orders: The orders of the files
+    :return: An array of shape (files, max. order, len(CIRCUIT_ELEMENTS)); the circuits a file does not have are NaN
+    """
+    circuits = np.full((len(parameter_list), max(orders, default=0), len(CIRCUIT_ELEMENTS)), np.nan)
+    for num_set, parameter_set in enumerate(parameter_list):
+        for key_number in range(1, orders[num_set] + 1):
+            circuits[num_set, key_number - 1] = [parameter_set["%s%s" % (element, key_number)].value
+                                                 for element in CIRCUIT_ELEMENTS]
+    return circuits
+
+
+def assignment_matrices(w_array):
+    """
+    Function to assign the circuits of every file to the circuits of the reference file, i.e. the first file that has
+    all circuits. The cost of an assignment is the sum of the distances of the resonance frequencies on a log scale; it
+    is minimized for each file with the Hungarian method, so the assignment is globally optimal and does not depend on
+    the order of the circuits
+
+    :param w_array: The resonance frequencies of the circuits, an array of shape (files, order); NaN = not present
+    :return: The permutation matrices, an array of shape (files, order, order); element [f, i, j] is 1 if circuit i of
+        file f is assigned to key number j + 1
+    :raises Exception: if no file has all circuits
+    """
+    present = ~np.isnan(w_array)
+    complete = np.flatnonzero(present.all(axis=1))
+    if not len(complete):
+        raise Exception("Could not determine a reference array for output; this should not happen")
+    reference = np.log(w_array[complete[0]])
+
+    # (files x order x order) distance tensor; missing circuits cost the same for every key, so they do not change the
+    # assignment of the present ones and are dropped afterwards
+    distances = np.abs(np.log(np.where(present, w_array, 1.0))[:, :, np.newaxis] - reference[np.newaxis, np.newaxis, :])
+    distances[~present] = 0.0
+
+    permutations = np.zeros(distances.shape)
+    for num_set, cost in enumerate(distances):
+        rows, cols = linear_sum_assignment(cost)
+        permutations[num_set, rows, cols] = 1.0
+    permutations[~present] = 0.0
+    return permutations
+
+
+def match_circuits(circuits, r_fill):
+    """
+    Function to renumber the circuits of all files so that each key number holds the same resonance in all files. A
+    circuit that a file lacks is taken from the previous file (from the first file that has it, for the first file),
+    with its resistor set to r_fill
+
+    :param circuits: The circuits of all files (see circuit_array())
+    :param r_fill: The resistance of filled circuits
+    :return: An array of the shape of circuits, with the circuits matched and all missing circuits filled
+    """
+    if not circuits.shape[1]:
+        return circuits.copy()
+
+    permutations = assignment_matrices(circuits[:, :, CIRCUIT_ELEMENTS.index('w')])
+    matched = np.einsum('fij,fie->fje', permutations, np.nan_to_num(circuits))
+    present = permutations.any(axis=1)
+
+    # index of the file each key number is taken from: the last file up to this one that has it, or the first file
+    # that has it at all
+    files = np.arange(len(circuits))[:, np.newaxis]
+    source = np.maximum.accumulate(np.where(present, files, -1), axis=0)
+    source = np.where(source < 0, present.argmax(axis=0)[np.newaxis, :], source)
+
+    matched = matched[source, np.arange(circuits.shape[1])[np.newaxis, :]]
+    matched[..., CIRCUIT_ELEMENTS.index('R')] = np.where(present, matched[..., CIRCUIT_ELEMENTS.index('R')], r_fill)
+    return matched
@@ -0,0 +1,124 @@
+"""
+Dense store of the fitted models of all files.
+
+The fits work on one lmfit Parameters() object per file; once the fits are done, the models of all files are held in a
+(files x parameters) float array with a column per parameter, in config units like the fits. The post-processing
+(matching, saturation tables, export, netlists) reads whole columns or rows of the array; Parameters() objects are only
+created again where a model is passed to the impedance calculation of a fitter (see ParameterMatrix.to_parameters()).
+"""
+
+import numpy as np
+from lmfit import Parameters
+
+import config
+import constants
+from parameter_matching import CIRCUIT_ELEMENTS
+
+
+def main_parameter_names(fit_type, captype = None):
+    """
+    Function to get the names of the parameters of the main element
+
+    :param fit_type: The type of DUT (coil or capacitor)
+    :param captype: (optional) The type of capacitor; MLCCs have the parameters of the acoustic resonance as well
+    :return: A list of the parameter names
+    """
+    match fit_type:
+        case constants.El.INDUCTOR:
+            return ['R_s', 'R_Fe', 'L', 'C']
+        case constants.El.CAPACITOR:
+            names = ['R_s', 'R_iso', 'L', 'C']
+            if captype == constants.captype.MLCC:
+                names += ['R_A', 'L_A', 'C_A']
+            return names
+
+
+def circuit_parameter_names(order):
+    """
+    Function to get the names of the parameters of the higher order circuits, circuit by circuit
+
+    :param order: The number of circuits
+    :return: A list of the parameter names
+    """
+    return ["%s%s" % (element, key_number) for key_number in range(1, order + 1) for element in CIRCUIT_ELEMENTS]
+
+
+def unit_scale(name):
+    """
+    Function to get the factor that converts a parameter from config units to SI units
+
+    :param name: The name of the parameter
+    :return: config.INDUNIT for inductances, config.CAPUNIT for capacitances, config.FUNIT for (angular) frequencies and
+        bandwidths, 1 otherwise
+    """
+    if name.startswith('BW') or name.startswith('w'):
+        return config.FUNIT
+    if name.startswith('L'):
+        return config.INDUNIT
+    if name.startswith('C'):
+        return config.CAPUNIT
+    return 1.0
+
+
+class ParameterMatrix:
+    """
+    The parameters of the models of all files as a (files x parameters) array; the first row is the reference file
+    """
+
+    def __init__(self, names, values):
+        """
+        :param names: The names of the parameters, one per column
+        :param values: The values in config units, an array of shape (files, parameters)
+        """
+        self.names = list(names)
+        self.columns = {name: it for it, name in enumerate(self.names)}
+        self.values = np.asarray(values, dtype=float).reshape(-1, len(self.names))
+
+    @classmethod
+    def from_parameters(cls, parameter_list, names):
+        """
+        Method to create the matrix from Parameters() objects
+
+        :param parameter_list: A list containing a Parameters() object per file
+        :param names: The names of the parameters to store; every Parameters() object has to contain them
+        :return: A ParameterMatrix
+        """
+        return cls(names, [[parameter_set[name].value for name in names] for parameter_set in parameter_list])
+
+    def __len__(self):
+        return len(self.values)
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def column(self, name):
+        """
+        :param name: The name of a parameter
+        :return: The values of the parameter for all files (a view of the matrix)
+        """
+        return self.values[:, self.columns[name]]
+
+    def row(self, file_number):
+        """
+        :param file_number: The index of the file
+        :return: A dict containing the values of all parameters of the file, like Parameters.valuesdict()
+        """
+        return dict(zip(self.names, self.values[file_number].tolist()))
+
+    def si_values(self):
+        """
+        :return: The values of the matrix in SI units (see unit_scale())
+        """
+        return self.values * np.array([unit_scale(name) for name in self.names])
+
+    def to_parameters(self, file_number):
+        """
+        Method to convert the model of a file to a Parameters() object, e.g. for the impedance calculation of a fitter
+
+        :param file_number: The index of the file
+        :return: A Parameters() object containing fixed parameters
+        """
+        parameter_set = Parameters()
+        for name, value in zip(self.names, self.values[file_number].tolist()):
+            parameter_set.add(name, value=value, vary=False)
+        return parameter_set
@@ -0,0 +1,184 @@
+"""
+Profiling mode of the fitting pipeline (config.PROFILING).
+
+In profiling mode every optimizer call reports, in addition to its evaluations and wall time, its CPU time, the residual
+before and after the fit, and the number and time of the model evaluations (see optimizer.minimize()). The StageProfiler
+collects these 'fit' events and the 'stage_end' events of all processes (see events.py) and prints a report per stage
+and per file at the end of the run.
+
+If config.PROFILE_DUMP_DIR is set, every stage is run under cProfile and its statistics are written to a file in that
+directory (e.g. 0003_pre-fit_coil1_1234.prof, numbered per process); the statistics of a stage do not include its nested
+stages. The files can be read with pstats or snakeviz.
+"""
+
+import cProfile
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+
+
+class TimedObjective:
+    """
+    Wrapper for an objective function that counts its calls and measures the time spent in them
+    """
+
+    def __init__(self, fcn):
+        """
+        :param fcn: The objective function
+        """
+        self.fcn = fcn
+        self.calls = 0
+        self.time = 0.0
+
+    def __call__(self, *args, **kwargs):
+        start_time = time.perf_counter()
+        try:
+            return self.fcn(*args, **kwargs)
+        finally:
+            self.time += time.perf_counter() - start_time
+            self.calls += 1
+
+
+def residual_norm(resid):
+    """
+    Function to calculate the norm of a residual vector, as it is reported for the fits
+
+    :param resid: The residual vector
+    :return: The norm of the residual
+    """
+    return float(np.sqrt(np.sum(abs(np.asarray(resid)) ** 2)))
+
+
+class StageProfiler:
+    """
+    Event subscriber of the profiling mode. Aggregates the statistics of the stages and fits and, if a dump directory is
+    given, runs every stage of its own process under cProfile.
+    """
+
+    def __init__(self, dump_dir = None, collect = True):
+        """
+        :param dump_dir: (optional) The directory the cProfile statistics of the stages are written to
+        :param collect: (optional) collect the events for the report; the pool workers only write the cProfile
+            statistics, their events are collected by the main process
+        """
+        self.dump_dir = dump_dir
+        self.collect = collect
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.stages = []
+        self.fits = []
+
+        self._profiles = threading.local()
+        self._dump_count = 0
+
+        if dump_dir is not None:
+            os.makedirs(dump_dir, exist_ok=True)
+
+    def __call__(self, event):
+        match event['event']:
+            case 'stage_start':
+                if self.dump_dir is not None and event['pid'] == self.pid:
+                    self._start_profile()
+            case 'stage_end':
+                if self.dump_dir is not None and event['pid'] == self.pid:
+                    self._stop_profile(event)
+                if self.collect:
+                    with self.lock:
+                        self.stages.append(event)
+            case 'fit' if self.collect:
+                with self.lock:
+                    self.fits.append(event)
+
+    def _start_profile(self):
+        """
+        Method to start the profile of a stage; the profile of the enclosing stage is paused
+
+        :return: None
+        """
+        stack = getattr(self._profiles, 'stack', None)
+        if stack is None:
+            stack = self._profiles.stack = []
+        if stack:
+            stack[-1].disable()
+
+        profile = cProfile.Profile()
+        stack.append(profile)
+        profile.enable()
+
+    def _stop_profile(self, event):
+        """
+        Method to stop the profile of a stage, write it to the dump directory and resume the profile of the enclosing
+        stage
+
+        :param event: The 'stage_end' event of the stage
+        :return: None
+        """
+        stack = getattr(self._profiles, 'stack', None)
+        if not stack:
+            return
+
+        profile = stack.pop()
+        profile.disable()
+
+        with self.lock:
+            self._dump_count += 1
+            number = self._dump_count
+        name = "%04d_%s_%s_%d.prof" % (number, event['stage'], event['file'] or 'run', self.pid)
+        profile.dump_stats(os.path.join(self.dump_dir, re.sub(r'[^\w.\-]', '_', name)))
+
+        if stack:
+            stack[-1].enable()
+
+    def report(self):
+        """
+        Method to create the report of the run
+
+        :return: The report as a string
+        """
+        with self.lock:
+            stages = list(self.stages)
+            fits = list(self.fits)
+
+        lines = ["Profile of the run (wall and CPU times of a stage include its nested stages)", "",
+                 "{:<24} {:>6} {:>10} {:>10} {:>10}".format("stage", "calls", "wall (s)", "CPU (s)", "nfev")]
+        per_stage = defaultdict(lambda: [0, 0.0, 0.0, 0])
+        for event in stages:
+            entry = per_stage[event['stage']]
+            entry[0] += 1
+            entry[1] += event['elapsed']
+            entry[2] += event['cpu_time']
+            entry[3] += event['nfev']
+        for stage, (calls, wall, cpu, nfev) in sorted(per_stage.items(), key=lambda it: -it[1][1]):
+            lines.append("{:<24} {:>6} {:>10.2f} {:>10.2f} {:>10}".format(stage, calls, wall, cpu, nfev))
+
+        lines += ["", "{:<24} {:<20} {:>6} {:>10} {:>10} {:>10} {:>10} {:>7} {:>12}".format(
+            "stage", "fit", "fits", "nfev", "wall (s)", "CPU (s)", "model (s)", "params", "resid. ratio")]
+        per_fit = defaultdict(list)
+        for event in fits:
+            per_fit[(str(event.get('pipeline_stage')), str(event['stage']))].append(event)
+        for (stage, fit), group in sorted(per_fit.items(), key=lambda it: -sum([e['elapsed'] for e in it[1]])):
+            ratios = [event['residual'] / event['residual_initial'] for event in group
+                      if event.get('residual_initial')]
+            lines.append("{:<24} {:<20} {:>6} {:>10} {:>10.2f} {:>10.2f} {:>10.2f} {:>7.1f} {:>12}".format(
+                stage, fit, len(group), sum([event['nfev'] for event in group]),
+                sum([event['elapsed'] for event in group]), sum([event['cpu_time'] for event in group]),
+                sum([event.get('eval_time', 0.0) for event in group]),
+                np.mean([event['nvarys'] for event in group]),
+                "%.3E" % np.median(ratios) if ratios else "-"))
+
+        lines += ["", "{:<24} {:<24} {:>10} {:>10}".format("file", "stage", "wall (s)", "nfev")]
+        per_file = defaultdict(lambda: [0.0, 0])
+        for event in stages:
+            if event['file'] is None:
+                continue
+            entry = per_file[(event['file'], event['stage'])]
+            entry[0] += event['elapsed']
+            entry[1] += event['nfev']
+        for (file, stage), (wall, nfev) in sorted(per_file.items()):
+            lines.append("{:<24} {:<24} {:>10.2f} {:>10}".format(file, stage, wall, nfev))
+
+        return "\n".join(lines) + "\n"
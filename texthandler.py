@@ -1,25 +1,48 @@
-
-
+import collections
 import logging
-import tkinter
 import threading
+import tkinter
+
+import GUI_config
 """
 """
 
 
 class Text_Handler(logging.Handler):
     """
-        Texthandler for GUI output of log messages; copypasted
+        Texthandler for GUI output of log messages
 
         This class allows you to log to a Tkinter Text or ScrolledText widget
         #see https://gist.github.com/moshekaplan/c425f861de7bbf28ef06 for reference
+
+        Records are not written to the widget directly: emit() only appends the message to a ring buffer, which can be
+        done from any thread. The buffer is flushed to the widget in batches by the Tk main loop, so a burst of log
+        messages results in a single insert instead of one event per record. If more messages arrive between two
+        flushes than the buffer holds, the oldest ones are dropped; the widget is trimmed to a maximum number of lines.
     """
 
-    def __init__(self, text):
+    def __init__(self, text, max_lines = GUI_config.LOG_MAX_LINES, buffer_size = GUI_config.LOG_BUFFER_SIZE,
+                 flush_interval = GUI_config.LOG_FLUSH_INTERVAL):
+        """
+        Note: the handler has to be created on the Tk main thread, since it schedules the first flush
+
+        :param text: The Text or ScrolledText widget to log to
+        :param max_lines: The maximum number of lines the widget holds; older lines are deleted
+        :param buffer_size: The maximum number of messages that are buffered between two flushes
+        :param flush_interval: The interval (in ms) in which the buffer is flushed to the widget
+        """
         # run the regular Handler __init__
         logging.Handler.__init__(self)
         # Store a reference to the Text it will log to
         self.text = text
+        self.max_lines = max_lines
+        self.flush_interval = flush_interval
+
+        self.buffer = collections.deque(maxlen=buffer_size)
+        self.buffer_lock = threading.Lock()
+        self.dropped = 0
+
+        self.text.after(self.flush_interval, self.flush_to_widget)
 
     def emit(self, record):
         """
@@ -29,11 +52,37 @@ class Text_Handler(logging.Handler):
         :return: None
         """
         msg = self.format(record)
-        def append():
+        with self.buffer_lock:
+            if len(self.buffer) == self.buffer.maxlen:
+                self.dropped += 1
+            self.buffer.append(msg)
+
+    def flush_to_widget(self):
+        """
+        Method to write the buffered messages to the widget; runs on the Tk main thread and reschedules itself
+
+        :return: None
+        """
+        with self.buffer_lock:
+            messages = list(self.buffer)
+            self.buffer.clear()
+            dropped = self.dropped
+            self.dropped = 0
+
+        if messages:
+            if dropped:
+                messages.insert(0, "... %d log messages dropped ..." % dropped)
+
             self.text.configure(state='normal')
-            self.text.insert(tkinter.END, msg + '\n')
+            self.text.insert(tkinter.END, '\n'.join(messages) + '\n')
+
+            # Trim the widget to the maximum number of lines
+            num_lines = int(self.text.index('end-1c').split('.')[0])
+            if num_lines > self.max_lines:
+                self.text.delete('1.0', '%d.0' % (num_lines - self.max_lines + 1))
+
             self.text.configure(state='disabled')
             # Autoscroll to the bottom
             self.text.yview(tkinter.END)
-        # This is necessary because we can't modify the Text from other threads
-        self.text.after(0, append)
\ No newline at end of file
+
+        self.text.after(self.flush_interval, self.flush_to_widget)
@@ -0,0 +1,156 @@
+"""
+Rational approximation of frequency responses by vector fitting (B. Gustavsen, A. Semlyen, "Rational approximation of
+frequency domain responses by vector fitting", IEEE Trans. Power Delivery, 1999).
+
+The response is approximated by complex conjugate pole pairs plus a constant and a proportional term:
+
+    H(s) = sum_n ( r_n/(s - a_n) + conj(r_n)/(s - conj(a_n)) ) + d + s*e
+
+Every pole pair corresponds to one resonant circuit; the poles are relocated by solving a few linear least squares
+problems, so no nonlinear optimization is needed to get estimates for all resonances at once.
+"""
+
+import numpy as np
+
+import constants
+
+
+def starting_poles(f_peaks, damping = constants.VF_STARTING_POLE_DAMPING):
+    """
+    Function to create starting poles for the vector fitting at the given frequencies
+
+    :param f_peaks: The frequencies (in Hz) to put the starting poles at
+    :param damping: Relative damping of the starting poles (real part relative to the imaginary part)
+    :return: An array of complex poles (upper half-plane; the conjugate poles are implied)
+    """
+    w_peaks = 2 * np.pi * np.asarray(f_peaks, dtype=float)
+    return -damping * w_peaks + 1j * w_peaks
+
+
+def _basis(s, poles):
+    """
+    Function to calculate the real valued partial fraction basis for complex conjugate pole pairs
+
+    :param s: The (scaled) complex frequency vector
+    :param poles: The poles (upper half-plane)
+    :return: A complex matrix of shape (len(s), 2*len(poles))
+    """
+    basis = np.empty((len(s), 2 * len(poles)), dtype=complex)
+    for it, pole in enumerate(poles):
+        basis[:, 2 * it] = 1 / (s - pole) + 1 / (s - np.conj(pole))
+        basis[:, 2 * it + 1] = 1j / (s - pole) - 1j / (s - np.conj(pole))
+    return basis
+
+
+def _solve_real(matrix, rhs):
+    """
+    Function to solve a complex least squares problem for real unknowns
+
+    :param matrix: Complex system matrix
+    :param rhs: Complex right hand side
+    :return: The real solution vector
+    """
+    matrix_real = np.vstack([matrix.real, matrix.imag])
+    rhs_real = np.concatenate([rhs.real, rhs.imag])
+
+    # Normalize the columns for a better conditioned problem
+    norm = np.linalg.norm(matrix_real, axis=0)
+    norm[norm == 0] = 1
+    solution = np.linalg.lstsq(matrix_real / norm, rhs_real, rcond=None)[0]
+    return solution / norm
+
+
+def vector_fit(freq, data, poles, n_iter = constants.VF_ITERATIONS, weight = None):
+    """
+    Function to fit a rational approximation to a frequency response
+
+    :param freq: The frequency vector (in Hz)
+    :param data: The complex frequency response
+    :param poles: The starting poles (upper half-plane), e.g. from starting_poles()
+    :param n_iter: Number of pole relocation iterations
+    :param weight: (optional) Weights for the data points; if not supplied, the inverse magnitude of the data is used,
+        so the fit is done on the relative error
+    :return: Tuple (poles, residues, d, e); poles and residues of the upper half-plane
+    """
+    if weight is None:
+        weight = 1 / np.maximum(abs(data), constants.MINIMUM_PRECISION)
+
+    # Scale the frequency to improve the conditioning of the problem
+    scale = 2 * np.pi * max(freq)
+    s = 2j * np.pi * np.asarray(freq) / scale
+    poles = np.asarray(poles, dtype=complex) / scale
+
+    for it in range(n_iter):
+        if not len(poles):
+            break
+
+        n_cols = 2 * len(poles)
+        basis = _basis(s, poles)
+
+        # Unknowns: residues of H*sigma, d, e and the residues of sigma (sigma = 1 + sum of partial fractions)
+        matrix = np.hstack([basis, np.ones((len(s), 1)), s[:, np.newaxis], -data[:, np.newaxis] * basis])
+        solution = _solve_real(matrix * weight[:, np.newaxis], data * weight)
+        c_sigma = solution[n_cols + 2:]
+
+        # The zeros of sigma are the new poles: eig(A - b*c^T) in the real representation
+        state_matrix = np.zeros((n_cols, n_cols))
+        b_vector = np.zeros(n_cols)
+        for num, pole in enumerate(poles):
+            state_matrix[2 * num:2 * num + 2, 2 * num:2 * num + 2] = [[pole.real, pole.imag], [-pole.imag, pole.real]]
+            b_vector[2 * num] = 2
+
+        new_poles = np.linalg.eigvals(state_matrix - np.outer(b_vector, c_sigma))
+
+        # Keep the complex poles only (one of each pair) and flip unstable poles into the left half-plane
+        new_poles = new_poles[new_poles.imag > 0]
+        poles = -abs(new_poles.real) + 1j * new_poles.imag
+
+    # Identification of the residues with the final poles
+    basis = _basis(s, poles)
+    matrix = np.hstack([basis, np.ones((len(s), 1)), s[:, np.newaxis]])
+    solution = _solve_real(matrix * weight[:, np.newaxis], data * weight)
+
+    residues = solution[0:2 * len(poles):2] + 1j * solution[1:2 * len(poles):2]
+    d = solution[2 * len(poles)]
+    e = solution[2 * len(poles) + 1]
+
+    return poles * scale, residues * scale, d, e / scale
+
+
+def poles_to_rlc(poles, residues, fit_type):
+    """
+    Function to map pole pairs and residues to resonant circuits.
+
+    For inductors the impedance is fit and every pole pair is a parallel RLC circuit:
+        Z = (s/C) / (s^2 + s/(RC) + 1/(LC))
+    For capacitors the admittance is fit and every pole pair is a serial RLC circuit:
+        Y = (s/L) / (s^2 + s*R/L + 1/(LC))
+
+    :param poles: The poles (upper half-plane)
+    :param residues: The corresponding residues
+    :param fit_type: The type of DUT (coil or capacitor)
+    :return: Tuple of arrays (f_res, R, L, C); circuits that can not be realized (negative elements) are NaN
+    """
+    poles = np.asarray(poles)
+    residues = np.asarray(residues)
+
+    f_res = abs(poles) / (2 * np.pi)
+    damping = -2 * poles.real
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        match fit_type:
+            case constants.El.INDUCTOR:
+                C = 1 / (2 * residues.real)
+                R = 1 / (damping * C)
+                L = 1 / (abs(poles) ** 2 * C)
+            case constants.El.CAPACITOR:
+                L = 1 / (2 * residues.real)
+                R = damping * L
+                C = 1 / (abs(poles) ** 2 * L)
+
+    invalid = np.logical_not((R > 0) & (L > 0) & (C > 0) & np.isfinite(R) & np.isfinite(L) & np.isfinite(C))
+    R = np.where(invalid, np.nan, R)
+    L = np.where(invalid, np.nan, L)
+    C = np.where(invalid, np.nan, C)
+
+    return f_res, R, L, C
@@ -0,0 +1,397 @@
+"""
+Long-lived multiprocessing pool for the fits.
+
+The pool is owned by the application and reused by all runs, so the start-up of the worker processes and the import of
+the fitter's dependencies is paid once per session. The number of workers is derived from the available cores and the
+available memory (see config.WORKER_MEMORY_ESTIMATE), capped by config.MULTIPROCESSING_COUNT. A run asks for as many
+workers as its batch of tasks can keep busy (see plan_batch()); the pool is only restarted if it has to grow, so small
+runs do not pay for starting workers they would not use.
+
+Every worker runs a single fit at a time, so its BLAS/OpenMP libraries are limited to one thread; otherwise each worker
+would start as many threads as there are cores and the workers would compete for them.
+
+The events of the workers (see events.py) are sent to the main process through a queue and dispatched to its
+subscribers there.
+
+Note: this module must not import NumPy on module level; with the 'spawn' start method, the thread limits are set by
+the worker initializer before NumPy is imported.
+"""
+
+import itertools
+import logging
+import math
+import multiprocessing as mp
+import os
+import threading
+import time
+
+import cancellation
+import config
+import constants
+import events
+
+# exponent of the run time of a higher order fit over the order of the model (see benchmarks/benchmark_scaling.py)
+TASK_COST_EXPONENT = 1.4
+
+# time (in seconds) a task may take beyond its timeout to return the results of its stopped fits; a task that takes
+# longer is considered stuck and its worker is stopped (see WorkerPool.run_batch())
+TASK_TIMEOUT_GRACE = 5.0
+
+# environment variables that limit the thread count of the BLAS/OpenMP libraries
+THREAD_LIMIT_VARIABLES = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS',
+                          'NUMEXPR_NUM_THREADS', 'NUMBA_NUM_THREADS']
+
+
+def available_cores():
+    """
+    Function to get the number of cores this process may run on
+
+    :return: The number of cores
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def available_memory():
+    """
+    Function to get the available physical memory
+
+    :return: The available memory in bytes, or None if it can not be determined
+    """
+    try:
+        import psutil
+        return psutil.virtual_memory().available
+    except ImportError:
+        pass
+
+    # Linux: the memory available for new processes, including the reclaimable page cache
+    try:
+        with open('/proc/meminfo') as file:
+            for line in file:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+
+    # free memory only; underestimates the available memory on systems with a filled page cache
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def default_pool_size():
+    """
+    Function to get the number of workers for the pool: one per available core, as many as fit into the available
+    memory, and at most config.MULTIPROCESSING_COUNT
+
+    :return: The number of workers
+    """
+    size = min(available_cores(), config.MULTIPROCESSING_COUNT)
+
+    memory = available_memory()
+    if memory is not None:
+        size = min(size, int(memory // config.WORKER_MEMORY_ESTIMATE))
+
+    return max(size, 1)
+
+
+def task_cost(order):
+    """
+    Function to estimate the relative run time of the higher order fit of a file
+
+    :param order: The order of the model of the file
+    :return: The estimated cost (arbitrary unit; 0 for a file without higher order circuits)
+    """
+    return order ** TASK_COST_EXPONENT if order > 0 else 0
+
+
+def schedule_tasks(orders):
+    """
+    Function to get the order in which the tasks of a batch are submitted to the pool: the most expensive first, so the
+    cheap ones fill the gaps at the end instead of a large task starting last
+
+    :param orders: The orders of the models of the files
+    :return: The indices of the files in the order of submission
+    """
+    return sorted(range(len(orders)), key=lambda it: -task_cost(orders[it]))
+
+
+def plan_batch(orders):
+    """
+    Function to size and shape the pool for the higher order fits of a batch of files.
+
+    The batch can not finish before its most expensive task, so more workers than the total cost divided by the cost
+    of that task do not shorten it; these are not started. If config.BAND_PARALLEL_PRE_FIT is set, the pre-fit is
+    split into tasks per band (see GUI.pre_fit_bands_batch()); if it is None, only if the files leave at least half of
+    the available workers idle and a file has more concurrent bands than there are files. The pool is sized for the
+    concurrent bands of all files then.
+
+    :param orders: The orders of the models of the files
+    :return: A tuple (number of workers, split the pre-fit into band tasks)
+    """
+    costs = [task_cost(order) for order in orders]
+    max_size = default_pool_size()
+    size = math.ceil(sum(costs) / max(costs)) if sum(costs) else 1
+
+    # the bands of a file are fit in waves of non-overlapping bands, i.e. of about half of its bands
+    band_size = max(orders, default=0) // 2
+    split_bands = config.BAND_PARALLEL_PRE_FIT
+    if split_bands is None:
+        split_bands = size * 2 <= max_size and band_size > size
+    if split_bands:
+        # the waves of all files are submitted together
+        size = max(size, band_size * len(orders))
+
+    return max(1, min(size, max_size)), split_bands
+
+
+def limit_threads():
+    """
+    Function to limit the BLAS/OpenMP libraries of the current process to one thread. The environment variables take
+    effect on libraries that are loaded afterwards; libraries that are already loaded are limited by threadpoolctl, if
+    it is installed
+
+    :return: None
+    """
+    for variable in THREAD_LIMIT_VARIABLES:
+        os.environ[variable] = '1'
+
+    try:
+        import threadpoolctl
+        threadpoolctl.threadpool_limits(1)
+    except ImportError:
+        pass
+
+
+def _init_worker(event_queue):
+    """
+    Initializer of the worker processes: limits the threads, sends the events to the main process and imports the
+    dependencies of the fitter, so the first task of a worker does not pay for them
+
+    :param event_queue: The queue the events of the worker are sent to
+    :return: None
+    """
+    limit_threads()
+    events.forward_to_queue(event_queue)
+    if config.PROFILING and config.PROFILE_DUMP_DIR is not None:
+        import profiling
+        events.subscribe(profiling.StageProfiler(config.PROFILE_DUMP_DIR, collect=False))
+    if config.MEMORY_PROFILING:
+        import memory_profiling
+        events.subscribe(memory_profiling.MemoryProfiler(config.MEMORY_TOP_ALLOCATIONS, collect=False))
+
+    import fitter
+    import kernels
+    kernels.warm_up()
+
+
+def run_task(function, task_id, timeout = None):
+    """
+    Function that runs a task on a worker. The start of the task is reported with a 'task_start' event, so the timeout
+    of the task is measured from its start, not from its submission; the fits of the task stop at the deadline (see
+    optimizer.stage_deadline()) and return the best parameters found so far
+
+    :param function: The task, a callable without arguments
+    :param task_id: The id of the task (see TaskMonitor)
+    :param timeout: (optional) The wall time limit of the task in seconds
+    :return: A tuple (result of the task, True if the task exceeded its timeout)
+    """
+    import optimizer
+
+    events.emit('task_start', task=task_id)
+    deadline = None if timeout is None else time.perf_counter() + timeout
+    optimizer.set_task_deadline(deadline)
+    try:
+        result = function()
+    finally:
+        optimizer.set_task_deadline(None)
+    return result, deadline is not None and time.perf_counter() > deadline
+
+
+class TaskMonitor:
+    """
+    Event subscriber that records the start times of the pool tasks (see run_task())
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start_times = {}
+        self._ids = itertools.count()
+
+    def __call__(self, event):
+        if event['event'] == 'task_start':
+            with self.lock:
+                self.start_times[event['task']] = event['time']
+
+    def new_id(self):
+        """
+        :return: A new task id
+        """
+        return next(self._ids)
+
+    def start_time(self, task_id):
+        """
+        :param task_id: The id of a task
+        :return: The time.time() value at the start of the task, or None if the task has not started
+        """
+        with self.lock:
+            return self.start_times.get(task_id)
+
+
+class WorkerPool:
+    """
+    The WorkerPool holds the multiprocessing pool of the application. The pool is created on first use and kept alive
+    between runs; if it has been terminated (e.g. because a run was cancelled), the next run creates a new one.
+    """
+
+    def __init__(self, processes = None, logger_instance = logging.getLogger()):
+        """
+        :param processes: (optional) The number of workers; if not supplied, default_pool_size() is used
+        :param logger_instance: A logger instance
+        """
+        self.processes = processes
+        self.logger = logger_instance
+        self.pool = None
+        self.size = 0
+        self.event_queue = None
+
+    def get(self, processes = None):
+        """
+        Method to get the pool; starts it if it is not running, and restarts it if it has less than the requested number
+        of workers. A pool with more workers is kept as it is
+
+        :param processes: (optional) The number of workers needed (see plan_batch()); if not supplied,
+            default_pool_size() is used. Ignored if the number of workers was set for the WorkerPool
+        :return: A multiprocessing pool
+        """
+        if self.processes is not None:
+            processes = self.processes
+        elif processes is None:
+            processes = default_pool_size()
+
+        if self.pool is not None and self.size < processes:
+            self.logger.info("Growing worker pool from %d to %d processes" % (self.size, processes))
+            self.close()
+
+        if self.pool is None:
+            self.event_queue = mp.Queue()
+            events.start_forwarding(self.event_queue)
+            self.pool = mp.Pool(processes, initializer=_init_worker, initargs=(self.event_queue,))
+            self.size = processes
+            self.logger.info("Started worker pool with %d processes" % processes)
+        return self.pool
+
+    def run_batch(self, tasks, timeout = None, report = None):
+        """
+        Method to run a batch of tasks on the pool and to wait for their results; returns if the run is cancelled.
+
+        The timeout of a task is measured from its start on a worker, so tasks that wait for a free worker do not use
+        it up. A task that exceeds its timeout stops its fits and returns (see run_task()); it counts as timed out and
+        its result is discarded. A task that does not return within TASK_TIMEOUT_GRACE seconds after its timeout is
+        stuck: the pool is restarted at once, and the tasks that were lost with it are submitted again.
+
+        :param tasks: A dict containing the tasks (callables without arguments) by their keys, in the order of submission
+        :param timeout: (optional) The wall time limit per task in seconds
+        :param report: (optional) A callable that is called with the number of finished tasks and the number of tasks
+        :return: A tuple (dict containing the results of the tasks that finished in time by their keys, list of the
+            keys of the tasks that timed out)
+        """
+        monitor = TaskMonitor()
+        events.subscribe(monitor)
+
+        pending = {}
+
+        def submit(key):
+            task_id = monitor.new_id()
+            pending[key] = (task_id, self.pool.apply_async(run_task, (tasks[key], task_id, timeout)))
+
+        results = {}
+        timed_out = []
+        num_done = 0
+        try:
+            for key in tasks:
+                submit(key)
+
+            while pending:
+                cancellation.check_cancelled()
+                stuck = []
+                for key, (task_id, task) in list(pending.items()):
+                    if task.ready():
+                        result, task_timed_out = task.get()
+                        del pending[key]
+                        if task_timed_out:
+                            timed_out.append(key)
+                        else:
+                            results[key] = result
+                    elif timeout is not None:
+                        start_time = monitor.start_time(task_id)
+                        if start_time is not None and time.time() > start_time + timeout + TASK_TIMEOUT_GRACE:
+                            del pending[key]
+                            stuck.append(key)
+
+                if stuck:
+                    self.logger.warning("%d task(s) stuck after their timeout of %s s; restarting the worker pool"
+                                        % (len(stuck), timeout))
+                    timed_out += stuck
+                    self.restart()
+                    # the tasks that were queued or running are lost with the old pool
+                    for key in list(pending):
+                        submit(key)
+
+                if report is not None and len(results) + len(timed_out) > num_done:
+                    num_done = len(results) + len(timed_out)
+                    report(num_done, len(tasks))
+                if pending:
+                    next(iter(pending.values()))[1].wait(constants.CANCEL_POLL_INTERVAL)
+        finally:
+            events.unsubscribe(monitor)
+
+        return results, timed_out
+
+    def terminate(self):
+        """
+        Method to stop the workers immediately; running tasks are aborted
+
+        :return: None
+        """
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+            self.size = 0
+            self._stop_forwarding()
+
+    def restart(self):
+        """
+        Method to replace the pool by a new one, e.g. to get rid of workers that are stuck in a task
+
+        :return: The new multiprocessing pool
+        """
+        size = self.size
+        self.terminate()
+        return self.get(size or None)
+
+    def close(self):
+        """
+        Method to shut down the pool after the pending tasks are done
+
+        :return: None
+        """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+            self.size = 0
+            self._stop_forwarding()
+
+    def _stop_forwarding(self):
+        """
+        Method to stop the thread that forwards the events of the workers
+
+        :return: None
+        """
+        self.event_queue.put(None)
+        self.event_queue = None